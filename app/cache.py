@@ -0,0 +1,37 @@
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+class TTLCache:
+    """簡易行程內快取：逾時自動失效，亦可由寫入路徑主動清除"""
+
+    def __init__(self, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._data: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable = None, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires, value = entry
+            if expires <= self._clock():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, value: Any, key: Hashable = None, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (self._clock() + (self.ttl if ttl is None else ttl), value)
+
+    def invalidate(self, key: Hashable = _MISSING) -> None:
+        """不指定 key 時清除全部"""
+        with self._lock:
+            if key is _MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
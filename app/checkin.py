@@ -0,0 +1,163 @@
+"""活動簽到：批次寫入、記憶體出席計數與 SSE 即時推播
+
+- bulk_check_in：一批客戶 id / Email 先解析為不重複的客戶，再以單一 INSERT ... ON CONFLICT DO UPDATE 標記出席，
+  未報名的現場來賓一併建立報名；已簽到者不會重複計算
+- AttendanceBoard：有人訂閱的活動才把報名 / 簽到數放在記憶體 (訂閱時以一個聚合查詢載入)，
+  之後只由簽到路徑累加，不輪詢資料庫。推播每 CHECKIN_PUSH_SECONDS 合併一次，
+  同一區間內的多次簽到只推送最新數字
+- 計數只包含本行程處理的簽到；多副本部署時，最後一個訂閱者離開即丟棄計數，
+  重新連線會從資料庫重新載入
+"""
+import asyncio
+import json
+from typing import Dict, Iterable, Set
+from sqlalchemy import func, or_, update, literal, literal_column, false
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import Customer, EventRegistration
+from .rollups import apply_import_deltas
+from .customer_detail import touch_customers
+
+HEARTBEAT_SECONDS = 15
+_INSERTED = literal_column("xmax = 0")  # Postgres：此列為本次新增 (現場報名) 而非更新
+
+async def bulk_check_in(db: AsyncSession, event_id: int, customer_ids: Iterable[int] = (), emails: Iterable[str] = (),
+                        register_walk_ins: bool = True) -> dict:
+    """標記出席並回傳 {checked_in, walk_ins, skipped}；需由呼叫端 commit
+
+    id 與 Email 先解析成不重複的客戶 (同一人以 id 和 Email 各傳一次只算一人)，
+    skipped = 找到但未標記的客戶數 + 找不到客戶的 id / Email 數
+    """
+    ids = list(dict.fromkeys(customer_ids))
+    mails = list(dict.fromkeys(e.strip() for e in emails if e and e.strip()))
+    found = (await db.execute(select(Customer.id, Customer.email).where(or_(Customer.id.in_(ids), Customer.email.in_(mails))))).all()
+    targets = {r.id for r in found}
+    known = {r.email for r in found}
+    unknown = sum(i not in targets for i in ids) + sum(m not in known for m in mails)
+    if not targets:
+        return {"checked_in": 0, "walk_ins": 0, "skipped": unknown}
+
+    if register_walk_ins:
+        stmt = insert(EventRegistration).from_select(
+            ["customer_id", "event_id", "attended"],
+            select(Customer.id, literal(event_id), literal(True)).where(Customer.id.in_(targets)),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[EventRegistration.customer_id, EventRegistration.event_id],
+            set_={"attended": True},
+            where=EventRegistration.attended.is_not(True),
+        ).returning(EventRegistration.customer_id, _INSERTED.label("inserted"))
+    else:
+        stmt = (
+            update(EventRegistration)
+            .where(EventRegistration.event_id == event_id, EventRegistration.attended.is_not(True),
+                   EventRegistration.customer_id.in_(targets))
+            .values(attended=True)
+            .returning(EventRegistration.customer_id, false().label("inserted"))
+        )
+    rows = (await db.execute(stmt)).all()
+
+    walk_ins = [(r.customer_id, event_id) for r in rows if r.inserted]
+    await apply_import_deltas(db, [], walk_ins)
+    await touch_customers(db, [r.customer_id for r in rows])
+    return {"checked_in": len(rows), "walk_ins": len(walk_ins), "skipped": len(targets) - len(rows) + unknown}
+
+async def load_attendance(db: AsyncSession, event_id: int) -> dict:
+    row = (await db.execute(
+        select(func.count(), func.count().filter(EventRegistration.attended.is_(True)))
+        .where(EventRegistration.event_id == event_id)
+    )).one()
+    return {"registrations": row[0], "checked_in": row[1]}
+
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+class AttendanceBoard:
+    def __init__(self, interval: float = settings.CHECKIN_PUSH_SECONDS):
+        self.interval = interval
+        self._counts: Dict[int, dict] = {}
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._dirty: set = set()
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def _payload(self, event_id: int) -> dict:
+        c = self._counts[event_id]
+        rate = round(c["checked_in"] / c["registrations"] * 100, 2) if c["registrations"] else 0
+        return {"event_id": event_id, **c, "attendance_rate": rate}
+
+    async def snapshot(self, event_id: int) -> dict:
+        if event_id not in self._counts:
+            async with AsyncSessionLocal() as db:
+                counts = await load_attendance(db, event_id)
+            self._counts.setdefault(event_id, counts)
+        return self._payload(event_id)
+
+    def apply(self, event_id: int, checked_in: int = 0, registrations: int = 0):
+        """簽到 commit 後呼叫；沒有訂閱者的活動不保留計數"""
+        counts = self._counts.get(event_id)
+        if counts is None or not (checked_in or registrations):
+            return
+        counts["checked_in"] += checked_in
+        counts["registrations"] += registrations
+        self._dirty.add(event_id)
+        self._wake.set()
+
+    def _publish(self, event_id: int):
+        if event_id not in self._counts:
+            return
+        payload = self._payload(event_id)
+        for queue in self._subscribers.get(event_id, ()):
+            # 每個訂閱者只保留最新一筆，慢的連線不會累積訊息
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(payload)
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            await asyncio.sleep(self.interval)  # 合併這段時間內的所有簽到
+            self._wake.clear()
+            dirty, self._dirty = self._dirty, set()
+            for event_id in dirty:
+                self._publish(event_id)
+
+    async def stream(self, event_id: int):
+        """SSE 產生器：先送目前數字，之後推送合併後的更新，閒置時送 heartbeat"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(event_id, set()).add(queue)
+        self.start()
+        try:
+            yield _sse(await self.snapshot(event_id))
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield _sse(payload)
+        finally:
+            subscribers = self._subscribers.get(event_id)
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[event_id]
+                self._counts.pop(event_id, None)
+                self._dirty.discard(event_id)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+attendance_board = AttendanceBoard()
@@ -6,6 +6,21 @@ import os
 class Settings(BaseSettings):
     # 資料庫連線網址
     DATABASE_URL: str = ""
+    # 唯讀資料庫 (例如 replica)；留空時讀取也走主資料庫
+    DATABASE_READ_URL: Optional[str] = None
+
+    # 連線池
+    DB_POOL_SIZE: int = 10             # 常駐連線數
+    DB_MAX_OVERFLOW: int = 10          # 尖峰時可額外建立的連線數
+    DB_POOL_TIMEOUT: float = 30        # 等待可用連線的秒數
+    DB_POOL_RECYCLE: int = 1800        # 連線使用超過此秒數即重建 (避開防火牆 / proxy 閒置斷線)
+    DB_POOL_PRE_PING: bool = True      # 取用前先檢查連線是否仍有效
+    DB_STATEMENT_CACHE_SIZE: int = 100 # asyncpg prepared statement 快取；經 pgbouncer transaction mode 時設為 0
+    DB_READ_POOL_SIZE: int = 5         # 唯讀資料庫連線池
+    DB_READ_MAX_OVERFLOW: int = 10
+    READ_FALLBACK_SECONDS: int = 30    # 唯讀資料庫無法連線時，改用主資料庫的秒數
+    # 啟動時自動建表 / 套用 migration；多副本部署請關閉，改在部署前執行 python -m app.migrations
+    AUTO_MIGRATE: bool = True
     
     POSTGRES_USER: Optional[str] = None
     POSTGRES_PASSWORD: Optional[str] = None
@@ -15,9 +30,73 @@ class Settings(BaseSettings):
     GOOGLE_CLIENT_ID: Optional[str] = None
     GOOGLE_CLIENT_SECRET: Optional[str] = Field(None, validation_alias="GOOGLE_CLIENT_SERECT")
     
+    # Gmail API 位址 (留空使用 Google 正式環境；測試時可指向本機假伺服器)
+    GMAIL_API_ENDPOINT: Optional[str] = None
+
     # 強制優先讀取系統環境變數中的 BASE_URL，若無則預設 localhost
     BASE_URL: str = Field("http://localhost:8080", validation_alias="BASE_URL")
 
+    # Dashboard 統計快取秒數 (寫入路徑會主動失效)
+    STATS_CACHE_TTL: int = 30
+
+    # 郵件發送引擎
+    MAIL_CONCURRENCY: int = 4          # 同時寄信的 worker 數
+    MAIL_RATE_PER_SEC: float = 2.5     # Gmail messages.send 每使用者配額 (250 units/s ÷ 100 units)
+    MAIL_RATE_BURST: int = 5           # token bucket 容量
+    MAIL_MAX_RETRIES: int = 5          # 429/5xx 重試次數
+    MAIL_WRITE_BATCH: int = 50         # 每累積幾筆結果寫回資料庫
+    MAIL_SEND_BATCH: int = 10          # 每次 Gmail batch 請求合併的封數 (1 = 逐封寄送)
+
+    # 發送佇列 (outbox)
+    OUTBOX_CLAIM_BATCH: int = 100      # 每次認領的收件人數上限 (實際依目前發送速率縮小，見 DeliveryEngine.claim_size)
+    OUTBOX_LEASE_SECONDS: int = 300    # 租約秒數，逾時未完成即可被其他 worker 重新認領
+    OUTBOX_MAX_ATTEMPTS: int = 5       # 同一收件人最多被認領幾次 (避免反覆崩潰的毒訊息)
+
+    # 排程：活動以一次性任務準時觸發，巡檢只負責補漏與接續中斷的發送
+    RUN_SCHEDULER: bool = True         # API 行程是否參與排程 leader 競選並發送；另外執行 worker.py 時設為 False
+    SCHEDULER_LOCK_ID: int = 7_420_001 # 選 leader 用的 Postgres advisory lock id
+    LEADER_RETRY_SECONDS: float = 10   # 非 leader 重試取得 lock / leader heartbeat 的間隔
+    SCHEDULER_SWEEP_SECONDS: int = 300 # 巡檢間隔
+    DELIVERY_POLL_SECONDS: float = 15  # 每個 worker 查詢發送中活動的間隔 (本行程的 leader 轉換活動時立即喚醒)
+    CAMPAIGN_CONCURRENCY: int = 4      # 同時發送的活動數
+
+    # 開信追蹤寫回緩衝
+    TRACKING_FLUSH_SECONDS: float = 2.0   # 定期寫回間隔
+    TRACKING_BUFFER_MAX: int = 100_000    # 緩衝上限 (筆)，滿了立即寫回
+
+    # 活動簽到
+    CHECKIN_BATCH_MAX: int = 5000         # 每次批次簽到的筆數上限
+    CHECKIN_PUSH_SECONDS: float = 0.5     # 即時出席數的推播合併間隔
+
+    # --- 批次匯入 ---
+    IMPORT_CHUNK_SIZE: int = 1000         # 每個 chunk 的列數 (一次交易)
+
+    # --- 重複客戶偵測 ---
+    DEDUP_MIN_SCORE: float = 0.5          # 相似度分數 (0~1) 達此值才列為建議
+    DEDUP_MAX_BLOCK: int = 200            # 同一 blocking key 超過此人數視為不具鑑別力 (例如大公司的常見姓氏)，略過
+    DEDUP_MAX_SUGGESTIONS: int = 100_000  # 每次掃描保留的建議數 (依分數)
+    DEDUP_MERGE_MAX: int = 1000           # 每次合併請求的客戶數上限
+    DEDUP_SCAN_HOUR: int = 19             # leader 每日自動掃描的時間 (UTC 時，19 = 台灣凌晨 3 點)；-1 停用
+
+    # --- 互動紀錄批次寫入 ---
+    INTERACTION_INGEST_CHUNK: int = 5000  # 每次 COPY / INSERT 的筆數
+    INTERACTION_COPY: bool = True         # asyncpg 時以 COPY 寫入 (經不支援 COPY 的 proxy 時關閉)
+    INTERACTION_PARTITION_MONTHS: int = 3 # 預先建立的未來月分區數；created_at 不得晚於最後一個預建分區
+    INTERACTION_MAX_AGE_DAYS: int = 3650  # created_at 可回溯的最長天數
+
+    # --- 串流匯出 ---
+    EXPORT_BATCH_SIZE: int = 2000         # server-side cursor 每次取回的列數
+
+    # --- 監控 ---
+    SLOW_QUERY_MS: float = 200            # 超過此時間的 SQL 記錄為慢查詢
+    SERVER_TIMING: bool = False           # 允許請求以 X-Server-Timing: 1 取得 Server-Timing 標頭
+
+    # --- 回應壓縮 / 靜態檔 ---
+    GZIP_MIN_SIZE: int = 1024             # 小於此大小的回應不壓縮 (例如追蹤像素)
+    GZIP_LEVEL: int = 6                   # 動態回應的 gzip 壓縮等級 (靜態檔一律預先以最高等級壓縮)
+    STATIC_MAX_AGE: int = 3600            # index.html 以外靜態檔的快取秒數
+    FAST_JSON: bool = False               # 列表端點略過 response_model 驗證，直接以 orjson 輸出
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 # 手動檢查環境變數以確保 Zeabur 的變數有被系統抓到
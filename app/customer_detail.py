@@ -0,0 +1,107 @@
+"""客戶詳情：固定大小的表頭 + 分頁時間軸，並以 updated_at 支援條件式 GET
+
+互動 / 報名 / 課程異動時需呼叫 touch_customers 更新 updated_at，
+否則快取中的詳情 (304) 會看不到新資料。
+"""
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterable, Optional
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from .models import Customer, Course, Event, EventRegistration, Interaction, customer_courses
+from .pagination import decode_cursor, after, page_of
+
+HEADER_COURSE_LIMIT = 20
+
+async def touch_customers(db: AsyncSession, customer_ids: Iterable[int]):
+    ids = list(set(customer_ids))
+    if ids:
+        await db.execute(update(Customer).where(Customer.id.in_(ids)).values(updated_at=func.now()))
+
+# --- 條件式 GET ---
+
+async def customer_version(db: AsyncSession, customer_id: int) -> datetime:
+    """只讀客戶本身一列；不存在時回 404"""
+    row = (await db.execute(select(Customer.updated_at, Customer.created_at).where(Customer.id == customer_id))).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="找不到客戶")
+    version = row.updated_at or row.created_at or datetime.fromtimestamp(0, timezone.utc)
+    return version if version.tzinfo else version.replace(tzinfo=timezone.utc)
+
+def _etag(customer_id: int, version: datetime) -> str:
+    return f'W/"c{customer_id}-{int(version.timestamp() * 1_000_000)}"'
+
+def not_modified(request: Request, response: Response, customer_id: int, version: datetime) -> Optional[Response]:
+    """設定 ETag / Last-Modified；用戶端快取仍有效時回傳 304 Response"""
+    headers = {
+        "ETag": _etag(customer_id, version),
+        "Last-Modified": format_datetime(version.astimezone(timezone.utc), usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match 優先於 If-Modified-Since (RFC 9110)
+        tags = {t.strip() for t in if_none_match.split(",")}
+        if "*" in tags or headers["ETag"] in tags or headers["ETag"][2:] in tags:
+            return Response(status_code=304, headers=headers)
+        return None
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return None
+        if since.tzinfo and version.replace(microsecond=0) <= since:
+            return Response(status_code=304, headers=headers)
+    return None
+
+# --- 表頭與時間軸 ---
+
+async def read_header(db: AsyncSession, customer_id: int) -> dict:
+    customer = (await db.execute(select(Customer).where(Customer.id == customer_id))).scalars().first()
+    interactions = (await db.execute(select(func.count()).select_from(Interaction).where(Interaction.customer_id == customer_id))).scalar()
+    registrations = (await db.execute(select(func.count()).select_from(EventRegistration).where(EventRegistration.customer_id == customer_id))).scalar()
+    courses = (await db.execute(
+        select(Course.id, Course.name, Course.price)
+        .join(customer_courses, customer_courses.c.course_id == Course.id)
+        .where(customer_courses.c.customer_id == customer_id)
+        .order_by(Course.id)
+        .limit(HEADER_COURSE_LIMIT)
+    )).all()
+    return {
+        "id": customer.id, "name": customer.name, "email": customer.email, "phone": customer.phone,
+        "company": customer.company, "created_at": customer.created_at, "updated_at": customer.updated_at,
+        "interaction_count": interactions, "registration_count": registrations,
+        "courses": [dict(c._mapping) for c in courses],
+    }
+
+async def interactions_page(db: AsyncSession, customer_id: int, limit: int, cursor: Optional[str]) -> dict:
+    """依 (created_at, id) 由新到舊，使用 (customer_id, created_at, id) 索引"""
+    query = (
+        select(Interaction.id, Interaction.type, Interaction.notes, Interaction.created_at)
+        .where(Interaction.customer_id == customer_id)
+        .order_by(Interaction.created_at.desc(), Interaction.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(after((Interaction.created_at, Interaction.id), decode_cursor(cursor, datetime, int)))
+    rows, next_cursor = page_of((await db.execute(query)).all(), limit, key=lambda r: (r.created_at, r.id))
+    return {"items": [dict(r._mapping) for r in rows], "next_cursor": next_cursor}
+
+async def registrations_page(db: AsyncSession, customer_id: int, limit: int, cursor: Optional[str]) -> dict:
+    """依 (registered_at, event_id) 由新到舊，使用 (customer_id, registered_at, event_id) 索引"""
+    query = (
+        select(EventRegistration.event_id, Event.name, Event.date, EventRegistration.attended, EventRegistration.registered_at)
+        .join(Event, Event.id == EventRegistration.event_id)
+        .where(EventRegistration.customer_id == customer_id)
+        .order_by(EventRegistration.registered_at.desc(), EventRegistration.event_id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(after((EventRegistration.registered_at, EventRegistration.event_id), decode_cursor(cursor, datetime, int)))
+    rows, next_cursor = page_of((await db.execute(query)).all(), limit, key=lambda r: (r.registered_at, r.event_id))
+    return {"items": [dict(r._mapping) for r in rows], "next_cursor": next_cursor}
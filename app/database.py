@@ -1,10 +1,36 @@
+import time
+from contextlib import asynccontextmanager
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
 from .config import settings
 
-engine = create_async_engine(settings.DATABASE_URL, echo=False)
+def _engine_options(url: str, pool_size: int, max_overflow: int) -> dict:
+    options = {"echo": False, "pool_pre_ping": settings.DB_POOL_PRE_PING, "pool_recycle": settings.DB_POOL_RECYCLE}
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        return options
+    options.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=settings.DB_POOL_TIMEOUT)
+    if parsed.get_driver_name() == "asyncpg":
+        # 經 pgbouncer (transaction mode) 連線時需設為 0
+        options["connect_args"] = {
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        }
+    return options
+
+engine = create_async_engine(settings.DATABASE_URL, **_engine_options(settings.DATABASE_URL, settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW))
 AsyncSessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
+# 唯讀 engine：Dashboard、列表、匯出等大量讀取的查詢使用，不與寫入路徑搶連線。
+# 未設定 DATABASE_READ_URL 時直接使用主資料庫
+if settings.DATABASE_READ_URL:
+    read_engine = create_async_engine(settings.DATABASE_READ_URL, **_engine_options(settings.DATABASE_READ_URL, settings.DB_READ_POOL_SIZE, settings.DB_READ_MAX_OVERFLOW))
+else:
+    read_engine = engine
+ReadSessionLocal = async_sessionmaker(bind=read_engine, class_=AsyncSession, expire_on_commit=False)
+
 class Base(DeclarativeBase):
     pass
 
@@ -12,3 +38,29 @@ async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
         await session.commit()
+
+_read_down_until = 0.0
+
+@asynccontextmanager
+async def read_session():
+    """唯讀 session；唯讀資料庫無法連線時改用主資料庫，並在 READ_FALLBACK_SECONDS 內不再嘗試"""
+    global _read_down_until
+    if read_engine is not engine and time.monotonic() >= _read_down_until:
+        session = ReadSessionLocal()
+        try:
+            await session.connection()
+        except (OSError, DBAPIError) as e:
+            await session.close()
+            _read_down_until = time.monotonic() + settings.READ_FALLBACK_SECONDS
+            print(f"⚠️ [DB] 唯讀資料庫無法連線，{settings.READ_FALLBACK_SECONDS} 秒內改用主資料庫: {e}")
+        else:
+            async with session:
+                yield session
+            return
+    async with AsyncSessionLocal() as session:
+        yield session
+
+async def get_read_db():
+    """大量讀取端點使用的 dependency；不 commit (不應有寫入)"""
+    async with read_session() as session:
+        yield session
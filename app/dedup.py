@@ -0,0 +1,462 @@
+"""重複客戶偵測與合併
+
+Email 是唯一鍵，同一人以不同 Email 匯入就會成為多位客戶。兩兩比較是 O(n²)，
+因此先以 blocking key 分組，只比較同一組內的客戶：
+
+- p: 電話 (去掉格式、分機與國碼後的末 9 碼)
+- n: 姓名 (正規化後的 token，不分順序)
+- e: Email 帳號 (@ 之前，去掉 . 與 +tag)
+- c: 公司 + 姓名中的任一 token (姓名有錯字時仍能配對)
+
+超過 DEDUP_MAX_BLOCK 人的組 (例如大公司的常見姓氏) 不具鑑別力，直接略過。
+候選配對以 numpy 向量化計分：姓名與 Email 各壓成 64 位元的 n-gram 特徵，
+以 popcount 估計 Jaccard 相似度。numpy 為選用套件，未安裝時以純 Python 計分 (結果相同，較慢)。
+
+    python -m app.dedup scan          # 重新掃描並寫入 duplicate_suggestions
+
+merge_customers 以固定幾個集合式語句把互動、課程、報名與行銷收件人改指到保留的客戶，
+再刪除其餘客戶；語句數與合併的人數無關。
+"""
+import asyncio
+import re
+import sys
+import time
+import unicodedata
+import zlib
+from array import array
+from collections import defaultdict
+from datetime import datetime, timezone
+from itertools import combinations
+from typing import Dict, List, Optional
+from sqlalchemy import case, delete, func, or_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+from .config import settings
+from .customer_detail import touch_customers
+from .database import AsyncSessionLocal, read_session
+from .models import Customer, CampaignRecipient, DuplicateSuggestion, EventRegistration, Interaction, customer_courses
+from .pagination import decode_cursor, after, page_of
+from .rollups import apply_customer_deltas
+
+try:
+    import numpy as np
+    if not hasattr(np, "bitwise_count"):  # numpy < 2.0 沒有 popcount
+        np = None
+except ImportError:  # 選用套件
+    np = None
+
+# 分數 = 各特徵加權和 (0~1)；兩邊都有電話但不同時扣分
+W_PHONE, W_NAME, W_EMAIL, W_COMPANY = 0.35, 0.35, 0.15, 0.15
+PHONE_CONFLICT = 0.15
+NAME_MATCH, EMAIL_MATCH = 0.8, 0.6  # 相似度達此值才列入 reasons
+REASONS = ((1, "phone"), (2, "name"), (4, "email"), (8, "company"))
+
+PAIR_CHUNK = 2_000_000  # numpy 每次計分的配對數上限 (控制記憶體)
+WRITE_BATCH = 5000
+
+class MergeError(ValueError):
+    pass
+
+# --- 正規化 ---
+
+_NON_WORD = re.compile(r"[\W_]+")
+_CJK = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+_EXTENSION = re.compile(r"#|x|ext|轉|分機")
+_COMPANY_SUFFIX = re.compile(r"(?:股份有限公司|有限公司|公司|企業社|工作室|inc|ltd|llc|corp|corporation|co)+$")
+
+def _fold(value) -> str:
+    return unicodedata.normalize("NFKC", value or "").casefold().strip()
+
+def normalize_phone(phone) -> Optional[str]:
+    """末 9 碼 (0912-345-678、+886 912 345 678 皆為 912345678)；位數不足視為無效"""
+    digits = re.sub(r"\D", "", _EXTENSION.split(_fold(phone))[0])
+    if digits.startswith("886") and len(digits) >= 11:
+        digits = digits[3:]
+    digits = digits.lstrip("0")
+    return digits[-9:] if len(digits) >= 8 else None
+
+def normalize_company(company) -> str:
+    compact = _NON_WORD.sub("", _fold(company))
+    return _COMPANY_SUFFIX.sub("", compact) or compact
+
+def name_tokens(name) -> List[str]:
+    """英文以空白 / 標點分詞；中文 (不以空白分隔) 拆成單字"""
+    tokens = []
+    for part in _NON_WORD.split(_fold(name)):
+        if _CJK.search(part):
+            tokens.extend(part)
+        elif part:
+            tokens.append(part)
+    return tokens
+
+def email_account(email) -> str:
+    local = _fold(email).split("@", 1)[0].split("+", 1)[0]
+    return _NON_WORD.sub("", local)
+
+def _ngram_bits(text: str, n: int) -> int:
+    bits = 0
+    for i in range(len(text) - n + 1):
+        bits |= 1 << (zlib.crc32(text[i:i + n].encode()) & 63)
+    return bits
+
+def name_key(name) -> str:
+    """token 排序後的姓名 ("Smith John" 與 "john smith" 相同)"""
+    return " ".join(sorted(t for t in _NON_WORD.split(_fold(name)) if t))
+
+def name_signature(name) -> int:
+    text = name_key(name).replace(" ", "")
+    return _ngram_bits(text, 1) | _ngram_bits(f"^{text}$", 2) if text else 0
+
+def email_signature(account: str) -> int:
+    return _ngram_bits(f"^{account}$", 3) if account else 0
+
+# --- 特徵與 blocking index ---
+
+class Features:
+    """每位客戶一組緊湊的特徵 (array 模組)，加上 (blocking key hash, 客戶索引) 清單
+
+    客戶依 id 遞增加入，因此索引順序即 id 順序
+    """
+    def __init__(self):
+        self.ids = array("q")
+        self.phones = array("q")     # 0 = 無
+        self.companies = array("q")  # 公司 hash，0 = 無
+        self.names = array("Q")
+        self.emails = array("Q")
+        self.block_keys = array("q")
+        self.block_members = array("q")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, customer_id: int, name, email, phone, company):
+        i = len(self.ids)
+        p, c, account = normalize_phone(phone), normalize_company(company), email_account(email)
+        self.ids.append(customer_id)
+        self.phones.append(int(p) if p else 0)
+        self.companies.append((hash(c) or 1) if c else 0)
+        self.names.append(name_signature(name))
+        self.emails.append(email_signature(account))
+
+        keys = set()
+        if p:
+            keys.add("p:" + p)
+        full = name_key(name)
+        if full:
+            keys.add("n:" + full)
+        if len(account) >= 4:
+            keys.add("e:" + account)
+        if c:
+            keys.update(f"c:{c}:{t}" for t in name_tokens(name) if len(t) >= 2 or _CJK.match(t))
+        for key in keys:
+            self.block_keys.append(hash(key))
+            self.block_members.append(i)
+
+def _combine(phone, conflict, name, email, company):
+    """phone / conflict / company 為布林 (電話相同 / 電話不同 / 公司相同)，name / email 為相似度；純量與 numpy 陣列皆適用"""
+    score = W_PHONE * phone - PHONE_CONFLICT * conflict + W_NAME * name + W_EMAIL * email + W_COMPANY * company
+    reasons = phone * 1 | (name >= NAME_MATCH) * 2 | (email >= EMAIL_MATCH) * 4 | company * 8
+    return score, reasons
+
+def _reason_text(bits: int) -> str:
+    return ",".join(label for bit, label in REASONS if bits & bit)
+
+# --- 計分 (numpy) ---
+
+def _jaccard_np(x, y):
+    inter = np.bitwise_count(x & y).astype(np.float64)
+    union = np.bitwise_count(x | y).astype(np.float64)
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+def _find_numpy(f: Features, min_score: float, max_block: int, limit: int):
+    phones, companies = np.frombuffer(f.phones, np.int64), np.frombuffer(f.companies, np.int64)
+    names, emails = np.frombuffer(f.names, np.uint64), np.frombuffer(f.emails, np.uint64)
+    keys, members = np.frombuffer(f.block_keys, np.int64), np.frombuffer(f.block_members, np.int64)
+
+    order = np.argsort(keys, kind="stable")  # 同一組內維持索引 (id) 遞增
+    keys, members = keys[order], members[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, np.int64)
+    sizes = np.diff(np.r_[starts, len(keys)])
+    stats = {"blocks": int((sizes >= 2).sum()), "skipped_blocks": int((sizes > max_block).sum()), "candidate_pairs": 0}
+
+    found = []
+    # 相同大小的組一起展開成配對：組起點 + 上三角索引
+    for size in np.unique(sizes[(sizes >= 2) & (sizes <= max_block)]):
+        i, j = np.triu_indices(int(size), 1)
+        group = starts[sizes == size]
+        step = max(1, PAIR_CHUNK // len(i))
+        for k in range(0, len(group), step):
+            s = group[k:k + step, None]
+            a, b = members[s + i].ravel(), members[s + j].ravel()
+            stats["candidate_pairs"] += len(a)
+            pa, pb = phones[a], phones[b]
+            score, reasons = _combine(
+                (pa == pb) & (pa != 0),
+                (pa != pb) & (pa != 0) & (pb != 0),
+                _jaccard_np(names[a], names[b]),
+                _jaccard_np(emails[a], emails[b]),
+                (companies[a] == companies[b]) & (companies[a] != 0),
+            )
+            keep = score >= min_score
+            found.append((a[keep], b[keep], score[keep], reasons[keep]))
+    if not found:
+        return stats, []
+
+    a, b, score, reasons = (np.concatenate(cols) for cols in zip(*found))
+    # 同一配對可能出現在多個組 (例如電話與姓名皆相同)，分數相同，保留一筆
+    _, first = np.unique(a * len(f) + b, return_index=True)
+    top = first[np.argsort(-score[first], kind="stable")][:limit]
+    ids = np.frombuffer(f.ids, np.int64)
+    return stats, list(zip(ids[a[top]].tolist(), ids[b[top]].tolist(), np.round(score[top], 4).tolist(), reasons[top].tolist()))
+
+# --- 計分 (純 Python) ---
+
+def _jaccard(x: int, y: int) -> float:
+    union = (x | y).bit_count()
+    return (x & y).bit_count() / union if union else 0.0
+
+def _find_python(f: Features, min_score: float, max_block: int, limit: int):
+    blocks = defaultdict(list)
+    for key, i in zip(f.block_keys, f.block_members):
+        blocks[key].append(i)
+    stats = {"blocks": sum(1 for m in blocks.values() if len(m) >= 2), "skipped_blocks": sum(1 for m in blocks.values() if len(m) > max_block), "candidate_pairs": 0}
+
+    found = {}
+    for members in blocks.values():
+        if not 2 <= len(members) <= max_block:
+            continue
+        for a, b in combinations(members, 2):
+            stats["candidate_pairs"] += 1
+            if (a, b) in found:
+                continue
+            pa, pb = f.phones[a], f.phones[b]
+            score, reasons = _combine(
+                pa == pb != 0,
+                pa != pb and pa != 0 and pb != 0,
+                _jaccard(f.names[a], f.names[b]),
+                _jaccard(f.emails[a], f.emails[b]),
+                f.companies[a] == f.companies[b] != 0,
+            )
+            if score >= min_score:
+                found[(a, b)] = (score, reasons)
+    ranked = sorted(found.items(), key=lambda item: -item[1][0])[:limit]
+    return stats, [(f.ids[a], f.ids[b], round(score, 4), reasons) for (a, b), (score, reasons) in ranked]
+
+def find_duplicates(f: Features, min_score: float = None, max_block: int = None, limit: int = None):
+    """回傳 (統計, [(customer_id, duplicate_id, score, reason bits)])，依分數由高到低"""
+    min_score = settings.DEDUP_MIN_SCORE if min_score is None else min_score
+    max_block = max_block or settings.DEDUP_MAX_BLOCK
+    limit = limit or settings.DEDUP_MAX_SUGGESTIONS
+    find = _find_numpy if np is not None else _find_python
+    stats, pairs = find(f, min_score, max_block, limit)
+    stats["engine"] = "numpy" if np is not None else "python"
+    return stats, pairs
+
+# --- 掃描 ---
+
+async def load_features(batch_size: int = None) -> Features:
+    f = Features()
+    query = select(Customer.id, Customer.name, Customer.email, Customer.phone, Customer.company).order_by(Customer.id)
+    async with read_session() as db:
+        result = await db.stream(query.execution_options(yield_per=batch_size or settings.EXPORT_BATCH_SIZE))
+        async for partition in result.partitions():
+            for row in partition:
+                f.add(*row)
+    return f
+
+async def store_suggestions(db: AsyncSession, pairs: list):
+    """取代未被人工排除的建議；已排除 (dismissed) 的配對保留，不會再次出現"""
+    await db.execute(delete(DuplicateSuggestion).where(DuplicateSuggestion.dismissed.is_(False)))
+    rows = [{"customer_id": a, "duplicate_id": b, "score": score, "reasons": _reason_text(bits)} for a, b, score, bits in pairs]
+    for i in range(0, len(rows), WRITE_BATCH):
+        await db.execute(insert(DuplicateSuggestion).on_conflict_do_nothing(), rows[i:i + WRITE_BATCH])
+
+async def scan_duplicates(min_score: float = None) -> dict:
+    timings = {}
+    start = time.perf_counter()
+    features = await load_features()
+    timings["load"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats, pairs = await asyncio.to_thread(find_duplicates, features, min_score)
+    timings["match"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        await store_suggestions(db, pairs)
+        await db.commit()
+    timings["store"] = time.perf_counter() - start
+
+    return {"customers": len(features), "block_keys": len(features.block_keys), **stats, "suggestions": len(pairs),
+            "seconds": {k: round(v, 2) for k, v in timings.items()}}
+
+_scan_lock = asyncio.Lock()
+_scan_task = None
+last_scan: dict = {"status": "idle"}
+
+async def run_scan():
+    """排程與 API 共用；同一行程內同時只會有一次掃描"""
+    if _scan_lock.locked():
+        return
+    async with _scan_lock:
+        last_scan.clear()
+        last_scan.update(status="running", started_at=datetime.now(timezone.utc).isoformat())
+        try:
+            stats = await scan_duplicates()
+        except Exception as e:
+            last_scan.update(status="failed", error=str(e))
+            print(f"❌ [Dedup] 掃描失敗: {e}")
+            return
+        last_scan.update(status="done", finished_at=datetime.now(timezone.utc).isoformat(), **stats)
+        print(f"🔍 [Dedup] {stats['customers']} 位客戶，候選配對 {stats['candidate_pairs']}，建議 {stats['suggestions']} 組 ({stats['engine']}, {stats['seconds']})")
+
+def start_scan() -> bool:
+    """在背景開始掃描；已在掃描中時回傳 False"""
+    global _scan_task
+    if _scan_lock.locked():
+        return False
+    _scan_task = asyncio.create_task(run_scan())
+    return True
+
+# --- 建議列表 ---
+
+async def suggestions_page(db: AsyncSession, limit: int, cursor: Optional[str], min_score: float = 0) -> dict:
+    """依 (score, customer_id, duplicate_id) 由高到低，附上兩位客戶的基本資料"""
+    s = DuplicateSuggestion
+    a, b = aliased(Customer), aliased(Customer)
+    query = (
+        select(s.customer_id, s.duplicate_id, s.score, s.reasons,
+               a.name.label("name"), a.email.label("email"), a.phone.label("phone"), a.company.label("company"), a.created_at.label("created_at"),
+               b.name.label("dup_name"), b.email.label("dup_email"), b.phone.label("dup_phone"), b.company.label("dup_company"), b.created_at.label("dup_created_at"))
+        .join(a, a.id == s.customer_id)
+        .join(b, b.id == s.duplicate_id)
+        .where(s.dismissed.is_(False), s.score >= min_score)
+        .order_by(s.score.desc(), s.customer_id.desc(), s.duplicate_id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(after((s.score, s.customer_id, s.duplicate_id), decode_cursor(cursor, float, int, int)))
+    rows, next_cursor = page_of((await db.execute(query)).all(), limit, key=lambda r: (r.score, r.customer_id, r.duplicate_id))
+    items = []
+    for r in rows:
+        m = r._mapping
+        items.append({
+            "score": r.score, "reasons": r.reasons.split(",") if r.reasons else [],
+            "customer": {"id": r.customer_id, **{k: m[k] for k in ("name", "email", "phone", "company", "created_at")}},
+            "duplicate": {"id": r.duplicate_id, **{k: m["dup_" + k] for k in ("name", "email", "phone", "company", "created_at")}},
+        })
+    return {"items": items, "next_cursor": next_cursor}
+
+async def dismiss_suggestion(db: AsyncSession, customer_id: int, duplicate_id: int) -> bool:
+    lo, hi = sorted((customer_id, duplicate_id))
+    result = await db.execute(
+        update(DuplicateSuggestion)
+        .where(DuplicateSuggestion.customer_id == lo, DuplicateSuggestion.duplicate_id == hi)
+        .values(dismissed=True)
+    )
+    return result.rowcount > 0
+
+# --- 合併 ---
+
+async def merge_customers(db: AsyncSession, groups: Dict[int, List[int]]) -> dict:
+    """groups 為 {保留的客戶 id: [併入的客戶 id, ...]}；需由呼叫端 commit
+
+    所有群組共用同一組語句：以 CASE 對照表把舊 id 改成保留的 id
+    """
+    groups = {keep: list(dict.fromkeys(olds)) for keep, olds in groups.items() if olds}
+    mapping = {old: keep for keep, olds in groups.items() for old in olds}
+    if not mapping:
+        raise MergeError("沒有要合併的客戶")
+    if len(mapping) != sum(len(olds) for olds in groups.values()) or set(mapping) & set(groups):
+        raise MergeError("同一位客戶不能同時出現在多個合併群組，或同時是保留與被併入的客戶")
+    old_ids, all_ids = list(mapping), list(groups) + list(mapping)
+
+    rows = (await db.execute(
+        select(Customer.id, Customer.name, Customer.email, Customer.phone, Customer.company)
+        .where(Customer.id.in_(all_ids)).order_by(Customer.id).with_for_update()
+    )).all()
+    by_id = {r.id: r for r in rows}
+    missing = [cid for cid in all_ids if cid not in by_id]
+    if missing:
+        raise MergeError(f"找不到客戶: {', '.join(map(str, missing[:20]))}")
+
+    await apply_customer_deltas(db, all_ids, -1)
+
+    # 保留的客戶沒有電話 / 公司時，以被併入者 (id 小者優先) 的資料補上
+    for keep, olds in groups.items():
+        fill = {}
+        for field in ("phone", "company"):
+            if not getattr(by_id[keep], field):
+                value = next((getattr(by_id[o], field) for o in sorted(olds) if getattr(by_id[o], field)), None)
+                if value:
+                    fill[field] = value
+        if fill:
+            await db.execute(update(Customer).where(Customer.id == keep).values(**fill))
+
+    moved = (await db.execute(
+        update(Interaction).where(Interaction.customer_id.in_(old_ids))
+        .values(customer_id=case(mapping, value=Interaction.customer_id))
+    )).rowcount
+
+    cc = customer_courses.c
+    await db.execute(insert(customer_courses).from_select(
+        ["customer_id", "course_id"],
+        select(case(mapping, value=cc.customer_id), cc.course_id).where(cc.customer_id.in_(old_ids)).distinct(),
+    ).on_conflict_do_nothing())
+    await db.execute(delete(customer_courses).where(cc.customer_id.in_(old_ids)))
+
+    # 同一活動的多筆報名合併為一筆：任一出席即出席，報名時間取最早
+    r = EventRegistration
+    regs = select(case(mapping, value=r.customer_id).label("customer_id"), r.event_id, r.attended, r.registered_at).where(r.customer_id.in_(old_ids)).subquery()
+    stmt = insert(EventRegistration).from_select(
+        ["customer_id", "event_id", "attended", "registered_at"],
+        select(regs.c.customer_id, regs.c.event_id, func.max(case((regs.c.attended.is_(True), 1), else_=0)) == 1, func.min(regs.c.registered_at))
+        .group_by(regs.c.customer_id, regs.c.event_id),
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[r.customer_id, r.event_id],
+        set_={
+            "attended": or_(r.attended.is_(True), stmt.excluded.attended.is_(True)),
+            "registered_at": case((stmt.excluded.registered_at < r.registered_at, stmt.excluded.registered_at), else_=r.registered_at),
+        },
+    ))
+    await db.execute(delete(EventRegistration).where(r.customer_id.in_(old_ids)))
+
+    # 同一行銷活動的多筆收件紀錄合併為一筆：已寄出 / 已開啟以任一筆為準，保留客戶已有的紀錄不會重複發送
+    cr = CampaignRecipient
+    recs = select(case(mapping, value=cr.customer_id).label("customer_id"), cr.campaign_id, cr.sent_at, cr.opened_at, cr.error,
+                  cr.claimed_by, cr.lease_expires_at, cr.attempts).where(cr.customer_id.in_(old_ids)).subquery()
+    stmt = insert(CampaignRecipient).from_select(
+        ["customer_id", "campaign_id", "sent_at", "opened_at", "error", "claimed_by", "lease_expires_at", "attempts"],
+        select(recs.c.customer_id, recs.c.campaign_id, func.min(recs.c.sent_at), func.min(recs.c.opened_at), func.min(recs.c.error),
+               func.max(recs.c.claimed_by), func.max(recs.c.lease_expires_at), func.max(recs.c.attempts))
+        .group_by(recs.c.customer_id, recs.c.campaign_id),
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[cr.campaign_id, cr.customer_id],
+        set_={"sent_at": func.coalesce(cr.sent_at, stmt.excluded.sent_at), "opened_at": func.coalesce(cr.opened_at, stmt.excluded.opened_at)},
+    ))
+    await db.execute(delete(CampaignRecipient).where(cr.customer_id.in_(old_ids)))
+
+    await db.execute(delete(DuplicateSuggestion).where(or_(DuplicateSuggestion.customer_id.in_(old_ids), DuplicateSuggestion.duplicate_id.in_(old_ids))))
+    await db.execute(insert(Interaction), [{
+        "customer_id": keep, "type": "合併",
+        "notes": "併入客戶 " + "、".join(f"#{o} {by_id[o].name} <{by_id[o].email}>" for o in olds),
+    } for keep, olds in groups.items()])
+    await db.execute(delete(Customer).where(Customer.id.in_(old_ids)))
+
+    await apply_customer_deltas(db, list(groups), 1)
+    await touch_customers(db, list(groups))
+    return {"groups": len(groups), "merged": len(old_ids), "interactions_moved": moved}
+
+async def _scan_main():
+    stats = await scan_duplicates()
+    print(f"✅ [Dedup] 掃描完成: {stats}")
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["scan"]:
+        print("用法: python -m app.dedup scan")
+        sys.exit(1)
+    asyncio.run(_scan_main())
@@ -0,0 +1,275 @@
+"""郵件發送引擎：有界 worker pool + token bucket 限速 + 429/5xx 自適應退避。
+
+阻塞的 Gmail 呼叫一律丟到 thread pool 執行，不會卡住 API 的 event loop；
+每位收件人的 sent_at / error 累積成批後一次寫回資料庫，並同時累加成效 rollup。
+帶 outbox Lease 時，每次寫回 (以及至少每 1/3 租約時間) 續期租約，只寄出仍持有租約的收件人。
+"""
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import AsyncIterable, Callable, Iterable, Optional, Union
+from sqlalchemy import update, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from .config import settings
+from .email_utils import send_raw, send_raw_batch, GmailSendError
+from .engagement import record_sends
+from .metrics import mail_sends, mail_send_latency
+from .models import CampaignRecipient
+from .outbox import Lease
+
+BACKOFF_BASE = 1.0    # 秒
+BACKOFF_MAX = 60.0
+MIN_RATE_FRACTION = 0.1  # 被節流時最低降到設定速率的 10%
+
+class TokenBucket:
+    """非同步 token bucket；throttle()/recover() 以 AIMD 方式調整速率"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, n: int = 1):
+        """取得 n 個 token；n 超過容量時先借貸，之後的請求會等待補回
+
+        檢查與扣除之間沒有 await (在 event loop 中不會被打斷)，不需要鎖；等待時不佔用任何資源，
+        醒來後以當下的速率重新計算，throttle() 降速立即生效
+        """
+        need = min(n, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= need:
+                self.tokens -= n
+                return
+            await asyncio.sleep((need - self.tokens) / self.rate)
+
+    def throttle(self):
+        """遇到 429/5xx：速率減半"""
+        self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate / 2)
+
+    def recover(self):
+        """成功寄出：速率緩慢回升"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * MIN_RATE_FRACTION)
+
+@dataclass
+class Delivery:
+    customer_id: int
+    to_email: str
+    raw: str  # 已編碼的 RFC 822 訊息 (見 templating.CampaignMessage.render_raw)
+
+@dataclass
+class DeliveryReport:
+    campaign_id: int
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """每秒寄出封數"""
+        return round(self.sent / self.elapsed, 2) if self.elapsed else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "campaign_id": self.campaign_id, "sent": self.sent, "failed": self.failed, "retries": self.retries,
+            "elapsed_sec": round(self.elapsed, 2), "sends_per_sec": self.throughput,
+        }
+
+def _backoff(attempt: int, retry_after: Optional[float] = None) -> float:
+    if retry_after:
+        return min(BACKOFF_MAX, retry_after)
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+async def _aiter(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+class DeliveryEngine:
+    """同一個 engine 共用 token bucket，確保所有活動合計不超過 Gmail 配額"""
+
+    def __init__(
+        self,
+        concurrency: int = settings.MAIL_CONCURRENCY,
+        rate: float = settings.MAIL_RATE_PER_SEC,
+        burst: int = settings.MAIL_RATE_BURST,
+        max_retries: int = settings.MAIL_MAX_RETRIES,
+        batch_size: int = settings.MAIL_WRITE_BATCH,
+        send_batch_size: int = settings.MAIL_SEND_BATCH,
+        send: Callable[[str], str] = send_raw,
+        send_batch: Callable[[list], list] = send_raw_batch,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.send_batch_size = max(1, send_batch_size)
+        self.send = send
+        self.send_batch = send_batch
+        self.reports: dict = {}
+
+    def _send_many(self, deliveries: list) -> list:
+        """在 thread pool 中執行；回傳與輸入同順序的例外 (成功為 None)"""
+        if len(deliveries) == 1:
+            try:
+                self.send(deliveries[0].raw)
+                return [None]
+            except Exception as e:
+                return [e]
+        outcomes = self.send_batch([d.raw for d in deliveries])
+        return [error for _, error in outcomes]
+
+    async def _send_chunk(self, executor, chunk: list, report: DeliveryReport) -> list:
+        """寄出一批收件人；429/5xx 的部分退避後重試，回傳每位收件人的錯誤訊息 (成功為 None)"""
+        loop = asyncio.get_running_loop()
+        errors: list = [None] * len(chunk)
+        pending = list(range(len(chunk)))
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire(len(pending))
+            start = time.perf_counter()
+            outcomes = await loop.run_in_executor(executor, self._send_many, [chunk[i] for i in pending])
+            mail_send_latency.observe(time.perf_counter() - start, mode="batch" if len(pending) > 1 else "single")
+            retry, retry_after = [], None
+            for i, error in zip(pending, outcomes):
+                if error is None:
+                    errors[i] = None
+                    mail_sends.inc(result="sent")
+                elif isinstance(error, GmailSendError) and error.retryable and attempt < self.max_retries:
+                    retry.append(i)
+                    retry_after = max(retry_after or 0, error.retry_after or 0) or None
+                    mail_sends.inc(result="retried")
+                elif isinstance(error, GmailSendError):
+                    errors[i] = str(error)
+                    mail_sends.inc(result="failed")
+                else:
+                    errors[i] = f"發生未知錯誤: {str(error)}"
+                    mail_sends.inc(result="failed")
+            if not retry:
+                self.bucket.recover()
+                break
+            self.bucket.throttle()
+            report.retries += len(retry)
+            await asyncio.sleep(_backoff(attempt, retry_after))
+            pending = retry
+        return errors
+
+    def claim_size(self, lease_seconds: float = settings.OUTBOX_LEASE_SECONDS) -> int:
+        """每次認領的筆數：以目前 (可能已被節流的) 速率約半個租約內寄得完"""
+        return max(self.send_batch_size, min(settings.OUTBOX_CLAIM_BATCH, int(self.bucket.rate * lease_seconds / 2)))
+
+    async def run(self, db: AsyncSession, campaign_id: int, deliveries: Union[Iterable[Delivery], AsyncIterable[Delivery]],
+                  lease: Optional[Lease] = None) -> DeliveryReport:
+        report = DeliveryReport(campaign_id=campaign_id)
+        self.reports[campaign_id] = report
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results: list = []
+        db_lock = asyncio.Lock()
+        done = asyncio.Event()
+        worker_id = lease.worker_id if lease else None
+
+        async def flush():
+            # AsyncSession 不可併用，寫回一律經過 db_lock
+            async with db_lock:
+                batch = results[:]
+                results.clear()
+                if batch:
+                    where = [CampaignRecipient.campaign_id == bindparam("b_campaign_id"), CampaignRecipient.customer_id == bindparam("b_customer_id")]
+                    if lease:
+                        where.append(CampaignRecipient.claimed_by == worker_id)  # 租約已被其他 worker 接手的列不覆寫
+                    stmt = (
+                        update(CampaignRecipient.__table__)
+                        .where(*where)
+                        .values(sent_at=bindparam("b_sent_at"), error=bindparam("b_error"), claimed_by=None, lease_expires_at=None)
+                    )
+                    await record_sends(db, campaign_id, [(r["b_customer_id"], r["b_sent_at"]) for r in batch if r["b_sent_at"]], worker_id)
+                    await db.execute(stmt, batch)
+                    if lease:
+                        lease.held.difference_update(r["b_customer_id"] for r in batch)
+                if lease:
+                    lost = await lease.renew(db)
+                    if lost:
+                        print(f"⚠️ [Delivery] 活動 {campaign_id} 有 {len(lost)} 位收件人的租約已逾期並被接手，不再寄出")
+                elif not batch:
+                    return
+                await db.commit()
+
+        async def renew():
+            # 速率很低 (節流、退避) 時寫回間隔可能超過租約，另外定期續期
+            while not done.is_set():
+                try:
+                    await asyncio.wait_for(done.wait(), timeout=lease.seconds / 3)
+                except asyncio.TimeoutError:
+                    try:
+                        await flush()
+                    except Exception as e:
+                        print(f"⚠️ [Delivery] 活動 {campaign_id} 租約續期失敗: {e}")
+
+        async def worker(executor):
+            while (chunk := await queue.get()) is not None:
+                if lease:
+                    chunk = [d for d in chunk if d.customer_id in lease.held]
+                    if not chunk:
+                        continue
+                    lease.sending.update(d.customer_id for d in chunk)
+                errors = await self._send_chunk(executor, chunk, report)
+                sent_at = datetime.now(timezone.utc)
+                for delivery, error in zip(chunk, errors):
+                    if error:
+                        report.failed += 1
+                    else:
+                        report.sent += 1
+                    results.append({
+                        "b_campaign_id": campaign_id, "b_customer_id": delivery.customer_id,
+                        "b_sent_at": None if error else sent_at, "b_error": error,
+                    })
+                if lease:
+                    lease.sending.difference_update(d.customer_id for d in chunk)
+                if len(results) >= self.batch_size:
+                    await flush()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="mail") as executor:
+            async def produce():
+                chunk = []
+                async for delivery in _aiter(deliveries):
+                    chunk.append(delivery)
+                    if len(chunk) >= self.send_batch_size:
+                        await queue.put(chunk)
+                        chunk = []
+                if chunk:
+                    await queue.put(chunk)
+                for _ in range(self.concurrency):
+                    await queue.put(None)
+
+            tasks = [asyncio.create_task(produce())] + [asyncio.create_task(worker(executor)) for _ in range(self.concurrency)]
+            renewer = asyncio.create_task(renew()) if lease else None
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for t in tasks:
+                    t.cancel()
+                done.set()
+                if renewer:
+                    await asyncio.gather(renewer, return_exceptions=True)
+                await flush()
+                # 中斷時 (例如停止行程) 歸還還沒寄出的收件人；已交給 Gmail 的保留租約等逾期
+                if lease and await lease.release(db):
+                    await db.commit()
+                report.elapsed = time.monotonic() - report.started_at
+        return report
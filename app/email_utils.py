@@ -1,20 +1,34 @@
 import os.path
 import base64
 import json
+import threading
+from datetime import datetime, timedelta, timezone
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 from .config import settings
 
+# Google client 套件 (googleapiclient / google.auth / httplib2) 載入很慢，
+# 只在第一次寄信或授權時才 import；不寄信的 API 節點完全不會載入
+
 SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
 TOKEN_FILE = "token.json"
 CREDENTIALS_FILE = "credentials.json"
 
-def get_gmail_service():
+REFRESH_AHEAD = timedelta(minutes=5)  # 到期前 5 分鐘即預先刷新
+BATCH_LIMIT = 50                      # Gmail 建議每個 batch 不超過 50 封
+GMAIL_BATCH_PATH = "batch/gmail/v1"
+
+def _token_source():
+    """回傳目前 Token 來源的識別值；來源改變 (例如 token.json 被重寫) 時需重新載入"""
+    token_env = os.getenv("GMAIL_TOKEN_JSON")
+    if token_env:
+        return ("env", hash(token_env))
+    if os.path.exists(TOKEN_FILE):
+        return ("file", os.path.getmtime(TOKEN_FILE))
+    return None
+
+def _load_credentials():
+    from google.oauth2.credentials import Credentials
     creds = None
     # 1. 嘗試環境變數
     token_env = os.getenv("GMAIL_TOKEN_JSON")
@@ -30,47 +44,210 @@ def get_gmail_service():
             creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
             print("💡 從 token.json 載入成功")
         except Exception as e: print(f"⚠️ token.json 載入失敗: {e}")
-    
-    # 3. 處理過期刷新
-    if creds and creds.expired and creds.refresh_token:
+    return creds
+
+def _needs_refresh(creds) -> bool:
+    if not creds.valid:
+        return True
+    if creds.expiry is None:
+        return False
+    now = datetime.now(timezone.utc).replace(tzinfo=None)  # google-auth 的 expiry 為 naive UTC
+    return creds.expiry - now < REFRESH_AHEAD
+
+class GmailServiceCache:
+    """長駐、thread-safe 的 Gmail service 快取
+
+    - service 只建立一次，Token 來源變更或呼叫 invalidate() 時才重建
+    - 憑證在到期前 REFRESH_AHEAD 內預先刷新，寄信時不必等待刷新
+    - httplib2 非 thread-safe，因此每個執行緒各自持有一個 AuthorizedHttp
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._creds = None
+        self._service = None
+        self._source = None
+        self._generation = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._creds = None
+            self._service = None
+            self._source = None
+            self._generation += 1
+
+    def _build(self, creds):
+        from googleapiclient.discovery import build
+        client_options = {"api_endpoint": settings.GMAIL_API_ENDPOINT} if settings.GMAIL_API_ENDPOINT else None
+        return build("gmail", "v1", credentials=creds, cache_discovery=False, client_options=client_options)
+
+    def _refresh(self) -> bool:
+        if not self._creds.refresh_token:
+            return self._creds.valid
         try:
+            from google.auth.transport.requests import Request
             print("🔄 正在刷新 Gmail 存取權限...")
-            creds.refresh(Request())
+            self._creds.refresh(Request())
+            self._generation += 1
+            return True
         except Exception as e:
             print(f"❌ 刷新權限失敗: {e}")
-            creds = None
+            return False
+
+    def get(self):
+        with self._lock:
+            source = _token_source()
+            if self._service is not None and source == self._source:
+                if not _needs_refresh(self._creds) or self._refresh():
+                    return self._service
+                self.invalidate()
+                return None
+
+            self.invalidate()
+            creds = _load_credentials()
+            if creds and _needs_refresh(creds):
+                self._creds = creds
+                creds = creds if self._refresh() else None
+
+            if not creds:
+                print("❌ 完全找不到有效的 Gmail 授權資訊")
+                return None
+
+            try:
+                self._service = self._build(creds)
+            except Exception as e:
+                print(f"❌ 建立 Gmail Service 失敗: {e}")
+                return None
+            self._creds, self._source = creds, source
+            return self._service
+
+    def http(self):
+        """目前執行緒專用的已授權 http 連線"""
+        local = self._local
+        if getattr(local, "generation", None) != self._generation or local.http is None:
+            import httplib2
+            import google_auth_httplib2
+            with self._lock:
+                local.http = google_auth_httplib2.AuthorizedHttp(self._creds, http=httplib2.Http()) if self._creds else None
+                local.generation = self._generation
+        return local.http
+
+    def new_batch(self, callback):
+        if settings.GMAIL_API_ENDPOINT:
+            from googleapiclient.http import BatchHttpRequest
+            return BatchHttpRequest(callback=callback, batch_uri=f"{settings.GMAIL_API_ENDPOINT.rstrip('/')}/{GMAIL_BATCH_PATH}")
+        return self._service.new_batch_http_request(callback=callback)
+
+gmail_service_cache = GmailServiceCache()
+
+def get_gmail_service():
+    return gmail_service_cache.get()
+
+class GmailSendError(Exception):
+    """寄信失敗；status 為 Gmail API 回應碼 (無法連線或無授權時為 None)
+
+    retryable 未指定時依 status 判斷
+    """
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, message: str, status: int = None, retry_after: float = None, retryable: bool = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self._retryable = retryable
+
+    @property
+    def retryable(self) -> bool:
+        if self._retryable is not None:
+            return self._retryable
+        return self.status in self.RETRYABLE_STATUS
+
+def build_raw_message(to_email: str, subject: str, body: str, is_html: bool = False) -> str:
+    message = MIMEMultipart()
+    message["to"] = to_email
+    message["from"] = "me" # Gmail API 固定使用 me
+    message["subject"] = subject
 
-    if not creds:
-        print("❌ 完全找不到有效的 Gmail 授權資訊")
-        return None
+    # 內文處理
+    part = MIMEText(body, 'html' if is_html else 'plain')
+    message.attach(part)
+    return base64.urlsafe_b64encode(message.as_bytes()).decode()
 
+def _to_send_error(error) -> "GmailSendError":
+    retry_after = error.resp.get("retry-after")
+    return GmailSendError(
+        f"Gmail API 錯誤: {error.reason}",
+        status=error.resp.status,
+        retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+    )
+
+def send_raw(raw: str) -> str:
+    """寄出已編碼 (urlsafe base64 RFC 822) 的郵件並回傳 Gmail message id；失敗時拋出 GmailSendError"""
+    from googleapiclient.errors import HttpError
+    service = gmail_service_cache.get()
+    if not service:
+        raise GmailSendError("找不到授權資訊 (Token)")
     try:
-        return build("gmail", "v1", credentials=creds)
-    except Exception as e:
-        print(f"❌ 建立 Gmail Service 失敗: {e}")
-        return None
+        sent_msg = service.users().messages().send(userId="me", body={'raw': raw}).execute(http=gmail_service_cache.http())
+    except HttpError as error:
+        raise _to_send_error(error) from error
+    return sent_msg['id']
 
-def send_email(to_email: str, subject: str, body: str, is_html: bool = False):
-    service = get_gmail_service()
+def send_raw_batch(raws):
+    """以 Gmail batch endpoint 一次往返寄出多封已編碼的郵件
+
+    回傳與輸入同順序的 [(message_id, error), ...]，error 為 None 或 GmailSendError
+    """
+    from googleapiclient.errors import HttpError
+    service = gmail_service_cache.get()
     if not service:
-        return False, "找不到授權資訊 (Token)"
+        return [(None, GmailSendError("找不到授權資訊 (Token)"))] * len(raws)
+
+    # batch 回應缺少某個請求的結果時 callback 不會被呼叫：預設為可重試的錯誤，不可當成已寄出
+    results = [(None, GmailSendError("batch 回應中沒有此請求的結果", retryable=True)) for _ in raws]
+
+    def on_response(request_id, response, exception):
+        idx = int(request_id)
+        if exception is None:
+            results[idx] = (response['id'], None)
+        elif isinstance(exception, HttpError):
+            results[idx] = (None, _to_send_error(exception))
+        else:
+            results[idx] = (None, GmailSendError(f"發生未知錯誤: {str(exception)}"))
+
+    for start in range(0, len(raws), BATCH_LIMIT):
+        chunk = range(start, min(start + BATCH_LIMIT, len(raws)))
+        batch = gmail_service_cache.new_batch(on_response)
+        for idx in chunk:
+            batch.add(service.users().messages().send(userId="me", body={'raw': raws[idx]}), request_id=str(idx))
+        try:
+            batch.execute(http=gmail_service_cache.http())
+        except HttpError as error:
+            err = _to_send_error(error)
+            for idx in chunk:
+                results[idx] = (None, err)
+        except Exception as e:
+            err = GmailSendError(f"發生未知錯誤: {str(e)}")
+            for idx in chunk:
+                results[idx] = (None, err)
+    return results
+
+def send_message(to_email: str, subject: str, body: str, is_html: bool = False) -> str:
+    """寄出單封郵件並回傳 Gmail message id；失敗時拋出 GmailSendError"""
+    return send_raw(build_raw_message(to_email, subject, body, is_html))
+
+def send_messages_batch(messages):
+    """messages: [(to_email, subject, body, is_html), ...]；回傳格式同 send_raw_batch"""
+    return send_raw_batch([build_raw_message(*m) for m in messages])
 
+def send_email(to_email: str, subject: str, body: str, is_html: bool = False):
     try:
-        message = MIMEMultipart()
-        message["to"] = to_email
-        message["from"] = "me" # Gmail API 固定使用 me
-        message["subject"] = subject
-        
-        # 內文處理
-        part = MIMEText(body, 'html' if is_html else 'plain')
-        message.attach(part)
-        
-        raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        sent_msg = service.users().messages().send(userId="me", body={'raw': raw}).execute()
-        print(f"✅ 郵件已成功寄出至 {to_email} (ID: {sent_msg['id']})")
+        msg_id = send_message(to_email, subject, body, is_html)
+        print(f"✅ 郵件已成功寄出至 {to_email} (ID: {msg_id})")
         return True, "Success"
-    except HttpError as error:
-        err_msg = f"Gmail API 錯誤: {error.reason}"
+    except GmailSendError as error:
+        err_msg = str(error)
         print(f"❌ {err_msg}")
         return False, err_msg
     except Exception as e:
@@ -0,0 +1,165 @@
+"""行銷活動成效 rollup：每活動 × 每小時 × 公司的寄出 / 開信數
+
+由寫入路徑增量維護，分析查詢只讀 rollup，成本與時間桶數有關、與收件人數無關：
+
+- 發送：DeliveryEngine 寫回 sent_at 前呼叫 record_sends，只計入仍未寄出的收件人
+  (租約逾期被重新認領、重寄的收件人不會重複計算)
+- 開信：tracking 寫回時以同一個語句 (UPDATE ... RETURNING 接 INSERT ... ON CONFLICT) 累加，
+  只計入第一次開啟
+
+時間桶為 UTC 整點；漂移時可與 Dashboard rollup 一起重建 (python -m app.rollups rebuild)。
+"""
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.future import select
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import DateTime
+from .models import Campaign, CampaignEngagement, CampaignRecipient, Customer
+from .stats import OTHER_COMPANY
+
+UPSERT_BATCH = 1000
+
+class hour_bucket(FunctionElement):
+    """時間欄位截斷到 UTC 整點"""
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+@compiles(hour_bucket, "postgresql")
+def _hour_bucket_pg(element, compiler, **kw):
+    return f"date_trunc('hour', {compiler.process(element.clauses, **kw)} AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+
+@compiles(hour_bucket)
+def _hour_bucket_default(element, compiler, **kw):
+    # 本機 sqlite：時間以 UTC 字串儲存
+    return f"strftime('%Y-%m-%d %H:00:00', {compiler.process(element.clauses, **kw)})"
+
+def bucket_of(ts: datetime) -> datetime:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+def _company(value) -> str:
+    return value or OTHER_COMPANY
+
+# --- 增量維護 ---
+
+async def bump(db: AsyncSession, counts: Dict[Tuple[int, datetime, str], Tuple[int, int]]):
+    """counts 為 {(campaign_id, bucket, company): (sent, opened)}；多列 UPSERT，可安全並行"""
+    rows = [{"campaign_id": c, "bucket": b, "company": co, "sent": s, "opened": o} for (c, b, co), (s, o) in counts.items() if s or o]
+    e = CampaignEngagement
+    for i in range(0, len(rows), UPSERT_BATCH):
+        stmt = insert(e).values(rows[i:i + UPSERT_BATCH])
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[e.campaign_id, e.bucket, e.company],
+            set_={"sent": e.sent + stmt.excluded.sent, "opened": e.opened + stmt.excluded.opened},
+        ))
+
+async def record_sends(db: AsyncSession, campaign_id: int, sent: Iterable[Tuple[int, datetime]], worker_id: Optional[str] = None):
+    """需在寫回 sent_at 之前、同一交易內呼叫；sent 為 (customer_id, sent_at)
+
+    鎖定仍未寄出的收件人列，並行的寫回會等待並在重新檢查 sent_at 後略過；
+    指定 worker_id 時只計入仍由該 worker 持有租約的列 (與寫回條件一致)
+    """
+    times = dict(sent)
+    if not times:
+        return
+    query = (
+        select(CampaignRecipient.customer_id, Customer.company)
+        .outerjoin(Customer, Customer.id == CampaignRecipient.customer_id)
+        .where(CampaignRecipient.campaign_id == campaign_id, CampaignRecipient.customer_id.in_(times), CampaignRecipient.sent_at.is_(None))
+        .with_for_update(of=CampaignRecipient)
+    )
+    if worker_id is not None:
+        query = query.where(CampaignRecipient.claimed_by == worker_id)
+    rows = (await db.execute(query)).all()
+    counts = Counter((campaign_id, bucket_of(times[r.customer_id]), _company(r.company)) for r in rows)
+    await bump(db, {key: (n, 0) for key, n in counts.items()})
+
+async def rebuild_engagement(db: AsyncSession):
+    """自 campaign_recipients 完整重建 (修正漂移用)"""
+    cr = CampaignRecipient
+    company = func.coalesce(func.nullif(Customer.company, ""), OTHER_COMPANY)
+    await db.execute(delete(CampaignEngagement))
+    counts: dict = {}
+    for column, index in ((cr.sent_at, 0), (cr.opened_at, 1)):
+        bucket = hour_bucket(column)
+        rows = (await db.execute(
+            select(cr.campaign_id, bucket, company, func.count())
+            .outerjoin(Customer, Customer.id == cr.customer_id)
+            .where(column.is_not(None))
+            .group_by(cr.campaign_id, bucket, company)
+        )).all()
+        for campaign_id, b, co, n in rows:
+            if isinstance(b, str):  # sqlite
+                b = datetime.fromisoformat(b)
+            key = (campaign_id, bucket_of(b), co)
+            sent, opened = counts.get(key, (0, 0))
+            counts[key] = (sent + n, opened) if index == 0 else (sent, opened + n)
+    await bump(db, counts)
+
+# --- 分析查詢 ---
+
+async def open_curves(db: AsyncSession, campaign_ids: List[int], hours: int = 72, step: int = 1) -> list:
+    """各活動自開始寄送起每 step 小時的開信數與累積開信率
+
+    開始時間為第一個有寄出的時間桶；讀取的列數 = 活動數 × 時間桶數 × 公司數
+    """
+    e = CampaignEngagement
+    names = dict((await db.execute(select(Campaign.id, Campaign.name).where(Campaign.id.in_(campaign_ids)))).all())
+    rows = (await db.execute(
+        select(e.campaign_id, e.bucket, func.sum(e.sent).label("sent"), func.sum(e.opened).label("opened"))
+        .where(e.campaign_id.in_(campaign_ids))
+        .group_by(e.campaign_id, e.bucket)
+        .order_by(e.campaign_id, e.bucket)
+    )).all()
+    by_campaign: dict = {}
+    for r in rows:
+        by_campaign.setdefault(r.campaign_id, []).append(r)
+
+    points = -(-hours // step)
+    result = []
+    for campaign_id in campaign_ids:
+        if campaign_id not in names:
+            continue
+        buckets = by_campaign.get(campaign_id, [])
+        sent = sum(r.sent for r in buckets)
+        opened = sum(r.opened for r in buckets)
+        starts = [bucket_of(r.bucket) for r in buckets if r.sent] or [bucket_of(r.bucket) for r in buckets]
+        start = min(starts) if starts else None
+        per_point = [0] * points
+        for r in buckets:
+            hour = max(0, int((bucket_of(r.bucket) - start).total_seconds() // 3600))
+            if hour < hours:
+                per_point[hour // step] += r.opened
+        curve, cumulative = [], 0
+        for i, n in enumerate(per_point):
+            cumulative += n
+            curve.append({"hour": i * step, "opened": n, "cumulative": cumulative,
+                          "open_rate": round(cumulative / sent * 100, 2) if sent else 0})
+        result.append({
+            "campaign_id": campaign_id, "name": names[campaign_id], "started_at": start,
+            "sent": sent, "opened": opened, "open_rate": round(opened / sent * 100, 2) if sent else 0, "curve": curve,
+        })
+    return result
+
+async def company_engagement(db: AsyncSession, campaign_ids: Optional[List[int]] = None, since: Optional[datetime] = None,
+                             until: Optional[datetime] = None, limit: int = 20) -> list:
+    """依公司彙總寄出 / 開信數，依寄出數由多到少"""
+    e = CampaignEngagement
+    sent, opened = func.sum(e.sent).label("sent"), func.sum(e.opened).label("opened")
+    query = select(e.company, sent, opened).group_by(e.company).order_by(sent.desc(), e.company).limit(limit)
+    if campaign_ids:
+        query = query.where(e.campaign_id.in_(campaign_ids))
+    if since:
+        query = query.where(e.bucket >= since)
+    if until:
+        query = query.where(e.bucket < until)
+    return [
+        {"company": r.company, "sent": r.sent, "opened": r.opened, "open_rate": round(r.opened / r.sent * 100, 2) if r.sent else 0}
+        for r in (await db.execute(query)).all()
+    ]
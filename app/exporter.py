@@ -0,0 +1,89 @@
+"""串流匯出 CSV / NDJSON
+
+查詢以 server-side cursor (stream + yield_per) 逐批取回，邊讀邊寫入回應；
+記憶體用量只與批次大小有關。CSV 表頭在查詢前就送出，用戶端立即收到第一個位元組。
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from typing import AsyncIterator
+from fastapi.responses import StreamingResponse
+from sqlalchemy import case
+from sqlalchemy.future import select
+from .config import settings
+from .database import read_session
+from .models import Customer, Event, EventRegistration, CampaignRecipient
+
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+def customers_query():
+    return select(
+        Customer.id, Customer.name, Customer.email, Customer.phone, Customer.company, Customer.created_at,
+    ).order_by(Customer.id)
+
+def registrations_query():
+    return (
+        select(
+            EventRegistration.customer_id, Customer.name.label("customer_name"), Customer.email,
+            EventRegistration.event_id, Event.name.label("event_name"), Event.date.label("event_date"),
+            EventRegistration.attended, EventRegistration.registered_at,
+        )
+        .join(Customer, Customer.id == EventRegistration.customer_id)
+        .join(Event, Event.id == EventRegistration.event_id)
+        .order_by(EventRegistration.event_id, EventRegistration.customer_id)
+    )
+
+def recipients_query(campaign_id: int):
+    status = case(
+        (CampaignRecipient.opened_at.is_not(None), "opened"),
+        (CampaignRecipient.sent_at.is_not(None), "sent"),
+        (CampaignRecipient.error.is_not(None), "failed"),
+        else_="pending",
+    ).label("status")
+    return (
+        select(
+            CampaignRecipient.customer_id, Customer.name, Customer.email, status,
+            CampaignRecipient.sent_at, CampaignRecipient.opened_at, CampaignRecipient.error,
+        )
+        .join(Customer, Customer.id == CampaignRecipient.customer_id)
+        .where(CampaignRecipient.campaign_id == campaign_id)
+        .order_by(CampaignRecipient.customer_id)
+    )
+
+def _cell(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+async def _rows(query, batch_size: int) -> AsyncIterator[list]:
+    """每次產生一批列；使用獨立的唯讀 session，回應送完才關閉"""
+    async with read_session() as db:
+        result = await db.stream(query.execution_options(yield_per=batch_size))
+        async for partition in result.partitions():
+            yield partition
+
+async def _csv_stream(query, batch_size: int) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    # BOM：讓 Excel 正確辨識 UTF-8 中文
+    writer.writerow([c.name for c in query.selected_columns])
+    yield ("\ufeff" + buf.getvalue()).encode()
+    async for partition in _rows(query, batch_size):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows([[_cell(v) for v in row] for row in partition])
+        yield buf.getvalue().encode()
+
+async def _ndjson_stream(query, batch_size: int) -> AsyncIterator[bytes]:
+    names = [c.name for c in query.selected_columns]
+    async for partition in _rows(query, batch_size):
+        yield "".join(
+            json.dumps(dict(zip(names, map(_cell, row))), ensure_ascii=False) + "\n" for row in partition
+        ).encode()
+
+def export_response(query, name: str, fmt: str = "csv", batch_size: int = settings.EXPORT_BATCH_SIZE) -> StreamingResponse:
+    stream = _ndjson_stream(query, batch_size) if fmt == "ndjson" else _csv_stream(query, batch_size)
+    filename = f"{name}-{datetime.now():%Y%m%d-%H%M%S}.{fmt}"
+    return StreamingResponse(stream, media_type=MEDIA_TYPES[fmt], headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Cache-Control": "no-store",
+    })
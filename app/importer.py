@@ -0,0 +1,236 @@
+"""批次匯入客戶：串流解析 CSV / NDJSON，逐塊 (chunk) 以集合式 SQL 寫入
+
+每個 chunk 只需固定幾個語句：
+1. INSERT ... ON CONFLICT (email) DO NOTHING 一次寫入新客戶，既有客戶再以一次查詢取回 id
+2. 活動名稱透過本次匯入的快取解析，未知的活動一次查詢 / 建立
+3. INSERT ... ON CONFLICT DO NOTHING 一次建立所有報名關聯
+單列資料錯誤只記錄在結果中，不會中止整批匯入；記憶體用量只與 chunk 大小有關。
+"""
+import csv
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from .config import settings
+from .customer_detail import touch_customers
+from .models import Customer, Event, EventRegistration
+from .rollups import apply_import_deltas
+from .schemas import CustomerCreate
+
+MAX_REPORTED_ERRORS = 1000
+
+# CSV 表頭 (中英文皆可)；沒有表頭時依序為 姓名,Email,電話,公司,活動
+CSV_COLUMNS = {
+    "name": "name", "姓名": "name",
+    "email": "email",
+    "phone": "phone", "電話": "phone",
+    "company": "company", "公司": "company",
+    "events": "events_str", "events_str": "events_str", "活動": "events_str",
+}
+CSV_POSITIONAL = ("name", "email", "phone", "company")
+
+@dataclass
+class ImportResult:
+    success: int = 0
+    created: int = 0
+    registrations: int = 0
+    errors: List[str] = field(default_factory=list)
+    error_count: int = 0
+
+    def add_error(self, line: int, email: Optional[str], message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"第 {line} 行{f' {email}' if email else ''}: {message}")
+
+    def as_dict(self) -> dict:
+        return {
+            "message": f"成功匯入 {self.success} 筆", "created": self.created, "registrations": self.registrations,
+            "error_count": self.error_count, "errors": self.errors,
+        }
+
+# --- 串流解析 ---
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    buf = b""
+    first = True
+    async for chunk in stream:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            text = line.decode("utf-8-sig" if first else "utf-8").rstrip("\r")
+            first = False
+            yield text
+    if buf:
+        yield buf.decode("utf-8-sig" if first else "utf-8").rstrip("\r")
+
+async def iter_csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, dict]]:
+    """回傳 (行號, 欄位 dict)；引號內含換行的欄位會跨行合併"""
+    header = None
+    pending, start, lineno = None, 0, 0
+    async for line in lines:
+        lineno += 1
+        if pending is None:
+            pending, start = line, lineno
+        else:
+            pending += "\n" + line
+        if pending.count('"') % 2:
+            continue
+        record, pending = pending, None
+        if not record.strip():
+            continue
+        row = next(csv.reader([record]))
+        if header is None and start == 1 and any(c.strip().lower() in ("email", "姓名") for c in row):
+            header = [CSV_COLUMNS.get(c.strip().lower(), CSV_COLUMNS.get(c.strip())) for c in row]
+            continue
+        if header:
+            data = {k: v.strip() for k, v in zip(header, row) if k}
+        else:
+            data = {k: v.strip() for k, v in zip(CSV_POSITIONAL, row)}
+            # 活動欄位若未加引號，多出的欄位一併視為活動
+            if len(row) > len(CSV_POSITIONAL):
+                data["events_str"] = ",".join(c.strip().strip('"') for c in row[len(CSV_POSITIONAL):])
+        yield start, {k: (v or None) for k, v in data.items()}
+
+async def iter_ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, dict]]:
+    lineno = 0
+    async for line in lines:
+        lineno += 1
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield lineno, {"__error__": f"JSON 格式錯誤: {e}"}
+            continue
+        if isinstance(data, dict) and isinstance(data.get("events"), list):
+            data["events_str"] = ",".join(data.pop("events"))
+        yield lineno, data if isinstance(data, dict) else {"__error__": "每行必須是 JSON 物件"}
+
+# --- 集合式寫入 ---
+
+class EventCache:
+    """本次匯入期間的活動名稱 → id 快取"""
+
+    def __init__(self):
+        self._ids: dict = {}
+        self._pending: set = set()
+
+    async def resolve(self, db: AsyncSession, names: Iterable[str]) -> dict:
+        missing = {n for n in names if n not in self._ids}
+        if missing:
+            rows = await db.execute(select(Event.name, func.min(Event.id)).where(Event.name.in_(missing)).group_by(Event.name))
+            for name, eid in rows:
+                self._ids[name] = eid
+            to_create = [n for n in missing if n not in self._ids]
+            if to_create:
+                now = datetime.now()
+                rows = await db.execute(
+                    insert(Event).returning(Event.id, Event.name),
+                    [{"name": n, "date": now, "location": "未指定"} for n in to_create],
+                )
+                for eid, name in rows:
+                    self._ids[name] = eid
+                    self._pending.add(name)
+        return self._ids
+
+    def commit(self):
+        self._pending.clear()
+
+    def rollback(self):
+        """savepoint 回滾時，本次新建的活動也一併消失"""
+        for name in self._pending:
+            self._ids.pop(name, None)
+        self._pending.clear()
+
+def _event_names(events_str: Optional[str]) -> List[str]:
+    return [e.strip() for e in events_str.split(',') if e.strip()] if events_str else []
+
+def _slices(items: list, size: int = 5000):
+    """分批執行多列 VALUES / IN：asyncpg 單一語句最多 32767 個參數 (5000 列 × 4 欄仍在範圍內)"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+async def _write_chunk(db: AsyncSession, rows: List[Tuple[int, CustomerCreate]], events: EventCache) -> Tuple[int, int]:
+    """寫入一個 chunk；回傳 (新建客戶數, 新建報名數)"""
+    customers = {}
+    for _, c in rows:
+        customers.setdefault(c.email, c)  # 同一 email 以第一筆資料建立
+
+    # 既有客戶不覆寫 (與單筆新增行為一致)；RETURNING 只會帶回本次新增的列
+    inserted = []
+    for part in _slices(list(customers.values())):
+        inserted += (await db.execute(
+            insert(Customer).values([
+                {"name": c.name, "email": c.email, "phone": c.phone, "company": c.company} for c in part
+            ]).on_conflict_do_nothing(index_elements=[Customer.email]).returning(Customer.id, Customer.email, Customer.company)
+        )).all()
+    ids = {r.email: r.id for r in inserted}
+    existing = [e for e in customers if e not in ids]
+    for part in _slices(existing):
+        ids.update({email: cid for cid, email in await db.execute(select(Customer.id, Customer.email).where(Customer.email.in_(part)))})
+
+    new_regs = []
+    wanted = sorted({(ids[c.email], ename) for _, c in rows for ename in _event_names(c.events_str)})
+    if wanted:
+        event_ids = await events.resolve(db, {ename for _, ename in wanted})
+        for part in _slices(wanted):
+            new_regs += (await db.execute(
+                insert(EventRegistration).values([
+                    {"customer_id": cid, "event_id": event_ids[ename], "attended": True} for cid, ename in part
+                ]).on_conflict_do_nothing().returning(EventRegistration.customer_id, EventRegistration.event_id)
+            )).all()
+
+    await touch_customers(db, (cid for cid, _ in new_regs))
+    await apply_import_deltas(db, inserted, new_regs)
+    return len(inserted), len(new_regs)
+
+async def import_rows(db: AsyncSession, rows: AsyncIterator[Tuple[int, dict]], chunk_size: int = settings.IMPORT_CHUNK_SIZE) -> ImportResult:
+    result = ImportResult()
+    events = EventCache()
+    chunk: List[Tuple[int, CustomerCreate]] = []
+
+    async def flush():
+        if not chunk:
+            return
+        try:
+            async with db.begin_nested():
+                created, regs = await _write_chunk(db, chunk, events)
+            events.commit()
+            result.created += created
+            result.registrations += regs
+            result.success += len(chunk)
+        except Exception:
+            events.rollback()
+            # 整塊失敗時改為逐列寫入，找出實際出錯的資料
+            for line, c in chunk:
+                try:
+                    async with db.begin_nested():
+                        created, regs = await _write_chunk(db, [(line, c)], events)
+                    events.commit()
+                    result.created += created
+                    result.registrations += regs
+                    result.success += 1
+                except Exception as e:
+                    events.rollback()
+                    result.add_error(line, c.email, str(e).splitlines()[0])
+        await db.commit()
+        chunk.clear()
+
+    async for line, data in rows:
+        if "__error__" in data:
+            result.add_error(line, None, data["__error__"])
+            continue
+        try:
+            chunk.append((line, CustomerCreate(**data)))
+        except ValidationError as e:
+            result.add_error(line, data.get("email"), "; ".join(f"{'.'.join(map(str, err['loc']))} {err['msg']}" for err in e.errors()))
+            continue
+        if len(chunk) >= chunk_size:
+            await flush()
+    await flush()
+    return result
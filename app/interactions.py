@@ -0,0 +1,145 @@
+"""互動紀錄 (通話、郵件、網站造訪...) 的批次寫入與時間分區
+
+- ingest：JSON 陣列或 NDJSON 逐塊驗證，每個 chunk 以一次查詢確認客戶存在，
+  再以 asyncpg COPY (其他 driver 為多列 INSERT) 一次寫入
+- interactions 在 Postgres 上依 created_at 每月分區 (見 migrations 0007、0009)；leader 每天
+  預先建立未來 INTERACTION_PARTITION_MONTHS 個月的分區。created_at 超出
+  [now - INTERACTION_MAX_AGE_DAYS, 最後一個預建分區的月底) 的資料拒收，
+  避免未來時間的資料落入 default 分區而擋住該月分區的建立
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from .config import settings
+from .customer_detail import touch_customers
+from .database import engine
+from .metrics import interaction_partition_errors
+from .models import Customer, Interaction
+from .schemas import InteractionCreate
+
+MAX_REPORTED_ERRORS = 1000
+COPY_COLUMNS = ("customer_id", "type", "notes", "created_at")
+
+@dataclass
+class IngestResult:
+    inserted: int = 0
+    errors: List[str] = field(default_factory=list)
+    error_count: int = 0
+
+    def add_error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"第 {line} 筆: {message}")
+
+    def as_dict(self) -> dict:
+        return {"inserted": self.inserted, "error_count": self.error_count, "errors": self.errors}
+
+def month_start(ts: datetime, offset: int = 0) -> datetime:
+    """ts 所在月 (UTC) 往後 offset 個月的月初"""
+    m = ts.year * 12 + ts.month - 1 + offset
+    return datetime(m // 12, m % 12 + 1, 1, tzinfo=timezone.utc)
+
+def accepted_range(now: datetime = None) -> Tuple[datetime, datetime]:
+    now = now or datetime.now(timezone.utc)
+    return now - timedelta(days=settings.INTERACTION_MAX_AGE_DAYS), month_start(now, settings.INTERACTION_PARTITION_MONTHS + 1)
+
+def _check_created_at(row: InteractionCreate, earliest: datetime, latest: datetime):
+    """未帶時區視為 UTC；超出範圍時回傳錯誤訊息"""
+    if row.created_at is None:
+        return None
+    if row.created_at.tzinfo is None:
+        row.created_at = row.created_at.replace(tzinfo=timezone.utc)
+    if not earliest <= row.created_at < latest:
+        return f"created_at 須介於 {earliest:%Y-%m-%d} 與 {latest:%Y-%m-%d} 之間"
+    return None
+
+async def iter_json_array(items: list) -> AsyncIterator[Tuple[int, dict]]:
+    for i, item in enumerate(items):
+        yield i + 1, item if isinstance(item, dict) else {"__error__": "每筆必須是 JSON 物件"}
+
+async def _write_chunk(db: AsyncSession, rows: List[InteractionCreate]) -> int:
+    now = datetime.now(timezone.utc)
+    records = [(r.customer_id, r.type, r.notes, r.created_at or now) for r in rows]
+    conn = await db.connection()
+    if conn.dialect.driver == "asyncpg" and settings.INTERACTION_COPY:
+        raw = (await conn.get_raw_connection()).driver_connection
+        await raw.copy_records_to_table(Interaction.__tablename__, records=records, columns=COPY_COLUMNS)
+    else:
+        await db.execute(insert(Interaction), [dict(zip(COPY_COLUMNS, r)) for r in records])
+    await touch_customers(db, {r.customer_id for r in rows})
+    return len(records)
+
+async def _flush(db: AsyncSession, chunk: List[Tuple[int, InteractionCreate]], result: IngestResult):
+    ids = {r.customer_id for _, r in chunk}
+    known = set((await db.execute(select(Customer.id).where(Customer.id.in_(ids)))).scalars().all())
+    valid = []
+    for line, r in chunk:
+        if r.customer_id in known:
+            valid.append((line, r))
+        else:
+            result.add_error(line, f"找不到客戶 {r.customer_id}")
+    if not valid:
+        return
+    try:
+        async with db.begin_nested():
+            result.inserted += await _write_chunk(db, [r for _, r in valid])
+    except Exception as e:
+        # 例如寫入期間客戶被刪除 (外鍵錯誤)：整個 chunk 記為失敗，不影響其他 chunk
+        for line, _ in valid:
+            result.add_error(line, f"寫入失敗: {e}")
+
+async def ingest(db: AsyncSession, rows: AsyncIterator[Tuple[int, dict]], chunk_size: int = None) -> IngestResult:
+    """rows 為 (行號, dict)；每個 chunk 寫入後即 commit，記憶體用量只與 chunk 大小有關"""
+    chunk_size = chunk_size or settings.INTERACTION_INGEST_CHUNK
+    result = IngestResult()
+    earliest, latest = accepted_range()
+    chunk: List[Tuple[int, InteractionCreate]] = []
+    async for line, data in rows:
+        if "__error__" in data:
+            result.add_error(line, data["__error__"])
+            continue
+        try:
+            row = InteractionCreate.model_validate(data)
+        except ValidationError as e:
+            result.add_error(line, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        error = _check_created_at(row, earliest, latest)
+        if error:
+            result.add_error(line, error)
+            continue
+        chunk.append((line, row))
+        if len(chunk) >= chunk_size:
+            await _flush(db, chunk, result)
+            await db.commit()
+            chunk = []
+    if chunk:
+        await _flush(db, chunk, result)
+        await db.commit()
+    return result
+
+# --- 分區維護 ---
+
+async def ensure_partitions(months: int = None) -> int:
+    """建立本月起 months 個月的分區 (已存在則略過)，回傳失敗的月數；非 Postgres 不做事
+
+    每個月各自一個交易，單月失敗不影響其他月份；失敗計入 crm_interaction_partition_errors_total
+    """
+    if engine.dialect.name != "postgresql":
+        return 0
+    months = settings.INTERACTION_PARTITION_MONTHS if months is None else months
+    now = datetime.now(timezone.utc)
+    failed = 0
+    for offset in range(months + 1):
+        month = month_start(now, offset).date()
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text("SELECT crm_ensure_interaction_partition(:month)"), {"month": month})
+        except Exception as e:
+            failed += 1
+            interaction_partition_errors.inc()
+            print(f"❌ [Interactions] 建立 {month:%Y-%m} 分區失敗: {e}")
+    return failed
@@ -0,0 +1,91 @@
+"""以 Postgres advisory lock 選出唯一的 leader
+
+每個候選行程以一條專用連線嘗試 pg_try_advisory_lock；取得者成為 leader 並持有
+該連線 (session 級 lock，連線中斷即自動釋放)，其他行程每 LEADER_RETRY_SECONDS
+重試一次。leader 定期在同一連線上 heartbeat，連線失效時立即卸任。
+
+leader 連線同時 LISTEN 指定的 channel，讓 API 行程以 NOTIFY 通知 leader。
+非 Postgres (例如本機 sqlite) 沒有 advisory lock，只有單一行程，直接視為 leader。
+"""
+import asyncio
+from typing import Callable, Dict, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from .config import settings
+
+class LeaderElection:
+    def __init__(self, engine: AsyncEngine, lock_id: int, on_elected: Callable[[], None], on_resigned: Callable[[], None],
+                 channels: Optional[Dict[str, Callable[[str], None]]] = None, retry: float = settings.LEADER_RETRY_SECONDS):
+        self.engine = engine
+        self.lock_id = lock_id
+        self.on_elected = on_elected
+        self.on_resigned = on_resigned
+        self.channels = channels or {}
+        self.retry = retry
+        self.is_leader = False
+        self._task = None
+
+    def _elect(self):
+        self.is_leader = True
+        print(f"👑 [Leader] 取得 leader (lock {self.lock_id})")
+        self.on_elected()
+
+    def _resign(self):
+        if self.is_leader:
+            self.is_leader = False
+            print("🪑 [Leader] 卸任 leader")
+            self.on_resigned()
+
+    async def _lead(self, conn):
+        raw = (await conn.get_raw_connection()).driver_connection
+        listeners = {channel: (lambda _c, _pid, _ch, payload, cb=cb: cb(payload)) for channel, cb in self.channels.items()}
+        for channel, listener in listeners.items():
+            await raw.add_listener(channel, listener)
+        self._elect()
+        try:
+            while True:
+                await asyncio.sleep(self.retry)
+                await conn.execute(text("SELECT 1"))  # heartbeat：連線失效即拋出例外並卸任
+        finally:
+            self._resign()
+            for channel, listener in listeners.items():
+                try:
+                    await raw.remove_listener(channel, listener)
+                except Exception:
+                    pass
+
+    async def _run(self):
+        if self.engine.dialect.name != "postgresql":
+            self._elect()
+            return
+        while True:
+            try:
+                # AUTOCOMMIT：持有 lock 期間不留下 idle in transaction 的連線
+                async with self.engine.connect() as conn:
+                    conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                    locked = (await conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": self.lock_id})).scalar()
+                    if locked:
+                        try:
+                            await self._lead(conn)
+                        finally:
+                            await conn.invalidate()  # 關閉連線釋放 lock，不放回連線池
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ [Leader] leader 連線中斷: {e}")
+            await asyncio.sleep(self.retry)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止競選；leader 連線關閉時 lock 隨之釋放，其他行程即可接手"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._resign()
@@ -1,28 +1,61 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from .database import engine, Base
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from .config import settings
+from .database import engine, read_engine, AsyncSessionLocal
+from .rollups import ensure_rollups
+from .migrations import upgrade, pending_migrations
 from .router import router
-from .scheduler import scheduler
-import os
+from .scheduler import start_scheduler, stop_scheduler
+from .tracking import open_buffer
+from .checkin import attendance_board
+from .metrics import MetricsMiddleware, instrument_engine, registry
+from .static_assets import static_assets, ENTRY, NegotiatedGZipMiddleware
 
 app = FastAPI(title="CRM Pro API")
+# 靜態檔 (/、/static/) 由 StaticAssets 協商；SSE 不會被壓縮
+app.add_middleware(NegotiatedGZipMiddleware, minimum_size=settings.GZIP_MIN_SIZE, compresslevel=settings.GZIP_LEVEL)
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
+if read_engine is not engine:
+    instrument_engine(read_engine)
 
 @app.on_event("startup")
 async def startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    scheduler.start()
+    static_assets.load()
+    if settings.AUTO_MIGRATE:
+        await upgrade(engine)
+        async with AsyncSessionLocal() as db:
+            await ensure_rollups(db)
+    else:
+        # 快速啟動：schema 由部署流程套用，這裡只做一次查詢確認版本
+        async with engine.connect() as conn:
+            pending = await pending_migrations(conn)
+        if pending:
+            print(f"⚠️ [Migration] 資料庫尚未套用 {', '.join(pending)}，請執行 python -m app.migrations")
+    if settings.RUN_SCHEDULER:
+        start_scheduler()
+    open_buffer.start()
 
 @app.on_event("shutdown")
 async def shutdown():
-    scheduler.shutdown()
+    await stop_scheduler()
+    await open_buffer.stop()
+    await attendance_board.stop()
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
 
 app.include_router(router)
 
-if os.path.exists("static"):
-    app.mount("/static", StaticFiles(directory="static"), name="static")
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text format"""
+    return PlainTextResponse(await registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
-@app.get("/")
-async def root():
-    return FileResponse("static/index.html")
+@app.get("/static/{name:path}", include_in_schema=False)
+async def static_file(name: str, request: Request):
+    return static_assets.response(request, name)
+
+@app.get("/", include_in_schema=False)
+async def root(request: Request):
+    return static_assets.response(request, ENTRY)
@@ -0,0 +1,228 @@
+"""內建監控指標 (Prometheus text format)，不依賴外部套件
+
+- MetricsMiddleware：各路由延遲直方圖；啟用 SERVER_TIMING 時可逐請求回傳 Server-Timing
+- SQLAlchemy 事件：每個請求的查詢數與 DB 時間、全域查詢延遲、慢查詢記錄
+- 發送 / 排程指標由 delivery.py、scheduler.py 直接更新
+
+所有指標皆可跨執行緒更新 (發送在 thread pool 中執行)。
+"""
+import contextvars
+import inspect
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+from sqlalchemy import event
+from .config import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in items]
+
+class Gauge(Counter):
+    """可設定值，或以 collect 函式 (同步 / 非同步) 在抓取時計算"""
+    kind = "gauge"
+
+    def __init__(self, *args, collect: Optional[Callable] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # key -> [各 bucket 計數..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        lines = self.header()
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {count}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, inf)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, metric: _Metric):
+        self.metrics.append(metric)
+
+    async def render(self) -> str:
+        for metric in self.metrics:
+            if isinstance(metric, Gauge) and metric.collect:
+                try:
+                    value = metric.collect()
+                    if inspect.isawaitable(value):
+                        value = await value
+                    metric.set(value)
+                except Exception as e:
+                    print(f"⚠️ [Metrics] 無法取得 {metric.name}: {e}")
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# --- 指標定義 ---
+
+http_requests = Counter("crm_http_requests_total", "HTTP 請求數", ("method", "route", "status"))
+http_latency = Histogram("crm_http_request_duration_seconds", "HTTP 請求延遲", ("method", "route"))
+http_db_queries = Histogram("crm_http_request_db_queries", "每個 HTTP 請求執行的 SQL 數", ("method", "route"), buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500))
+db_queries = Counter("crm_db_queries_total", "SQL 執行次數")
+db_latency = Histogram("crm_db_query_duration_seconds", "SQL 執行時間", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+db_slow_queries = Counter("crm_db_slow_queries_total", "超過 SLOW_QUERY_MS 的 SQL 數")
+
+campaigns_processed = Counter("crm_campaigns_processed_total", "排程器處理的行銷活動數", ("result",))
+scheduler_runs = Histogram("crm_scheduler_run_duration_seconds", "排程器每輪執行時間", buckets=(0.1, 1, 5, 10, 30, 60, 300, 900))
+mail_sends = Counter("crm_mail_sends_total", "寄信結果", ("result",))
+mail_send_latency = Histogram("crm_mail_send_duration_seconds", "每次 Gmail 呼叫 (單封或 batch) 的延遲", ("mode",))
+outbox_depth = Gauge("crm_outbox_pending", "尚未寄出的收件人數")
+interaction_partition_errors = Counter("crm_interaction_partition_errors_total", "建立 interactions 月分區失敗次數")
+
+# --- 每個請求的 DB 統計 ---
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+_request_stats: contextvars.ContextVar = contextvars.ContextVar("request_stats", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    db_queries.inc()
+    db_latency.observe(elapsed)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+    if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+        db_slow_queries.inc()
+        print(f"🐢 [SQL] 慢查詢 {elapsed * 1000:.0f} ms: {' '.join(statement.split())[:500]}")
+
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection is not None else None
+    if starts:
+        starts.pop()
+
+def instrument_engine(engine):
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+# --- ASGI middleware ---
+
+class MetricsMiddleware:
+    """純 ASGI middleware，不緩衝回應內容 (串流回應照常運作)
+
+    路由以 FastAPI 的路徑樣板 (例如 /customers/{customer_id}) 為標籤，避免標籤數量爆增。
+    SERVER_TIMING 開啟時，請求帶 X-Server-Timing: 1 即回傳 Server-Timing 標頭。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        status = 500
+        timing = settings.SERVER_TIMING and (b"x-server-timing", b"1") in scope.get("headers", [])
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timing:
+                    app_ms = (time.perf_counter() - start) * 1000
+                    value = f'app;dur={app_ms:.1f}, db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"'
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", value.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            http_requests.inc(method=method, route=path, status=status)
+            http_latency.observe(time.perf_counter() - start, method=method, route=path)
+            http_db_queries.observe(stats.queries, method=method, route=path)
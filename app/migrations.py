@@ -0,0 +1,203 @@
+"""版本化 schema 變更
+
+新資料庫由 Base.metadata.create_all 建立完整結構；既有資料庫則依序套用
+尚未執行過的版本 (記錄於 schema_migrations)。每個版本的 SQL 都必須可重複執行。
+版本 SQL 皆為 Postgres 語法；其他資料庫 (本機 sqlite、基準測試) 只執行 create_all。
+
+AUTO_MIGRATE 關閉時 API 啟動不再建表，改在部署前執行一次：
+
+    python -m app.migrations            # 建表 + 套用未執行的版本
+    python -m app.migrations status     # 只列出尚未套用的版本
+"""
+import asyncio
+import sys
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection
+from .config import settings
+
+MIGRATIONS = [
+    ("0001_outbox_lease", [
+        "ALTER TABLE campaign_recipients ADD COLUMN IF NOT EXISTS claimed_by VARCHAR",
+        "ALTER TABLE campaign_recipients ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE",
+        "ALTER TABLE campaign_recipients ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS ix_campaign_recipients_pending ON campaign_recipients (campaign_id, customer_id) WHERE sent_at IS NULL AND error IS NULL",
+    ]),
+    ("0002_customer_list_indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_customers_created_at_id ON customers (created_at, id)",
+        # ILIKE '%q%' 搜尋使用 trigram GIN 索引
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_customers_name_trgm ON customers USING gin (name gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_customers_email_trgm ON customers USING gin (email gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_customers_company_trgm ON customers USING gin (company gin_trgm_ops)",
+    ]),
+    ("0003_list_aggregate_indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_events_date_id ON events (date, id)",
+        "CREATE INDEX IF NOT EXISTS ix_event_registrations_event_id_attended ON event_registrations (event_id, attended)",
+        "CREATE INDEX IF NOT EXISTS ix_campaigns_created_at_id ON campaigns (created_at, id)",
+    ]),
+    ("0004_customer_timelines", [
+        "CREATE INDEX IF NOT EXISTS ix_interactions_customer_id_created_at ON interactions (customer_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_event_registrations_customer_id_registered_at ON event_registrations (customer_id, registered_at, event_id)",
+    ]),
+    ("0005_campaign_schedule_index", [
+        "CREATE INDEX IF NOT EXISTS ix_campaigns_status_scheduled_at ON campaigns (status, scheduled_at)",
+    ]),
+    ("0006_segments", [
+        # segments 資料表由 create_all 建立
+        "ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS segment_id INTEGER REFERENCES segments(id) ON DELETE SET NULL",
+        "CREATE INDEX IF NOT EXISTS ix_customer_courses_course_id ON customer_courses (course_id)",
+    ]),
+    ("0007_interactions_partitioned", [
+        # 每月一個分區：interactions_yYYYYmMM，範圍以 UTC 月初為界
+        """
+        CREATE OR REPLACE FUNCTION crm_ensure_interaction_partition(month date) RETURNS void AS $$
+        DECLARE
+            start_at date := date_trunc('month', month)::date;
+            part text := format('interactions_y%sm%s', to_char(start_at, 'YYYY'), to_char(start_at, 'MM'));
+        BEGIN
+            IF to_regclass(part) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I PARTITION OF interactions FOR VALUES FROM (%L) TO (%L)', part,
+                               start_at::timestamp AT TIME ZONE 'UTC', (start_at + interval '1 month')::timestamp AT TIME ZONE 'UTC');
+            END IF;
+        END $$ LANGUAGE plpgsql
+        """,
+        # 一般資料表 (既有資料庫，或新資料庫由 create_all 建立) 改建為分區表；已是分區表則略過
+        """
+        DO $$
+        DECLARE
+            m date;
+            last_at timestamptz;
+        BEGIN
+            IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('interactions')) = 'r' THEN
+                ALTER TABLE interactions RENAME TO interactions_unpartitioned;
+                ALTER TABLE interactions_unpartitioned RENAME CONSTRAINT interactions_pkey TO interactions_unpartitioned_pkey;
+                DROP INDEX IF EXISTS ix_interactions_customer_id_created_at;
+                DROP INDEX IF EXISTS ix_interactions_id;
+                CREATE TABLE interactions (
+                    id INTEGER NOT NULL DEFAULT nextval('interactions_id_seq'),
+                    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                    customer_id INTEGER NOT NULL REFERENCES customers (id),
+                    type VARCHAR NOT NULL,
+                    notes TEXT,
+                    PRIMARY KEY (id, created_at)
+                ) PARTITION BY RANGE (created_at);
+                CREATE TABLE interactions_default PARTITION OF interactions DEFAULT;
+                SELECT date_trunc('month', min(created_at) AT TIME ZONE 'UTC')::date, max(created_at)
+                    INTO m, last_at FROM interactions_unpartitioned;
+                WHILE m IS NOT NULL AND m <= last_at LOOP
+                    PERFORM crm_ensure_interaction_partition(m);
+                    m := (m + interval '1 month')::date;
+                END LOOP;
+                INSERT INTO interactions (id, created_at, customer_id, type, notes)
+                    SELECT id, coalesce(created_at, now()), customer_id, type, notes FROM interactions_unpartitioned;
+                ALTER SEQUENCE interactions_id_seq OWNED BY interactions.id;
+                DROP TABLE interactions_unpartitioned;
+            END IF;
+        END $$
+        """,
+        "CREATE TABLE IF NOT EXISTS interactions_default PARTITION OF interactions DEFAULT",
+        "CREATE INDEX IF NOT EXISTS ix_interactions_customer_id_created_at ON interactions (customer_id, created_at, id)",
+        "SELECT crm_ensure_interaction_partition((date_trunc('month', now() AT TIME ZONE 'UTC') + make_interval(months => g))::date) "
+        f"FROM generate_series(0, {settings.INTERACTION_PARTITION_MONTHS}) AS g",
+    ]),
+    # campaign_engagement 由 create_all 建立；以既有收件人資料回填 (覆寫為完整計數，可重複執行)
+    ("0008_campaign_engagement", [
+        """
+        INSERT INTO campaign_engagement (campaign_id, bucket, company, sent, opened)
+        SELECT cr.campaign_id, date_trunc('hour', cr.sent_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+               COALESCE(NULLIF(c.company, ''), '其他'), count(*), 0
+        FROM campaign_recipients cr LEFT JOIN customers c ON c.id = cr.customer_id
+        WHERE cr.sent_at IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (campaign_id, bucket, company) DO UPDATE SET sent = EXCLUDED.sent
+        """,
+        """
+        INSERT INTO campaign_engagement (campaign_id, bucket, company, sent, opened)
+        SELECT cr.campaign_id, date_trunc('hour', cr.opened_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+               COALESCE(NULLIF(c.company, ''), '其他'), 0, count(*)
+        FROM campaign_recipients cr LEFT JOIN customers c ON c.id = cr.customer_id
+        WHERE cr.opened_at IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (campaign_id, bucket, company) DO UPDATE SET opened = EXCLUDED.opened
+        """,
+    ]),
+    # default 分區已有某月資料時 CREATE ... PARTITION OF 會失敗：改為先把資料搬到新表再 ATTACH
+    ("0009_interaction_partition_repair", [
+        """
+        CREATE OR REPLACE FUNCTION crm_ensure_interaction_partition(month date) RETURNS void AS $$
+        DECLARE
+            start_at date := date_trunc('month', month)::date;
+            part text := format('interactions_y%sm%s', to_char(start_at, 'YYYY'), to_char(start_at, 'MM'));
+            lo timestamptz := start_at::timestamp AT TIME ZONE 'UTC';
+            hi timestamptz := (start_at + interval '1 month')::timestamp AT TIME ZONE 'UTC';
+        BEGIN
+            IF to_regclass(part) IS NOT NULL THEN
+                RETURN;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM interactions_default WHERE created_at >= lo AND created_at < hi) THEN
+                EXECUTE format('CREATE TABLE %I PARTITION OF interactions FOR VALUES FROM (%L) TO (%L)', part, lo, hi);
+                RETURN;
+            END IF;
+            EXECUTE format('CREATE TABLE %I (LIKE interactions INCLUDING DEFAULTS)', part);
+            EXECUTE format('WITH moved AS (DELETE FROM interactions_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                           'INSERT INTO %I SELECT * FROM moved', lo, hi, part);
+            EXECUTE format('ALTER TABLE interactions ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', part, lo, hi);
+        END $$ LANGUAGE plpgsql
+        """,
+    ]),
+]
+
+async def apply_migrations(conn: AsyncConnection):
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (version VARCHAR PRIMARY KEY, applied_at TIMESTAMP WITH TIME ZONE DEFAULT now())"
+    ))
+    applied = set((await conn.execute(text("SELECT version FROM schema_migrations"))).scalars().all())
+    for version, statements in MIGRATIONS:
+        if version in applied:
+            continue
+        print(f"🛠️ [Migration] 套用 {version}")
+        for stmt in statements:
+            await conn.execute(text(stmt))
+        await conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:v)"), {"v": version})
+
+async def pending_migrations(conn: AsyncConnection) -> list:
+    """尚未套用的版本；schema_migrations 不存在 (資料庫尚未初始化) 時回傳全部版本，非 Postgres 一律為空"""
+    if conn.dialect.name != "postgresql":
+        return []
+    try:
+        applied = set((await conn.execute(text("SELECT version FROM schema_migrations"))).scalars().all())
+    except DBAPIError:
+        return [version for version, _ in MIGRATIONS]
+    return [version for version, _ in MIGRATIONS if version not in applied]
+
+async def upgrade(engine):
+    """建立缺少的資料表並套用所有未執行的版本 (非 Postgres 只建表)"""
+    from .database import Base
+    from . import models  # noqa: F401  註冊所有資料表
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        if conn.dialect.name == "postgresql":
+            await apply_migrations(conn)
+
+async def _main(command: str):
+    from .database import engine, AsyncSessionLocal
+    from .rollups import ensure_rollups
+    try:
+        if command == "status":
+            async with engine.connect() as conn:
+                pending = await pending_migrations(conn)
+            print("✅ [Migration] schema 已是最新" if not pending else f"⚠️ [Migration] 尚未套用: {', '.join(pending)}")
+            return
+        await upgrade(engine)
+        async with AsyncSessionLocal() as db:
+            await ensure_rollups(db)
+        print("✅ [Migration] schema 已是最新")
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    if sys.argv[1:] not in ([], ["upgrade"], ["status"]):
+        print("用法: python -m app.migrations [upgrade|status]")
+        sys.exit(1)
+    asyncio.run(_main((sys.argv[1:] or ["upgrade"])[0]))
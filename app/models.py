@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Table, Float, Boolean, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Table, Float, Boolean, Enum, Index, JSON, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -17,6 +17,8 @@ customer_courses = Table(
     Base.metadata,
     Column("customer_id", Integer, ForeignKey("customers.id"), primary_key=True),
     Column("course_id", Integer, ForeignKey("courses.id"), primary_key=True),
+    # 分群條件「購買過課程 X」依課程查詢
+    Index("ix_customer_courses_course_id", "course_id"),
 )
 
 class Customer(Base):
@@ -33,15 +35,27 @@ class Customer(Base):
     courses = relationship("Course", secondary=customer_courses, back_populates="students")
     registrations = relationship("EventRegistration", back_populates="customer", cascade="all, delete-orphan")
 
+    # 客戶列表 keyset 分頁；姓名 / Email / 公司的 trigram 搜尋索引見 migrations.py
+    __table_args__ = (
+        Index("ix_customers_created_at_id", "created_at", "id"),
+    )
+
 class Interaction(Base):
     __tablename__ = "interactions"
-    id = Column(Integer, primary_key=True, index=True)
+    # create_all 建立一般資料表；Postgres 上由 migrations 0007 改建為依 created_at 每月分區
+    # (主鍵改為 (id, created_at))，ORM 只以 id 識別，其他資料庫維持單欄主鍵
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
     type = Column(String, nullable=False)
     notes = Column(Text, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
     customer = relationship("Customer", back_populates="interactions")
 
+    # 客戶時間軸 keyset 分頁 (分區表上為各分區共用的 partitioned index)
+    __table_args__ = (
+        Index("ix_interactions_customer_id_created_at", "customer_id", "created_at", "id"),
+    )
+
 class Course(Base):
     __tablename__ = "courses"
     id = Column(Integer, primary_key=True, index=True)
@@ -58,6 +72,10 @@ class Event(Base):
     location = Column(String, nullable=True)
     registrations = relationship("EventRegistration", back_populates="event", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_events_date_id", "date", "id"),
+    )
+
 class EventRegistration(Base):
     __tablename__ = "event_registrations"
     customer_id = Column(Integer, ForeignKey("customers.id"), primary_key=True)
@@ -67,6 +85,12 @@ class EventRegistration(Base):
     customer = relationship("Customer", back_populates="registrations")
     event = relationship("Event", back_populates="registrations")
 
+    # 主鍵以 customer_id 開頭；依活動彙總報名 / 簽到數需要 event_id 開頭的索引
+    __table_args__ = (
+        Index("ix_event_registrations_event_id_attended", "event_id", "attended"),
+        Index("ix_event_registrations_customer_id_registered_at", "customer_id", "registered_at", "event_id"),
+    )
+
 class Campaign(Base):
     __tablename__ = "campaigns"
     id = Column(Integer, primary_key=True, index=True)
@@ -76,8 +100,14 @@ class Campaign(Base):
     status = Column(Enum(CampaignStatus), default=CampaignStatus.DRAFT)
     scheduled_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    segment_id = Column(Integer, ForeignKey("segments.id", ondelete="SET NULL"), nullable=True)  # 以分群建立時的來源
     recipients = relationship("CampaignRecipient", back_populates="campaign", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_campaigns_created_at_id", "created_at", "id"),
+        Index("ix_campaigns_status_scheduled_at", "status", "scheduled_at"),
+    )
+
 class CampaignRecipient(Base):
     __tablename__ = "campaign_recipients"
     campaign_id = Column(Integer, ForeignKey("campaigns.id"), primary_key=True)
@@ -85,9 +115,41 @@ class CampaignRecipient(Base):
     sent_at = Column(DateTime(timezone=True), nullable=True)
     opened_at = Column(DateTime(timezone=True), nullable=True)
     error = Column(String, nullable=True)
+    # 發送佇列 (outbox) 的租約欄位：worker 以 FOR UPDATE SKIP LOCKED 認領
+    claimed_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
     campaign = relationship("Campaign", back_populates="recipients")
     customer = relationship("Customer")
 
+    __table_args__ = (
+        Index("ix_campaign_recipients_pending", "campaign_id", "customer_id", postgresql_where=text("sent_at IS NULL AND error IS NULL")),
+    )
+
+class Segment(Base):
+    """受眾分群：definition 為 JSON 條件 (格式見 segments.py)"""
+    __tablename__ = "segments"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    definition = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class DuplicateSuggestion(Base):
+    """疑似重複的客戶配對 (customer_id < duplicate_id)，由 dedup 掃描產生 (見 dedup.py)"""
+    __tablename__ = "duplicate_suggestions"
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="CASCADE"), primary_key=True)
+    duplicate_id = Column(Integer, ForeignKey("customers.id", ondelete="CASCADE"), primary_key=True)
+    score = Column(Float, nullable=False)
+    reasons = Column(String, nullable=False, default="")  # 相符的特徵，例如 "phone,name"
+    dismissed = Column(Boolean, nullable=False, default=False, server_default=text("false"))  # 人工判定不是重複，重新掃描時保留
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # 依分數排序的 keyset 分頁
+    __table_args__ = (
+        Index("ix_duplicate_suggestions_rank", "score", "customer_id", "duplicate_id", postgresql_where=text("NOT dismissed")),
+        Index("ix_duplicate_suggestions_duplicate_id", "duplicate_id"),
+    )
+
 class EmailTemplate(Base):
     __tablename__ = "email_templates"
     id = Column(Integer, primary_key=True, index=True)
@@ -95,3 +157,34 @@ class EmailTemplate(Base):
     subject = Column(String, nullable=False)
     body = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# --- Dashboard Rollups (由寫入路徑增量維護) ---
+class DashboardCounter(Base):
+    __tablename__ = "dashboard_counters"
+    name = Column(String, primary_key=True)
+    value = Column(Float, nullable=False, default=0)
+
+class EventRollup(Base):
+    __tablename__ = "event_rollups"
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), primary_key=True)
+    registrations = Column(Integer, nullable=False, default=0)
+    converted = Column(Integer, nullable=False, default=0)
+
+class CompanyRollup(Base):
+    __tablename__ = "company_rollups"
+    company = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0, index=True)
+
+class CampaignEngagement(Base):
+    """行銷活動成效：每活動 × 每小時 (UTC 整點) × 公司的寄出 / 開信數 (見 engagement.py)"""
+    __tablename__ = "campaign_engagement"
+    campaign_id = Column(Integer, ForeignKey("campaigns.id", ondelete="CASCADE"), primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    company = Column(String, primary_key=True)
+    sent = Column(Integer, nullable=False, default=0)
+    opened = Column(Integer, nullable=False, default=0)
+
+    # 跨活動的公司成效 (依時間區間篩選)
+    __table_args__ = (
+        Index("ix_campaign_engagement_company_bucket", "company", "bucket"),
+    )
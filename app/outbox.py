@@ -0,0 +1,192 @@
+"""以 CampaignRecipient 為基礎的持久化發送佇列 (outbox)
+
+任何數量的行程 / 節點都可同時處理同一個活動：每個 worker 以
+FOR UPDATE SKIP LOCKED 認領一批尚未寄出的收件人並寫入租約；
+寄出後清除租約。行程中途崩潰時，租約逾期的收件人會自動被重新認領，
+活動從中斷處繼續 (at-least-once：最後一批未寫回的收件人可能重寄)。
+
+發送中的 worker 以 Lease 追蹤自己認領的收件人：每次寫回時續期租約，寫回只更新
+claimed_by 仍是自己的列；租約遺失 (逾期後被其他 worker 認領) 的收件人不再寄出。
+"""
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+from sqlalchemy import update, exists, and_, or_, func
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .config import settings
+from .database import AsyncSessionLocal
+from .metrics import outbox_depth
+from .models import Campaign, CampaignStatus, CampaignRecipient, Customer, Event, EventRegistration
+
+# 容器重啟後 hostname / pid 常常相同，加上隨機後綴避免誤認前一個行程的租約
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def _claimable(campaign_id: int, now: datetime):
+    return and_(
+        CampaignRecipient.campaign_id == campaign_id,
+        CampaignRecipient.sent_at.is_(None),
+        CampaignRecipient.error.is_(None),
+        CampaignRecipient.attempts < settings.OUTBOX_MAX_ATTEMPTS,
+        or_(CampaignRecipient.lease_expires_at.is_(None), CampaignRecipient.lease_expires_at < now),
+    )
+
+async def claim_batch(db: AsyncSession, campaign_id: int, limit: int = settings.OUTBOX_CLAIM_BATCH, worker_id: str = WORKER_ID, with_events: bool = False):
+    """認領一批收件人並回傳範本欄位 dict；其他 worker 已鎖定的列會直接略過
+
+    with_events=True 時一併以單一查詢帶出各收件人參加過的活動名稱 (events 欄位)
+    """
+    now = datetime.now(timezone.utc)
+    candidates = (
+        select(CampaignRecipient.customer_id)
+        .where(_claimable(campaign_id, now))
+        .order_by(CampaignRecipient.customer_id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    res = await db.execute(
+        update(CampaignRecipient)
+        .where(CampaignRecipient.campaign_id == campaign_id, CampaignRecipient.customer_id.in_(candidates))
+        .values(
+            claimed_by=worker_id,
+            lease_expires_at=now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS),
+            attempts=CampaignRecipient.attempts + 1,
+        )
+        .returning(CampaignRecipient.customer_id)
+        .execution_options(synchronize_session=False)
+    )
+    claimed = res.scalars().all()
+    if not claimed:
+        return []
+    rows = await db.execute(
+        select(Customer.id, Customer.name, Customer.email, Customer.company, Customer.phone)
+        .where(Customer.id.in_(claimed))
+        .order_by(Customer.id)
+    )
+    recipients = [dict(r._mapping) for r in rows]
+    if with_events:
+        ev_rows = await db.execute(
+            select(EventRegistration.customer_id, Event.name)
+            .join(Event, Event.id == EventRegistration.event_id)
+            .where(EventRegistration.customer_id.in_(claimed))
+            .order_by(Event.date)
+        )
+        events: dict = {}
+        for cid, ename in ev_rows:
+            events.setdefault(cid, []).append(ename)
+        for r in recipients:
+            r["events"] = "、".join(events.get(r["id"], []))
+    return recipients
+
+class Lease:
+    """一個 worker 在某活動上持有的收件人租約
+
+    held 為已認領、尚未寫回結果的收件人；sending 為已交給 Gmail、結果未知的收件人
+    """
+
+    def __init__(self, campaign_id: int, worker_id: str = WORKER_ID, seconds: float = settings.OUTBOX_LEASE_SECONDS):
+        self.campaign_id = campaign_id
+        self.worker_id = worker_id
+        self.seconds = seconds
+        self.held: set = set()
+        self.sending: set = set()
+
+    def _mine(self, ids):
+        return and_(
+            CampaignRecipient.campaign_id == self.campaign_id,
+            CampaignRecipient.customer_id.in_(ids),
+            CampaignRecipient.claimed_by == self.worker_id,
+            CampaignRecipient.sent_at.is_(None),
+            CampaignRecipient.error.is_(None),
+        )
+
+    async def renew(self, db: AsyncSession) -> set:
+        """延長仍持有的租約 (呼叫端 commit)；回傳已遺失的收件人並不再視為持有"""
+        if not self.held:
+            return set()
+        res = await db.execute(
+            update(CampaignRecipient)
+            .where(self._mine(self.held))
+            .values(lease_expires_at=datetime.now(timezone.utc) + timedelta(seconds=self.seconds))
+            .returning(CampaignRecipient.customer_id)
+            .execution_options(synchronize_session=False)
+        )
+        kept = set(res.scalars().all())
+        lost = self.held - kept
+        self.held = kept
+        return lost
+
+    async def release(self, db: AsyncSession) -> int:
+        """發送中斷時歸還尚未交給 Gmail 的收件人 (不計入認領次數)，其他 worker 可立即認領；呼叫端 commit"""
+        unsent = self.held - self.sending
+        if not unsent:
+            return 0
+        res = await db.execute(
+            update(CampaignRecipient)
+            .where(self._mine(unsent))
+            .values(claimed_by=None, lease_expires_at=None, attempts=CampaignRecipient.attempts - 1)
+            .execution_options(synchronize_session=False)
+        )
+        self.held -= unsent
+        return res.rowcount
+
+async def iter_claimed(campaign_id: int, with_events: bool = False, lease: Optional[Lease] = None, batch: Optional[Callable[[], int]] = None):
+    """持續認領直到沒有可認領的收件人；每次認領使用獨立 session 並立即 commit 租約
+
+    batch 回傳每次認領的筆數 (例如依目前發送速率，讓一批能在租約內寄完)
+    """
+    while True:
+        limit = batch() if batch else settings.OUTBOX_CLAIM_BATCH
+        async with AsyncSessionLocal() as db:
+            rows = await claim_batch(db, campaign_id, limit=limit, worker_id=lease.worker_id if lease else WORKER_ID, with_events=with_events)
+            await db.commit()
+        if not rows:
+            return
+        if lease is not None:
+            lease.held.update(r["id"] for r in rows)
+        for row in rows:
+            yield row
+
+async def finalize_campaign(db: AsyncSession, campaign_id: int) -> bool:
+    """所有收件人皆已處理時將活動標為完成；仍有其他 worker 租約中的收件人則回傳 False
+
+    租約未逾期的列即使已用完重試次數也視為處理中 (持有者可能正在做最後一次發送)
+    """
+    now = datetime.now(timezone.utc)
+    leased = CampaignRecipient.lease_expires_at >= now
+    expired = or_(CampaignRecipient.lease_expires_at.is_(None), CampaignRecipient.lease_expires_at < now)
+    pending = await db.execute(select(exists().where(
+        CampaignRecipient.campaign_id == campaign_id,
+        CampaignRecipient.sent_at.is_(None),
+        CampaignRecipient.error.is_(None),
+        or_(CampaignRecipient.attempts < settings.OUTBOX_MAX_ATTEMPTS, leased),
+    )))
+    if pending.scalar():
+        return False
+
+    # 反覆認領仍未完成 (例如每次都讓 worker 崩潰) 且租約已逾期的收件人標記為失敗
+    await db.execute(
+        update(CampaignRecipient)
+        .where(CampaignRecipient.campaign_id == campaign_id, CampaignRecipient.sent_at.is_(None), CampaignRecipient.error.is_(None), expired)
+        .values(error="重試次數過多", claimed_by=None, lease_expires_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    res = await db.execute(
+        update(Campaign)
+        .where(Campaign.id == campaign_id, Campaign.status == CampaignStatus.SENDING)
+        .values(status=CampaignStatus.COMPLETED)
+    )
+    await db.commit()
+    return bool(res.rowcount)
+
+async def pending_count() -> int:
+    """尚未寄出的收件人數 (使用 ix_campaign_recipients_pending 部分索引)"""
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(
+            select(func.count()).select_from(CampaignRecipient)
+            .where(CampaignRecipient.sent_at.is_(None), CampaignRecipient.error.is_(None))
+        )).scalar()
+
+outbox_depth.collect = pending_count
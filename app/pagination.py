@@ -0,0 +1,35 @@
+"""Keyset (cursor) 分頁工具
+
+cursor 為排序鍵值的 urlsafe base64 JSON，不透露內部結構也不需要 OFFSET；
+每頁成本只與頁面大小有關，資料表再大也一樣。
+"""
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+def encode_cursor(*values) -> str:
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """依 types (例如 datetime, int) 還原 cursor；格式錯誤時回 400"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if len(payload) != len(types):
+            raise ValueError
+        return tuple(datetime.fromisoformat(v) if t is datetime else t(v) for t, v in zip(types, payload))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="無效的 cursor")
+
+def after(columns, values, descending: bool = True):
+    """排序鍵在 cursor 之後的條件 (row comparison，可直接使用複合索引)"""
+    return tuple_(*columns) < tuple_(*values) if descending else tuple_(*columns) > tuple_(*values)
+
+def page_of(rows: list, limit: int, key) -> tuple:
+    """rows 應多查一筆 (limit + 1) 用來判斷是否還有下一頁；回傳 (本頁資料, next_cursor)"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
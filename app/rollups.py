@@ -0,0 +1,265 @@
+"""Dashboard rollup：由寫入路徑增量維護計數器，讀取成本與資料量無關。
+
+計數器若因異常中斷而漂移，可執行完整重建：
+
+    python -m app.rollups rebuild
+"""
+import asyncio
+import sys
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import func, delete, update, exists
+from sqlalchemy.dialects.postgresql import insert
+from .cache import TTLCache
+from .config import settings
+from .engagement import rebuild_engagement
+from .models import (
+    Customer, Course, Event, EventRegistration, customer_courses,
+    DashboardCounter, EventRollup, CompanyRollup
+)
+from .stats import (
+    SEGMENT_LIMIT, OTHER_COMPANY, company_key, event_conversion_query,
+    compute_dashboard_stats, format_dashboard
+)
+
+# DashboardCounter.name 對應 DashboardStats 欄位
+CUSTOMERS = "total_customers"
+PURCHASES = "total_purchases"
+REVENUE = "total_revenue"
+ATTENDEES = "unique_event_attendees"
+CONVERTED = "converted_purchasers"
+COUNTERS = (CUSTOMERS, PURCHASES, REVENUE, ATTENDEES, CONVERTED)
+
+stats_cache = TTLCache(ttl=settings.STATS_CACHE_TTL)
+
+# --- 低階累加 (UPSERT + 原子遞增，可安全並行) ---
+
+async def _bump(db: AsyncSession, **deltas):
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        stmt = insert(DashboardCounter).values(name=name, value=delta)
+        await db.execute(stmt.on_conflict_do_update(index_elements=[DashboardCounter.name], set_={"value": DashboardCounter.value + stmt.excluded.value}))
+
+async def _bump_company(db: AsyncSession, company, delta: int):
+    stmt = insert(CompanyRollup).values(company=company or OTHER_COMPANY, count=delta)
+    await db.execute(stmt.on_conflict_do_update(index_elements=[CompanyRollup.company], set_={"count": CompanyRollup.count + stmt.excluded.count}))
+
+async def _bump_event(db: AsyncSession, event_id: int, registrations: int = 0, converted: int = 0):
+    stmt = insert(EventRollup).values(event_id=event_id, registrations=registrations, converted=converted)
+    await db.execute(stmt.on_conflict_do_update(index_elements=[EventRollup.event_id], set_={
+        "registrations": EventRollup.registrations + stmt.excluded.registrations,
+        "converted": EventRollup.converted + stmt.excluded.converted,
+    }))
+
+async def _is_purchaser(db: AsyncSession, customer_id: int) -> bool:
+    return bool((await db.execute(select(exists().where(customer_courses.c.customer_id == customer_id)))).scalar())
+
+async def _is_attendee(db: AsyncSession, customer_id: int) -> bool:
+    return bool((await db.execute(select(exists().where(EventRegistration.customer_id == customer_id)))).scalar())
+
+# --- 寫入路徑 hooks (與資料異動在同一交易內呼叫) ---
+
+async def on_customer_created(db: AsyncSession, customer: Customer):
+    await _bump(db, **{CUSTOMERS: 1})
+    await _bump_company(db, customer.company, 1)
+
+async def on_registration_added(db: AsyncSession, customer_id: int, event_id: int):
+    """需在新增 EventRegistration 之前呼叫"""
+    purchaser = await _is_purchaser(db, customer_id)
+    first_registration = not await _is_attendee(db, customer_id)
+    await _bump_event(db, event_id, registrations=1, converted=int(purchaser))
+    if first_registration:
+        await _bump(db, **{ATTENDEES: 1, CONVERTED: int(purchaser)})
+
+async def on_course_enrolled(db: AsyncSession, customer_id: int, course: Course):
+    """需在寫入 customer_courses 之前呼叫"""
+    await _bump(db, **{PURCHASES: 1, REVENUE: course.price})
+    if await _is_purchaser(db, customer_id):
+        return
+    # 首次購買：該客戶報名過的活動皆轉換 +1
+    reg_events = select(EventRegistration.event_id).where(EventRegistration.customer_id == customer_id)
+    await db.execute(update(EventRollup).where(EventRollup.event_id.in_(reg_events)).values(converted=EventRollup.converted + 1))
+    if await _is_attendee(db, customer_id):
+        await _bump(db, **{CONVERTED: 1})
+
+async def on_customer_deleted(db: AsyncSession, customer: Customer):
+    """需在刪除客戶之前呼叫"""
+    purchase_row = (await db.execute(
+        select(func.count(), func.coalesce(func.sum(Course.price), 0))
+        .select_from(customer_courses)
+        .join(Course, Course.id == customer_courses.c.course_id)
+        .where(customer_courses.c.customer_id == customer.id)
+    )).one()
+    purchases, revenue = purchase_row[0] or 0, float(purchase_row[1] or 0)
+    purchaser = purchases > 0
+
+    reg_events = select(EventRegistration.event_id).where(EventRegistration.customer_id == customer.id)
+    await db.execute(update(EventRollup).where(EventRollup.event_id.in_(reg_events)).values(
+        registrations=EventRollup.registrations - 1,
+        converted=EventRollup.converted - int(purchaser),
+    ))
+    attendee = await _is_attendee(db, customer.id)
+
+    await _bump(db, **{
+        CUSTOMERS: -1, PURCHASES: -purchases, REVENUE: -revenue,
+        ATTENDEES: -int(attendee), CONVERTED: -int(attendee and purchaser),
+    })
+    await _bump_company(db, customer.company, -1)
+
+async def apply_import_deltas(db: AsyncSession, inserted, new_regs):
+    """批次匯入的集合式版本：inserted 為新建客戶 (id, company)，new_regs 為新報名 (customer_id, event_id)
+
+    需在報名寫入之後呼叫；每個 chunk 固定幾個語句，不隨列數增加
+    """
+    if inserted:
+        await _bump(db, **{CUSTOMERS: len(inserted)})
+        companies: dict = {}
+        for r in inserted:
+            key = r.company or OTHER_COMPANY
+            companies[key] = companies.get(key, 0) + 1
+        for company, delta in companies.items():
+            await _bump_company(db, company, delta)
+    if not new_regs:
+        return
+
+    added: dict = {}
+    for cid, _ in new_regs:
+        added[cid] = added.get(cid, 0) + 1
+    ids = list(added)
+    totals = dict((await db.execute(
+        select(EventRegistration.customer_id, func.count())
+        .where(EventRegistration.customer_id.in_(ids))
+        .group_by(EventRegistration.customer_id)
+    )).all())
+    purchasers = set((await db.execute(
+        select(customer_courses.c.customer_id).where(customer_courses.c.customer_id.in_(ids)).distinct()
+    )).scalars().all())
+
+    per_event: dict = {}
+    for cid, eid in new_regs:
+        regs, conv = per_event.get(eid, (0, 0))
+        per_event[eid] = (regs + 1, conv + int(cid in purchasers))
+    for eid, (regs, conv) in per_event.items():
+        await _bump_event(db, eid, registrations=regs, converted=conv)
+
+    first_time = [cid for cid in ids if totals.get(cid, 0) == added[cid]]
+    await _bump(db, **{ATTENDEES: len(first_time), CONVERTED: sum(1 for cid in first_time if cid in purchasers)})
+
+async def apply_customer_deltas(db: AsyncSession, customer_ids, sign: int):
+    """一群客戶對所有 rollup 的貢獻：sign=-1 扣除、+1 加回
+
+    合併客戶時在搬移資料前對所有相關客戶扣除，搬移後對保留的客戶加回；語句數固定，不隨人數增加
+    """
+    ids = list(customer_ids)
+    if not ids:
+        return
+    purchase_row = (await db.execute(
+        select(func.count(), func.coalesce(func.sum(Course.price), 0))
+        .select_from(customer_courses)
+        .join(Course, Course.id == customer_courses.c.course_id)
+        .where(customer_courses.c.customer_id.in_(ids))
+    )).one()
+    purchasers = select(customer_courses.c.customer_id).where(customer_courses.c.customer_id.in_(ids))
+    is_purchaser = EventRegistration.customer_id.in_(purchasers)
+
+    ev_rows = (await db.execute(
+        select(EventRegistration.event_id, func.count(), func.count().filter(is_purchaser))
+        .where(EventRegistration.customer_id.in_(ids))
+        .group_by(EventRegistration.event_id)
+    )).all()
+    for event_id, regs, conv in ev_rows:
+        await _bump_event(db, event_id, registrations=sign * regs, converted=sign * conv)
+
+    attendees = (
+        select(EventRegistration.customer_id, is_purchaser.label("purchaser"))
+        .where(EventRegistration.customer_id.in_(ids)).distinct().subquery()
+    )
+    att_row = (await db.execute(select(func.count(), func.count().filter(attendees.c.purchaser)).select_from(attendees))).one()
+
+    company = company_key().label("company")
+    customers = 0
+    for name, count in (await db.execute(select(company, func.count()).where(Customer.id.in_(ids)).group_by(company))).all():
+        await _bump_company(db, name, sign * count)
+        customers += count
+    await _bump(db, **{
+        CUSTOMERS: sign * customers, PURCHASES: sign * (purchase_row[0] or 0), REVENUE: sign * float(purchase_row[1] or 0),
+        ATTENDEES: sign * att_row[0], CONVERTED: sign * att_row[1],
+    })
+
+# --- 讀取與重建 ---
+
+async def read_dashboard_stats(db: AsyncSession) -> dict:
+    """自 rollup 組出 DashboardStats，讀取筆數只與活動數有關"""
+    rows = (await db.execute(select(DashboardCounter.name, DashboardCounter.value))).all()
+    values = {r.name: r.value for r in rows}
+    totals = {name: (float(values.get(name, 0)) if name == REVENUE else int(values.get(name, 0))) for name in COUNTERS}
+
+    seg_rows = (await db.execute(
+        select(CompanyRollup.company, CompanyRollup.count)
+        .where(CompanyRollup.count > 0)
+        .order_by(CompanyRollup.count.desc())
+        .limit(SEGMENT_LIMIT)
+    )).all()
+    segments = [{"company": r.company, "count": r.count} for r in seg_rows]
+
+    ev_rows = (await db.execute(
+        select(Event.name, func.coalesce(EventRollup.registrations, 0).label("registrations"), func.coalesce(EventRollup.converted, 0).label("converted"))
+        .outerjoin(EventRollup, EventRollup.event_id == Event.id)
+        .order_by(Event.id)
+    )).all()
+    events = [{"name": r.name, "registrations": r.registrations, "converted": r.converted} for r in ev_rows]
+
+    totals["total_events"] = len(events)
+    return format_dashboard(totals, segments, events)
+
+async def get_cached_dashboard_stats(db: AsyncSession) -> dict:
+    stats = stats_cache.get()
+    if stats is None:
+        stats = await read_dashboard_stats(db)
+        stats_cache.set(stats)
+    return stats
+
+async def rebuild_rollups(db: AsyncSession):
+    """自原始資料表完整重建所有 rollup (修正漂移用)"""
+    stats = await compute_dashboard_stats(db)
+
+    await db.execute(delete(DashboardCounter))
+    await db.execute(insert(DashboardCounter), [{"name": name, "value": stats[name]} for name in COUNTERS])
+
+    company = company_key().label("company")
+    await db.execute(delete(CompanyRollup))
+    await db.execute(insert(CompanyRollup).from_select(
+        ["company", "count"],
+        select(company, func.count(Customer.id)).group_by(company),
+    ))
+
+    ev = event_conversion_query().subquery()
+    await db.execute(delete(EventRollup))
+    await db.execute(insert(EventRollup).from_select(
+        ["event_id", "registrations", "converted"],
+        select(ev.c.id, ev.c.registrations, ev.c.converted),
+    ))
+    await rebuild_engagement(db)
+    stats_cache.invalidate()
+
+async def ensure_rollups(db: AsyncSession):
+    """rollup 尚未初始化時 (例如首次部署) 自動重建"""
+    initialized = (await db.execute(select(exists().where(DashboardCounter.name == CUSTOMERS)))).scalar()
+    if not initialized:
+        print("📊 [Rollup] 尚未初始化，正在重建 Dashboard 統計...")
+        await rebuild_rollups(db)
+        await db.commit()
+
+async def _rebuild_main():
+    from .database import AsyncSessionLocal
+    async with AsyncSessionLocal() as db:
+        await rebuild_rollups(db)
+        await db.commit()
+    print("✅ [Rollup] Dashboard 統計與活動成效已完整重建")
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("用法: python -m app.rollups rebuild")
+        sys.exit(1)
+    asyncio.run(_rebuild_main())
@@ -1,36 +1,58 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import func, insert, desc, text
 from sqlalchemy.orm import selectinload
-from typing import List, Optional
-import base64
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import List, Optional, Union
 import os
 import json
 from datetime import datetime, timedelta, timezone
 from pydantic import BaseModel
-from google_auth_oauthlib.flow import Flow
 
-from .database import get_db
+from .database import get_db, get_read_db
 from .models import (
     Customer, Interaction, Course, Event, customer_courses, 
-    EventRegistration, Campaign, CampaignStatus, CampaignRecipient, EmailTemplate
+    EventRegistration, Campaign, CampaignStatus, CampaignRecipient, EmailTemplate, Segment
 )
-from .email_utils import send_email, TOKEN_FILE
+from .email_utils import send_email, TOKEN_FILE, gmail_service_cache
 from .config import settings
+from .scheduler import delivery_engine, schedule_campaign, announce_campaign
+from .segments import SegmentError, compile_segment, count_audience, preview_audience, materialize_recipients
+from .templating import CompiledTemplate, get_template
+from .tracking import open_buffer, PIXEL_GIF
+from .pagination import decode_cursor, after, page_of
+from .checkin import bulk_check_in, attendance_board
+from .responses import fast_or_model
+from .customer_detail import touch_customers, customer_version, not_modified, read_header, interactions_page, registrations_page
+from .exporter import export_response, customers_query, registrations_query, recipients_query
+from .importer import import_rows, iter_lines, iter_csv_rows, iter_ndjson_rows
+from .interactions import ingest, iter_json_array
+from .engagement import open_curves, company_engagement
+from .dedup import MergeError, merge_customers, suggestions_page, dismiss_suggestion, start_scan, last_scan
+from .rollups import (
+    get_cached_dashboard_stats, rebuild_rollups, stats_cache,
+    on_customer_created, on_registration_added, on_course_enrolled, on_customer_deleted
+)
 from .schemas import (
-    CustomerCreate, CustomerResponse, DashboardStats,
-    EventResponse, EventCreate, EventListResponse, CampaignCreateRequest, TemplateCreate,
-    TestEmailRequest, CustomerDetailResponse
+    CustomerCreate, CustomerResponse, CustomerPage, DuplicatePage, MergeRequest, DashboardStats,
+    EventResponse, EventCreate, EventPage, EventSummary, CheckInRequest, CheckInResult, CampaignCreateRequest, CampaignPage,
+    CampaignSummary, CampaignOpenCurve, CompanyEngagement, SegmentCreate, SegmentResponse, SegmentPreviewRequest, TemplateCreate, TestEmailRequest, CustomerDetailResponse, InteractionPage, RegistrationPage
 )
 
 router = APIRouter(prefix="/customers", tags=["customers"])
 
+# 測試信與範本預覽用的範例資料
+SAMPLE_VALUES = {"name": "測試員", "company": "測試公司", "email": "test@example.com", "phone": "0900000000", "events": "測試活動"}
+
 # --- Google OAuth 設定 (省略，保持不變) ---
 SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
 REDIRECT_URI = "http://localhost:8080/customers/marketing/callback"
 
 def get_google_flow():
+    from google_auth_oauthlib.flow import Flow  # 只有授權流程需要，延後載入
     if settings.GOOGLE_CLIENT_ID and settings.GOOGLE_CLIENT_SECRET:
         client_config = {
             "web": {
@@ -59,6 +81,7 @@ async def auth_callback(code: str):
     creds = flow.credentials
     with open(TOKEN_FILE, "w") as token:
         token.write(creds.to_json())
+    gmail_service_cache.invalidate() # 下次寄信改用新 Token
     return RedirectResponse(url="/")
 
 @router.get("/marketing/status")
@@ -67,38 +90,15 @@ def get_auth_status():
 
 # --- Stats ---
 @router.get("/stats", response_model=DashboardStats)
-async def get_dashboard_stats(db: AsyncSession = Depends(get_db)):
-    cust_res = await db.execute(select(Customer).options(selectinload(Customer.courses), selectinload(Customer.registrations)))
-    customers = cust_res.scalars().all()
-    all_events = (await db.execute(select(Event))).scalars().all()
-
-    total_revenue = sum(sum(course.price for course in c.courses) for c in customers)
-    total_purchases = sum(len(c.courses) for c in customers)
-    attendee_ids = {c.id for c in customers if c.registrations}
-    purchaser_ids = {c.id for c in customers if c.courses}
-    converted = len(attendee_ids.intersection(purchaser_ids))
-
-    comp_map = {}
-    for c in customers:
-        name = c.company or "其他"
-        comp_map[name] = comp_map.get(name, 0) + 1
-    segments = [{"company": k, "count": v} for k, v in sorted(comp_map.items(), key=lambda x: x[1], reverse=True)[:5]]
-
-    top_events = []
-    for ev in all_events:
-        regs = [c for c in customers if any(r.event_id == ev.id for r in c.registrations)]
-        conv = [c for c in regs if c.courses]
-        top_events.append({"name": ev.name, "registrations": len(regs), "converted": len(conv), "rate": round(len(conv)/len(regs)*100, 2) if regs else 0})
-
-    return {
-        "total_customers": len(customers),
-        "total_events": len(all_events),
-        "total_purchases": total_purchases,
-        "total_revenue": total_revenue,
-        "unique_event_attendees": len(attendee_ids),
-        "converted_purchasers": converted, "conversion_rate": round(converted/len(attendee_ids)*100, 2) if attendee_ids else 0,
-        "customer_segments": segments, "top_converting_events": sorted(top_events, key=lambda x: x['rate'], reverse=True)
-    }
+async def get_dashboard_stats(db: AsyncSession = Depends(get_read_db)):
+    return await get_cached_dashboard_stats(db)
+
+@router.post("/stats/rebuild")
+async def rebuild_dashboard_stats(db: AsyncSession = Depends(get_db)):
+    """自原始資料完整重建 rollup，修正計數漂移"""
+    await rebuild_rollups(db)
+    await db.commit()
+    return {"status": "ok"}
 
 # --- Customer Management (核心修改點) ---
 
@@ -118,13 +118,38 @@ async def process_event_relations(db: AsyncSession, customer: Customer, events_s
             # 建立關聯 (如果還沒關聯)
             check = await db.execute(select(EventRegistration).where(EventRegistration.customer_id == customer.id, EventRegistration.event_id == event.id))
             if not check.scalars().first():
+                await on_registration_added(db, customer.id, event.id)
                 reg = EventRegistration(customer_id=customer.id, event_id=event.id, attended=True)
                 db.add(reg)
+                await touch_customers(db, [customer.id])
+
+CUSTOMER_FIELDS = {"id": Customer.id, "name": Customer.name, "email": Customer.email, "phone": Customer.phone, "company": Customer.company, "created_at": Customer.created_at}
+
+@router.get("/", response_model=CustomerPage)
+async def read_customers(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    q: Optional[str] = Query(None, description="搜尋姓名 / Email / 公司"),
+    fields: Optional[str] = Query(None, description="只回傳指定欄位，例如 id,name,email"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """依 (created_at, id) 由新到舊的 keyset 分頁"""
+    names = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(CUSTOMER_FIELDS)
+    unknown = [f for f in names if f not in CUSTOMER_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知欄位: {', '.join(unknown)}")
+    # 分頁鍵一律查出，回傳時再依 fields 篩選
+    columns = [CUSTOMER_FIELDS[f] for f in dict.fromkeys(names + ["created_at", "id"])]
+
+    query = select(*columns).order_by(Customer.created_at.desc(), Customer.id.desc()).limit(limit + 1)
+    if cursor:
+        query = query.where(after((Customer.created_at, Customer.id), decode_cursor(cursor, datetime, int)))
+    if q and q.strip():
+        term = q.strip()
+        query = query.where(Customer.name.icontains(term, autoescape=True) | Customer.email.icontains(term, autoescape=True) | Customer.company.icontains(term, autoescape=True))
 
-@router.get("/", response_model=List[CustomerResponse])
-async def read_customers(db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(Customer).order_by(Customer.created_at.desc()))
-    return res.scalars().all()
+    rows, next_cursor = page_of((await db.execute(query)).all(), limit, key=lambda r: (r.created_at, r.id))
+    return fast_or_model({"items": [{f: getattr(r, f) for f in names} for r in rows], "next_cursor": next_cursor})
 
 @router.post("/", response_model=CustomerResponse)
 async def create_customer(customer: CustomerCreate, db: AsyncSession = Depends(get_db)):
@@ -132,6 +157,7 @@ async def create_customer(customer: CustomerCreate, db: AsyncSession = Depends(g
         # 1. 建立客戶
         db_c = Customer(name=customer.name, email=customer.email, phone=customer.phone, company=customer.company)
         db.add(db_c)
+        await on_customer_created(db, db_c)
         await db.commit()
         await db.refresh(db_c)
 
@@ -139,7 +165,8 @@ async def create_customer(customer: CustomerCreate, db: AsyncSession = Depends(g
         if customer.events_str:
             await process_event_relations(db, db_c, customer.events_str)
             await db.commit()
-            
+
+        stats_cache.invalidate()
         return db_c
     except Exception as e:
         await db.rollback()
@@ -148,55 +175,209 @@ async def create_customer(customer: CustomerCreate, db: AsyncSession = Depends(g
 
 @router.post("/import")
 async def import_customers(customers: List[CustomerCreate], db: AsyncSession = Depends(get_db)):
-    """批次匯入 API"""
-    success_count = 0
-    errors = []
-    
-    for c in customers:
+    """批次匯入 API (JSON 陣列)；大量資料請改用 /import/stream"""
+    async def rows():
+        for i, c in enumerate(customers):
+            yield i + 1, c.model_dump()
+
+    result = await import_rows(db, rows())
+    stats_cache.invalidate()
+    return result.as_dict()
+
+@router.post("/import/stream")
+async def import_customers_stream(request: Request, format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"), db: AsyncSession = Depends(get_db)):
+    """串流匯入 CSV / NDJSON，邊讀邊寫，不需將整個檔案載入記憶體
+
+    格式由 format 參數或 Content-Type 決定 (預設 CSV)
+    """
+    content_type = request.headers.get("content-type", "")
+    fmt = format or ("ndjson" if "ndjson" in content_type or "jsonl" in content_type else "csv")
+    lines = iter_lines(request.stream())
+    rows = iter_ndjson_rows(lines) if fmt == "ndjson" else iter_csv_rows(lines)
+    result = await import_rows(db, rows)
+    stats_cache.invalidate()
+    print(f"📥 [Import] {fmt}: 成功 {result.success} 筆，新客戶 {result.created} 筆，錯誤 {result.error_count} 筆")
+    return result.as_dict()
+
+@router.post("/interactions/batch")
+async def ingest_interactions(request: Request, format: Optional[str] = Query(None, pattern="^(json|ndjson)$"), db: AsyncSession = Depends(get_db)):
+    """批次寫入互動紀錄：JSON 陣列或 NDJSON (串流解析)，單筆錯誤不影響其他資料
+
+    格式由 format 參數或 Content-Type 決定 (預設 JSON 陣列)
+    """
+    content_type = request.headers.get("content-type", "")
+    fmt = format or ("ndjson" if "ndjson" in content_type or "jsonl" in content_type else "json")
+    if fmt == "ndjson":
+        rows = iter_ndjson_rows(iter_lines(request.stream()))
+    else:
         try:
-            # 檢查 Email 是否存在
-            res = await db.execute(select(Customer).where(Customer.email == c.email))
-            exist = res.scalars().first()
-            
-            if not exist:
-                new_c = Customer(name=c.name, email=c.email, phone=c.phone, company=c.company)
-                db.add(new_c)
-                await db.flush() # 取得 ID 供關聯使用
-                exist = new_c
-            
-            # 無論是新舊客戶，都更新關聯
-            await process_event_relations(db, exist, c.events_str)
-            success_count += 1
-        except Exception as e:
-            errors.append(f"{c.email}: {str(e)}")
-            continue
-    
+            items = json.loads(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"JSON 格式錯誤: {e}")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="請傳入 JSON 陣列")
+        rows = iter_json_array(items)
+    result = await ingest(db, rows)
+    return result.as_dict()
+
+# --- 重複客戶 (需定義在 /{customer_id} 相關路由之前) ---
+@router.get("/duplicates", response_model=DuplicatePage)
+async def list_duplicates(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    min_score: float = Query(0, ge=0, le=1),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """疑似重複的客戶配對，依分數由高到低 (keyset 分頁)；資料來自最近一次掃描"""
+    return await suggestions_page(db, limit, cursor, min_score)
+
+@router.post("/duplicates/scan", status_code=status.HTTP_202_ACCEPTED)
+async def scan_duplicates():
+    """在背景重新掃描，完成前列表仍為上次的結果；進度見 GET /duplicates/scan"""
+    return {"status": "started" if start_scan() else "running"}
+
+@router.get("/duplicates/scan")
+async def duplicate_scan_status():
+    return last_scan
+
+@router.delete("/duplicates/{customer_id}/{duplicate_id}")
+async def dismiss_duplicate(customer_id: int, duplicate_id: int, db: AsyncSession = Depends(get_db)):
+    """標記為「不是重複」，之後重新掃描也不會再出現"""
+    if not await dismiss_suggestion(db, customer_id, duplicate_id):
+        raise HTTPException(status_code=404, detail="找不到此配對")
+    await db.commit()
+    return {"status": "ok"}
+
+@router.post("/merge")
+async def merge_duplicate_customers(request: MergeRequest, db: AsyncSession = Depends(get_db)):
+    """合併重複客戶：每組保留 keep_id，其餘客戶的互動、課程、報名與行銷紀錄改指到保留的客戶後刪除
+
+    所有群組在同一個交易內完成，任一客戶不存在時整批不執行
+    """
+    groups: dict = {}
+    for g in request.groups:
+        groups.setdefault(g.keep_id, []).extend(g.merge_ids)
+    if sum(len(ids) + 1 for ids in groups.values()) > settings.DEDUP_MERGE_MAX:
+        raise HTTPException(status_code=400, detail=f"每次最多合併 {settings.DEDUP_MERGE_MAX} 位客戶")
+    try:
+        result = await merge_customers(db, groups)
+    except MergeError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
     await db.commit()
-    return {"message": f"成功匯入 {success_count} 筆", "errors": errors}
+    stats_cache.invalidate()
+    print(f"🔗 [Dedup] {result['merged']} 位客戶併入 {result['groups']} 位")
+    return result
+
+# --- 串流匯出 (需定義在 /{customer_id} 相關路由之前) ---
+ExportFormat = Query("csv", pattern="^(csv|ndjson)$")
+
+@router.get("/export/customers")
+async def export_customers(format: str = ExportFormat):
+    return export_response(customers_query(), "customers", format)
+
+@router.get("/export/registrations")
+async def export_registrations(format: str = ExportFormat):
+    return export_response(registrations_query(), "registrations", format)
+
+@router.get("/export/campaigns/{campaign_id}/recipients")
+async def export_campaign_recipients(campaign_id: int, format: str = ExportFormat, db: AsyncSession = Depends(get_db)):
+    """收件人與發送狀態 (pending / sent / opened / failed)"""
+    if not (await db.execute(select(Campaign.id).where(Campaign.id == campaign_id))).scalar():
+        raise HTTPException(status_code=404, detail="找不到行銷活動")
+    return export_response(recipients_query(campaign_id), f"campaign-{campaign_id}-recipients", format)
 
 @router.delete("/{customer_id}")
 async def delete_customer(customer_id: int, db: AsyncSession = Depends(get_db)):
     res = await db.execute(select(Customer).where(Customer.id == customer_id))
     c = res.scalars().first()
-    if c: await db.delete(c); await db.commit()
+    if c:
+        await on_customer_deleted(db, c)
+        await db.delete(c); await db.commit()
+        stats_cache.invalidate()
+    return {"status": "ok"}
+
+@router.post("/{customer_id}/courses/{course_id}")
+async def enroll_course(customer_id: int, course_id: int, db: AsyncSession = Depends(get_db)):
+    """課程報名 (寫入 customer_courses 並更新 rollup)"""
+    course = (await db.execute(select(Course).where(Course.id == course_id))).scalars().first()
+    customer = (await db.execute(select(Customer.id).where(Customer.id == customer_id))).scalar()
+    if not course or not customer:
+        raise HTTPException(status_code=404, detail="找不到客戶或課程")
+    enrolled = await db.execute(select(customer_courses).where(customer_courses.c.customer_id == customer_id, customer_courses.c.course_id == course_id))
+    if enrolled.first():
+        return {"status": "ok"}
+    await on_course_enrolled(db, customer_id, course)
+    await db.execute(insert(customer_courses).values(customer_id=customer_id, course_id=course_id))
+    await touch_customers(db, [customer_id])
+    await db.commit()
+    stats_cache.invalidate()
     return {"status": "ok"}
 
 @router.get("/{customer_id}", response_model=CustomerDetailResponse)
-async def read_customer(customer_id: int, db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(Customer).options(selectinload(Customer.interactions), selectinload(Customer.courses), selectinload(Customer.registrations)).where(Customer.id == customer_id))
-    return res.scalars().first()
+async def read_customer(customer_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    """客戶表頭 (基本資料、計數、課程)；未變更時回 304，不查詢關聯資料"""
+    version = await customer_version(db, customer_id)
+    cached = not_modified(request, response, customer_id, version)
+    if cached:
+        return cached
+    return await read_header(db, customer_id)
+
+@router.get("/{customer_id}/interactions", response_model=InteractionPage)
+async def read_customer_interactions(
+    customer_id: int, request: Request, response: Response,
+    limit: int = Query(20, ge=1, le=200), cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    version = await customer_version(db, customer_id)
+    cached = not_modified(request, response, customer_id, version)
+    if cached:
+        return cached
+    return await interactions_page(db, customer_id, limit, cursor)
+
+@router.get("/{customer_id}/registrations", response_model=RegistrationPage)
+async def read_customer_registrations(
+    customer_id: int, request: Request, response: Response,
+    limit: int = Query(20, ge=1, le=200), cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    version = await customer_version(db, customer_id)
+    cached = not_modified(request, response, customer_id, version)
+    if cached:
+        return cached
+    return await registrations_page(db, customer_id, limit, cursor)
 
 # --- Other APIs (Events, Marketing) ---
-@router.get("/events/", response_model=List[EventListResponse])
-async def read_events(db: AsyncSession = Depends(get_db)):
-    events = (await db.execute(select(Event).order_by(Event.date.desc()))).scalars().all()
-    output = []
-    for e in events:
-        reg_res = await db.execute(select(EventRegistration).where(EventRegistration.event_id == e.id))
-        regs = reg_res.scalars().all()
-        checked = sum(1 for r in regs if r.attended)
-        output.append({"id": e.id, "name": e.name, "date": e.date, "location": e.location, "attendee_count": len(regs), "checkin_count": checked, "attendance_rate": round(checked/len(regs)*100, 2) if regs else 0})
-    return output
+@router.get("/events/", response_model=Union[EventPage, EventSummary])
+async def read_events(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    summary: bool = Query(False, description="只回傳總計 (Dashboard 小工具用)"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """依 (date, id) 由新到舊分頁；報名 / 簽到數以單一 GROUP BY 查詢取得"""
+    if summary:
+        row = (await db.execute(
+            select(func.count(Event.id.distinct()), func.count(EventRegistration.event_id), func.count(EventRegistration.event_id).filter(EventRegistration.attended.is_(True)))
+            .select_from(Event).outerjoin(EventRegistration, EventRegistration.event_id == Event.id)
+        )).one()
+        events, regs, checked = row
+        return {"total_events": events, "total_registrations": regs, "total_checkins": checked, "attendance_rate": round(checked/regs*100, 2) if regs else 0}
+
+    page = select(Event.id, Event.name, Event.date, Event.location).order_by(Event.date.desc(), Event.id.desc()).limit(limit + 1)
+    if cursor:
+        page = page.where(after((Event.date, Event.id), decode_cursor(cursor, datetime, int)))
+    page = page.subquery()
+    query = (
+        select(page, func.count(EventRegistration.event_id).label("attendee_count"), func.count(EventRegistration.event_id).filter(EventRegistration.attended.is_(True)).label("checkin_count"))
+        .outerjoin(EventRegistration, EventRegistration.event_id == page.c.id)
+        .group_by(page.c.id, page.c.name, page.c.date, page.c.location)
+        .order_by(page.c.date.desc(), page.c.id.desc())
+    )
+    rows, next_cursor = page_of((await db.execute(query)).all(), limit, key=lambda r: (r.date, r.id))
+    return fast_or_model({"items": [
+        {**r._mapping, "attendance_rate": round(r.checkin_count/r.attendee_count*100, 2) if r.attendee_count else 0} for r in rows
+    ], "next_cursor": next_cursor})
 
 @router.post("/events/", response_model=EventResponse)
 async def create_event(event: EventCreate, db: AsyncSession = Depends(get_db)):
@@ -204,8 +385,40 @@ async def create_event(event: EventCreate, db: AsyncSession = Depends(get_db)):
     db.add(db_e); await db.commit(); await db.refresh(db_e)
     return db_e
 
+@router.post("/events/{event_id}/checkin", response_model=CheckInResult)
+async def check_in(event_id: int, request: CheckInRequest, db: AsyncSession = Depends(get_db)):
+    """現場批次簽到：一批客戶 id / Email 以單一語句寫入"""
+    size = len(request.customer_ids) + len(request.emails)
+    if not size:
+        raise HTTPException(status_code=400, detail="請提供客戶 id 或 Email")
+    if size > settings.CHECKIN_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"每批最多 {settings.CHECKIN_BATCH_MAX} 筆")
+    if not (await db.execute(select(Event.id).where(Event.id == event_id))).first():
+        raise HTTPException(status_code=404, detail="找不到活動")
+    result = await bulk_check_in(db, event_id, request.customer_ids, request.emails, request.register_walk_ins)
+    await db.commit()
+    if result["walk_ins"]:
+        stats_cache.invalidate()
+    attendance_board.apply(event_id, checked_in=result["checked_in"], registrations=result["walk_ins"])
+    return result
+
+@router.get("/events/{event_id}/live")
+async def live_attendance(event_id: int):
+    """出席數即時推播 (Server-Sent Events)"""
+    return StreamingResponse(
+        attendance_board.stream(event_id), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.post("/marketing/campaigns")
 async def create_campaign(request: CampaignCreateRequest, db: AsyncSession = Depends(get_db)):
+    if not request.customer_ids and request.segment_id is None:
+        raise HTTPException(status_code=400, detail="請指定收件人或受眾分群")
+    segment = None
+    if request.segment_id is not None:
+        segment = (await db.execute(select(Segment).where(Segment.id == request.segment_id))).scalars().first()
+        if not segment:
+            raise HTTPException(status_code=404, detail="找不到受眾分群")
     try:
         final_time = request.scheduled_at
         if not final_time:
@@ -213,54 +426,183 @@ async def create_campaign(request: CampaignCreateRequest, db: AsyncSession = Dep
         else:
             final_time = final_time.astimezone(timezone.utc)
         
-        campaign = Campaign(name=request.name, subject=request.subject, body=request.body, scheduled_at=final_time, status=CampaignStatus.SCHEDULED)
-        db.add(campaign); await db.commit(); await db.refresh(campaign)
-        
+        campaign = Campaign(name=request.name, subject=request.subject, body=request.body, scheduled_at=final_time, status=CampaignStatus.SCHEDULED, segment_id=request.segment_id)
+        db.add(campaign); await db.flush()
+
+        # 活動與收件人同一交易寫入，定時任務觸發時收件人必定已存在
+        recipients = 0
+        if segment:
+            recipients += await materialize_recipients(db, campaign.id, segment.definition)
         if request.customer_ids:
-            await db.execute(insert(CampaignRecipient), [{"campaign_id": campaign.id, "customer_id": cid} for cid in request.customer_ids])
-            await db.commit()
-        return {"id": campaign.id, "message": "Success"}
+            added = await db.execute(
+                pg_insert(CampaignRecipient).on_conflict_do_nothing().returning(CampaignRecipient.customer_id),
+                [{"campaign_id": campaign.id, "customer_id": cid} for cid in dict.fromkeys(request.customer_ids)],
+            )
+            recipients += len(added.all())
+        await announce_campaign(db, campaign.id, final_time)
+        await db.commit()
+        schedule_campaign(campaign.id, final_time)
+        return {"id": campaign.id, "recipients": recipients, "message": "Success"}
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/marketing/campaigns")
-async def list_campaigns(db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(Campaign).order_by(Campaign.created_at.desc()))
-    campaigns = res.scalars().all()
-    output = []
-    for c in campaigns:
-        total = (await db.execute(select(func.count(CampaignRecipient.customer_id)).where(CampaignRecipient.campaign_id == c.id))).scalar() or 0
-        opened = (await db.execute(select(func.count(CampaignRecipient.opened_at)).where(CampaignRecipient.campaign_id == c.id))).scalar() or 0
-        output.append({"id": c.id, "name": c.name, "status": c.status.value, "total_recipients": total, "opened_count": opened, "open_rate": round(opened/total*100, 2) if total else 0, "scheduled_at": c.scheduled_at})
-    return output
+@router.get("/marketing/campaigns", response_model=Union[CampaignPage, CampaignSummary])
+async def list_campaigns(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    summary: bool = Query(False, description="只回傳各狀態數量與總開信率"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """依 (created_at, id) 由新到舊分頁；收件 / 開信數以單一 GROUP BY 查詢取得"""
+    if summary:
+        rows = (await db.execute(
+            select(Campaign.status, func.count(Campaign.id.distinct()), func.count(CampaignRecipient.customer_id), func.count(CampaignRecipient.opened_at))
+            .outerjoin(CampaignRecipient, CampaignRecipient.campaign_id == Campaign.id)
+            .group_by(Campaign.status)
+        )).all()
+        total = sum(r[2] for r in rows)
+        opened = sum(r[3] for r in rows)
+        return {
+            "total_campaigns": sum(r[1] for r in rows), "by_status": {r[0].value: r[1] for r in rows if r[0]},
+            "total_recipients": total, "opened_count": opened, "open_rate": round(opened/total*100, 2) if total else 0,
+        }
+
+    page = select(Campaign.id, Campaign.name, Campaign.status, Campaign.scheduled_at, Campaign.created_at).order_by(Campaign.created_at.desc(), Campaign.id.desc()).limit(limit + 1)
+    if cursor:
+        page = page.where(after((Campaign.created_at, Campaign.id), decode_cursor(cursor, datetime, int)))
+    page = page.subquery()
+    query = (
+        select(page, func.count(CampaignRecipient.customer_id).label("total"), func.count(CampaignRecipient.opened_at).label("opened"))
+        .outerjoin(CampaignRecipient, CampaignRecipient.campaign_id == page.c.id)
+        .group_by(page.c.id, page.c.name, page.c.status, page.c.scheduled_at, page.c.created_at)
+        .order_by(page.c.created_at.desc(), page.c.id.desc())
+    )
+    rows, next_cursor = page_of((await db.execute(query)).all(), limit, key=lambda r: (r.created_at, r.id))
+    return fast_or_model({"items": [
+        {"id": c.id, "name": c.name, "status": c.status.value, "total_recipients": c.total, "opened_count": c.opened, "open_rate": round(c.opened/c.total*100, 2) if c.total else 0, "scheduled_at": c.scheduled_at}
+        for c in rows
+    ], "next_cursor": next_cursor})
+
+@router.get("/marketing/campaigns/{campaign_id}/delivery")
+async def get_delivery_report(campaign_id: int):
+    """最近一次發送的吞吐量報告 (封/秒)"""
+    report = delivery_engine.reports.get(campaign_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="此活動尚無發送紀錄")
+    return report.as_dict()
+
+# --- 成效分析 (只讀 campaign_engagement rollup) ---
+MAX_CURVE_CAMPAIGNS = 20
+
+def _campaign_ids(value: Optional[str]) -> List[int]:
+    try:
+        ids = list(dict.fromkeys(int(v) for v in value.split(",") if v.strip())) if value else []
+    except ValueError:
+        raise HTTPException(status_code=400, detail="campaign_ids 須為以逗號分隔的活動 ID")
+    if len(ids) > MAX_CURVE_CAMPAIGNS:
+        raise HTTPException(status_code=400, detail=f"一次最多比較 {MAX_CURVE_CAMPAIGNS} 個活動")
+    return ids
+
+@router.get("/marketing/analytics/opens", response_model=List[CampaignOpenCurve])
+async def get_open_curves(
+    campaign_ids: str = Query(..., description="以逗號分隔的活動 ID，例如 3,5,8"),
+    hours: int = Query(72, ge=1, le=24 * 30),
+    step: int = Query(1, ge=1, le=24, description="每個點涵蓋的小時數"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """各活動寄出後逐小時的開信曲線，可多個活動並列比較"""
+    ids = _campaign_ids(campaign_ids)
+    if not ids:
+        raise HTTPException(status_code=400, detail="請指定至少一個活動")
+    return await open_curves(db, ids, hours, step)
+
+@router.get("/marketing/analytics/companies", response_model=List[CompanyEngagement])
+async def get_company_engagement(
+    campaign_ids: Optional[str] = Query(None, description="以逗號分隔的活動 ID，未指定為全部活動"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(20, ge=1, le=500),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """依公司彙總寄出 / 開信數 (以寄出 / 開信發生的時間桶篩選)"""
+    return await company_engagement(db, _campaign_ids(campaign_ids), since, until, limit)
+
+# --- 受眾分群 ---
+def _compiled(definition: dict):
+    try:
+        return compile_segment(definition)
+    except SegmentError as e:
+        raise HTTPException(status_code=400, detail=f"分群條件錯誤: {e}")
+
+@router.get("/marketing/segments", response_model=List[SegmentResponse])
+async def list_segments(db: AsyncSession = Depends(get_db)):
+    return (await db.execute(select(Segment).order_by(Segment.id))).scalars().all()
+
+@router.post("/marketing/segments", response_model=SegmentResponse)
+async def create_segment(segment: SegmentCreate, db: AsyncSession = Depends(get_db)):
+    _compiled(segment.definition)
+    db_s = Segment(name=segment.name, definition=segment.definition)
+    db.add(db_s); await db.commit(); await db.refresh(db_s)
+    return db_s
+
+@router.delete("/marketing/segments/{segment_id}")
+async def delete_segment(segment_id: int, db: AsyncSession = Depends(get_db)):
+    s = (await db.execute(select(Segment).where(Segment.id == segment_id))).scalars().first()
+    if s:
+        await db.delete(s); await db.commit()
+    return {"status": "ok"}
+
+@router.post("/marketing/segments/preview")
+async def preview_segment(request: SegmentPreviewRequest, db: AsyncSession = Depends(get_read_db)):
+    """試算符合條件的人數 (單一 COUNT 查詢) 並附上前 10 筆"""
+    _compiled(request.definition)
+    return await preview_audience(db, request.definition)
+
+@router.get("/marketing/segments/{segment_id}/count")
+async def count_segment(segment_id: int, db: AsyncSession = Depends(get_read_db)):
+    s = (await db.execute(select(Segment).where(Segment.id == segment_id))).scalars().first()
+    if not s:
+        raise HTTPException(status_code=404, detail="找不到受眾分群")
+    _compiled(s.definition)
+    return {"id": s.id, "count": await count_audience(db, s.definition)}
 
 @router.get("/marketing/templates")
 async def get_templates(db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(EmailTemplate).order_by(EmailTemplate.created_at.desc()))
-    return res.scalars().all()
+    res = await db.execute(
+        select(EmailTemplate.id, EmailTemplate.name, EmailTemplate.subject, EmailTemplate.body, EmailTemplate.created_at)
+        .order_by(EmailTemplate.created_at.desc())
+    )
+    return fast_or_model([r._asdict() for r in res])
 
 @router.post("/marketing/templates")
 async def create_template(request: TemplateCreate, db: AsyncSession = Depends(get_db)):
     tpl = EmailTemplate(**request.model_dump()); db.add(tpl); await db.commit()
     return tpl
 
+@router.get("/marketing/templates/{template_id}/preview")
+async def preview_template(template_id: int, customer_id: Optional[int] = None, db: AsyncSession = Depends(get_db)):
+    """以指定客戶 (或範例資料) 代入範本變數"""
+    tpl = (await db.execute(select(EmailTemplate).where(EmailTemplate.id == template_id))).scalars().first()
+    if not tpl:
+        raise HTTPException(status_code=404, detail="找不到範本")
+    values = SAMPLE_VALUES
+    if customer_id:
+        c = (await db.execute(select(Customer).options(selectinload(Customer.registrations).selectinload(EventRegistration.event)).where(Customer.id == customer_id))).scalars().first()
+        if not c:
+            raise HTTPException(status_code=404, detail="找不到客戶")
+        values = {"name": c.name, "email": c.email, "company": c.company, "phone": c.phone, "events": "、".join(r.event.name for r in c.registrations)}
+    return {"subject": CompiledTemplate(tpl.subject, html=False).render(values), "html": get_template(tpl.id, tpl.body).render(values)}
+
 @router.post("/marketing/test")
 async def send_test_email(request: TestEmailRequest):
-    success, msg = send_email(request.email, request.subject, request.body.replace("{name}", "測試員"), is_html=True)
+    sample = {**SAMPLE_VALUES, "email": request.email}
+    body = CompiledTemplate(request.body).render(sample)
+    success, msg = await run_in_threadpool(send_email, request.email, request.subject, body, is_html=True)
     if success: return {"message": "OK"}
     else: raise HTTPException(status_code=500, detail=msg)
 
 @router.get("/tracking/open/{campaign_id}/{customer_id}")
-async def track_open(campaign_id: int, customer_id: int, db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(CampaignRecipient).where(CampaignRecipient.campaign_id == campaign_id, CampaignRecipient.customer_id == customer_id))
-    rec = res.scalars().first()
-    if rec and not rec.opened_at:
-        rec.opened_at = datetime.now(timezone.utc)
-        await db.commit()
-    return Response(content=base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7"), media_type="image/gif")
-
-@router.get("/{customer_id}", response_model=CustomerDetailResponse)
-async def read_customer(customer_id: int, db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(Customer).options(selectinload(Customer.interactions), selectinload(Customer.courses), selectinload(Customer.registrations)).where(Customer.id == customer_id))
-    return res.scalars().first()
+async def track_open(campaign_id: int, customer_id: int):
+    open_buffer.record(campaign_id, customer_id)
+    return Response(content=PIXEL_GIF, media_type="image/gif", headers={"Cache-Control": "no-store"})
@@ -1,68 +1,218 @@
+"""活動排程與發送
+
+- 排程 (到期的活動由「已排程」轉為「發送中」、定時任務、分區 / 重複客戶等維護工作) 只在
+  leader 行程執行 (見 leader.py)；其他行程建立活動時以 NOTIFY 通知 leader 登記定時任務
+- 發送在每個 worker 行程執行 (python worker.py，或 RUN_SCHEDULER 開啟的 API 行程)：每
+  DELIVERY_POLL_SECONDS 查詢發送中的活動，多個行程以 outbox 租約分攤同一個活動的收件人
+"""
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.schedulers.base import STATE_STOPPED
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from datetime import datetime
-from .database import AsyncSessionLocal
-from .models import Campaign, CampaignStatus, CampaignRecipient
-from .email_utils import send_email
+from sqlalchemy import update, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from .config import settings
+from .database import engine, AsyncSessionLocal
+from .leader import LeaderElection
+from .interactions import ensure_partitions
+from .dedup import run_scan
+from .models import Campaign, CampaignStatus
+from .delivery import DeliveryEngine, Delivery
+from .outbox import Lease, iter_claimed, finalize_campaign
+from .templating import CampaignMessage, get_campaign_message
+from .metrics import campaigns_processed, scheduler_runs
 import asyncio
 import os
+import time
 
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8080")
 
+# 所有活動共用同一個 engine (同一組 Gmail 配額)
+delivery_engine = DeliveryEngine()
+_sending: Dict[int, asyncio.Task] = {}
+_send_slots = asyncio.Semaphore(settings.CAMPAIGN_CONCURRENCY)
+_wake = asyncio.Event()
+_delivery_task: Optional[asyncio.Task] = None
+
+def build_delivery(message: CampaignMessage, recipient: dict) -> Delivery:
+    raw = message.render_raw(recipient["email"], recipient["id"], recipient)
+    return Delivery(customer_id=recipient["id"], to_email=recipient["email"], raw=raw)
+
+async def send_campaign(campaign: Campaign):
+    """從 outbox 認領收件人並發送；可與其他行程同時處理同一個活動"""
+    print(f"📩 正在發送信件: {campaign.name}")
+    message = get_campaign_message(campaign.id, campaign.subject, campaign.body, BASE_URL)
+    lease = Lease(campaign.id)
+    recipients = iter_claimed(campaign.id, with_events="events" in message.uses, lease=lease, batch=delivery_engine.claim_size)
+    deliveries = (build_delivery(message, r) async for r in recipients)
+    async with AsyncSessionLocal() as db:
+        report = await delivery_engine.run(db, campaign.id, deliveries, lease)
+        done = await finalize_campaign(db, campaign.id)
+    campaigns_processed.inc(result="completed" if done else "pending")
+    if done:
+        print(f"✅ 活動 '{campaign.name}' 已發送完成，本次寄出 {report.sent} 封，失敗 {report.failed} 封 ({report.throughput} 封/秒)。")
+
+async def _claim_due(db, now: datetime, campaign_id: Optional[int] = None) -> list:
+    """將時間已到的「已排程」活動轉為發送中 (條件式 UPDATE，多個 worker 不會重複轉換)"""
+    stmt = update(Campaign).where(Campaign.status == CampaignStatus.SCHEDULED, Campaign.scheduled_at <= now)
+    if campaign_id is not None:
+        stmt = stmt.where(Campaign.id == campaign_id)
+    due = await db.execute(stmt.values(status=CampaignStatus.SENDING).returning(Campaign.id))
+    return due.scalars().all()
+
+async def _send(campaign: Campaign):
+    try:
+        async with _send_slots:
+            await send_campaign(campaign)
+    except asyncio.CancelledError:
+        print(f"⏸️ [Scheduler] 活動 {campaign.id} 發送已中止，未寄出的收件人已歸還 outbox")
+        raise
+    except Exception as e:
+        print(f"❌ [Scheduler] 活動 {campaign.id} 發送中斷，將由下次輪詢接手: {e}")
+    finally:
+        _sending.pop(campaign.id, None)
+
+def start_sending(campaigns: list) -> list:
+    """在背景發送 (同一行程內不重複處理同一活動)；同時發送的活動數上限為 CAMPAIGN_CONCURRENCY"""
+    for campaign in campaigns:
+        if campaign.id not in _sending:
+            _sending[campaign.id] = asyncio.create_task(_send(campaign))
+    return [_sending[c.id] for c in campaigns if c.id in _sending]
+
+async def deliver_sending_campaigns(wait: bool = False):
+    """所有 worker 都執行：接手發送中的活動 (包含其他行程中斷者)；wait=True 時等待本輪發送結束"""
+    async with AsyncSessionLocal() as db:
+        campaigns = (await db.execute(select(Campaign).where(Campaign.status == CampaignStatus.SENDING))).scalars().all()
+    tasks = start_sending(campaigns)
+    if wait:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _delivery_loop():
+    while True:
+        try:
+            await deliver_sending_campaigns()
+        except Exception as e:
+            print(f"⚠️ [Scheduler] 查詢發送中的活動失敗: {e}")
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=settings.DELIVERY_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+
+async def dispatch_campaign(campaign_id: int):
+    """單一活動的定時任務：在 scheduled_at 當下轉為發送中，並立即喚醒本行程的發送"""
+    async with AsyncSessionLocal() as db:
+        claimed = await _claim_due(db, datetime.now(timezone.utc), campaign_id)
+        await db.commit()
+    if not claimed:
+        return  # 已被其他 worker / 巡檢處理，或排程時間已變更
+    print(f"🚀 [Scheduler] 活動 {campaign_id} 排程時間已到")
+    _wake.set()
+
+def schedule_campaign(campaign_id: int, run_at: datetime):
+    """為活動登記一次性任務；時間已過則立即執行。非 leader 行程不登記 (由 announce_campaign 通知 leader)"""
+    if not leader.is_leader:
+        return
+    scheduler.add_job(
+        dispatch_campaign, "date", run_date=run_at, args=[campaign_id],
+        id=f"campaign-{campaign_id}", replace_existing=True,
+        misfire_grace_time=None,  # 行程忙碌而延誤時仍要執行
+    )
+
+async def announce_campaign(db: AsyncSession, campaign_id: int, run_at: datetime):
+    """在建立活動的交易內 NOTIFY leader；交易 commit 後才會送出"""
+    if db.bind.dialect.name == "postgresql":
+        await db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CAMPAIGN_CHANNEL, "payload": f"{campaign_id} {run_at.isoformat()}"})
+
+def _on_campaign_notify(payload: str):
+    try:
+        campaign_id, run_at = payload.split(" ", 1)
+        schedule_campaign(int(campaign_id), datetime.fromisoformat(run_at))
+    except ValueError:
+        print(f"⚠️ [Scheduler] 無法解析活動通知: {payload!r}")
+
 async def process_scheduled_campaigns():
-    """背景任務：使用本地時間檢查排程"""
+    """低頻巡檢：補上漏掉的定時任務 (例如重啟期間到期的活動)；發送由各 worker 的 delivery loop 負責"""
+    started = time.perf_counter()
     async with AsyncSessionLocal() as db:
-        now = datetime.now() # 使用本地時間
-        print(f"🕒 [Scheduler 心跳] 目前時間: {now.strftime('%Y-%m-%d %H:%M:%S')}")
-        
-        # 找出狀態為「已排程」且「時間已到」的活動
-        query = select(Campaign).where(Campaign.status == CampaignStatus.SCHEDULED).where(Campaign.scheduled_at <= now)
-        result = await db.execute(query)
-        campaigns = result.scalars().all()
-
-        if not campaigns:
-            return
-
-        print(f"🚀 [Scheduler] 偵測到 {len(campaigns)} 個待發送任務！")
-
-        for campaign in campaigns:
-            print(f"📩 正在發送信件: {campaign.name}")
-            campaign.status = CampaignStatus.SENDING
-            await db.commit()
-
-            rec_query = select(CampaignRecipient).options(selectinload(CampaignRecipient.customer)).where(CampaignRecipient.campaign_id == campaign.id)
-            rec_result = await db.execute(rec_query)
-            recipients = rec_result.scalars().all()
-
-            sent_ok = 0
-            for rec in recipients:
-                try:
-                    html_body = campaign.body.replace("{name}", rec.customer.name).replace("\n", "<br>")
-                    pixel_url = f"{BASE_URL}/customers/tracking/open/{campaign.id}/{rec.customer.id}"
-                    full_content = f"<html><body>{html_body}<img src='{pixel_url}' width='1' height='1' style='display:none;'></body></html>"
-
-                    success, msg = send_email(rec.customer.email, campaign.subject, full_content, is_html=True)
-                    if success:
-                        rec.sent_at = datetime.now()
-                        sent_ok += 1
-                    else:
-                        rec.error = msg
-                except Exception as e:
-                    rec.error = str(e)
-                await asyncio.sleep(0.5)
-
-            campaign.status = CampaignStatus.COMPLETED
-            await db.commit()
-            print(f"✅ 活動 '{campaign.name}' 已發送完成，共寄出 {sent_ok} 封。")
-
-# 設定排程器：增加 misfire_grace_time 容錯
-scheduler = AsyncIOScheduler()
+        now = datetime.now(timezone.utc)
+        print(f"🕒 [Scheduler 巡檢] 目前時間: {now.astimezone():%Y-%m-%d %H:%M:%S}")
+
+        due_ids = await _claim_due(db, now)
+        await db.commit()
+        if due_ids:
+            print(f"🚀 [Scheduler] 偵測到 {len(due_ids)} 個待發送任務！")
+            _wake.set()
+
+        # 尚未到期的活動重新登記定時任務 (記憶體中的任務在重啟後會遺失)
+        upcoming = await db.execute(
+            select(Campaign.id, Campaign.scheduled_at)
+            .where(Campaign.status == CampaignStatus.SCHEDULED, Campaign.scheduled_at > now)
+        )
+        for campaign_id, run_at in upcoming:
+            if scheduler.get_job(f"campaign-{campaign_id}") is None:
+                schedule_campaign(campaign_id, run_at)
+
+    scheduler_runs.observe(time.perf_counter() - started)
+
+# 設定排程器：活動以一次性任務準時觸發，另以低頻巡檢補漏；成為 leader 時立即巡檢一次
+CAMPAIGN_CHANNEL = "crm_campaign_scheduled"
+scheduler = AsyncIOScheduler(timezone=timezone.utc)
 scheduler.add_job(
-    process_scheduled_campaigns, 
+    process_scheduled_campaigns,
     'interval',
-    minutes=1, 
+    seconds=settings.SCHEDULER_SWEEP_SECONDS,
+    next_run_time=datetime.now(timezone.utc),
+    id="campaign-sweep",
     misfire_grace_time=60, # 允許 60 秒內的延遲執行
     coalesce=True,         # 如果多次執行重疊，只執行一次
     max_instances=1        # 同一時間只允許一個任務在跑
-)
\ No newline at end of file
+)
+# 互動紀錄分區：每天預先建立未來月份的分區
+scheduler.add_job(ensure_partitions, 'interval', hours=24, next_run_time=datetime.now(timezone.utc), id="interaction-partitions", coalesce=True, max_instances=1)
+# 重複客戶：每日離峰時段重新掃描
+if settings.DEDUP_SCAN_HOUR >= 0:
+    scheduler.add_job(run_scan, 'cron', hour=settings.DEDUP_SCAN_HOUR, id="dedup-scan", coalesce=True, max_instances=1)
+
+def _become_leader():
+    if scheduler.state == STATE_STOPPED:
+        scheduler.start()
+    else:
+        scheduler.resume()
+        scheduler.modify_job("campaign-sweep", next_run_time=datetime.now(timezone.utc))
+
+def _cancel_sends() -> list:
+    tasks = list(_sending.values())
+    for task in tasks:
+        task.cancel()
+    return tasks
+
+def _step_down():
+    # 暫停並移除一次性任務，交由新 leader 的巡檢重新登記
+    scheduler.pause()
+    for job in scheduler.get_jobs():
+        if job.id.startswith("campaign-") and job.id != "campaign-sweep":
+            job.remove()
+    # 卸任通常表示與資料庫的連線中斷、租約可能無法續期：中止本行程進行中的發送
+    # (未寄出的收件人歸還 outbox)，連線恢復後由 delivery loop 重新認領
+    _cancel_sends()
+
+leader = LeaderElection(engine, settings.SCHEDULER_LOCK_ID, _become_leader, _step_down, channels={CAMPAIGN_CHANNEL: _on_campaign_notify})
+
+def start_scheduler():
+    """參與 leader 競選 (排程) 並啟動本行程的 delivery loop (發送)"""
+    global _delivery_task
+    leader.start()
+    if _delivery_task is None:
+        _delivery_task = asyncio.create_task(_delivery_loop())
+
+async def stop_scheduler():
+    global _delivery_task
+    await leader.stop()
+    if scheduler.state != STATE_STOPPED:
+        scheduler.shutdown(wait=False)
+    if _delivery_task:
+        _delivery_task.cancel()
+        _delivery_task = None
+    await asyncio.gather(*_cancel_sends(), return_exceptions=True)
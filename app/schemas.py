@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 # --- Customer ---
@@ -17,11 +17,42 @@ class CustomerResponse(CustomerBase):
     created_at: datetime
     class Config: from_attributes = True
 
+class CustomerPage(BaseModel):
+    items: List[dict]
+    next_cursor: Optional[str] = None
+
+# --- Duplicates ---
+class DuplicateCustomer(BaseModel):
+    id: int
+    name: str
+    email: str
+    phone: Optional[str] = None
+    company: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class DuplicateSuggestionItem(BaseModel):
+    score: float
+    reasons: List[str]  # phone / name / email / company
+    customer: DuplicateCustomer
+    duplicate: DuplicateCustomer
+
+class DuplicatePage(BaseModel):
+    items: List[DuplicateSuggestionItem]
+    next_cursor: Optional[str] = None
+
+class MergeGroup(BaseModel):
+    keep_id: int
+    merge_ids: List[int]
+
+class MergeRequest(BaseModel):
+    groups: List[MergeGroup]
+
 # --- Interaction ---
 class InteractionCreate(BaseModel):
     customer_id: int
     type: str
     notes: Optional[str] = None
+    created_at: Optional[datetime] = None  # 來源系統的發生時間；省略時為寫入時間
 
 # --- Course & Event ---
 class CourseResponse(BaseModel):
@@ -42,19 +73,93 @@ class EventListResponse(EventResponse):
     checkin_count: int
     attendance_rate: float
 
+class EventPage(BaseModel):
+    items: List[EventListResponse]
+    next_cursor: Optional[str] = None
+
+class EventSummary(BaseModel):
+    total_events: int
+    total_registrations: int
+    total_checkins: int
+    attendance_rate: float
+
 class EventCreate(BaseModel):
     name: str
     date: datetime
     location: Optional[str] = None
 
+class CheckInRequest(BaseModel):
+    customer_ids: List[int] = []
+    emails: List[str] = []
+    register_walk_ins: bool = True  # 未報名者直接建立報名並簽到
+
+class CheckInResult(BaseModel):
+    checked_in: int   # 本次新標記出席的人數
+    walk_ins: int     # 其中現場報名的人數
+    skipped: int      # 已簽到或未報名 (register_walk_ins=False) 的客戶數 + 找不到客戶的 id / Email 數
+
 # --- Marketing ---
 class CampaignCreateRequest(BaseModel):
     name: str
     subject: str
     body: str
-    customer_ids: List[int]
+    customer_ids: List[int] = []
+    segment_id: Optional[int] = None  # 以分群選取收件人 (可與 customer_ids 併用)
+    scheduled_at: Optional[datetime] = None
+
+class SegmentCreate(BaseModel):
+    name: str
+    definition: dict
+
+class SegmentResponse(SegmentCreate):
+    id: int
+    created_at: Optional[datetime] = None
+    class Config: from_attributes = True
+
+class SegmentPreviewRequest(BaseModel):
+    definition: dict
+
+class CampaignListItem(BaseModel):
+    id: int
+    name: str
+    status: str
+    total_recipients: int
+    opened_count: int
+    open_rate: float
     scheduled_at: Optional[datetime] = None
 
+class CampaignPage(BaseModel):
+    items: List[CampaignListItem]
+    next_cursor: Optional[str] = None
+
+class CampaignSummary(BaseModel):
+    total_campaigns: int
+    by_status: Dict[str, int]
+    total_recipients: int
+    opened_count: int
+    open_rate: float
+
+class OpenCurvePoint(BaseModel):
+    hour: int  # 自開始寄送起的小時數
+    opened: int
+    cumulative: int
+    open_rate: float  # 累積開信率 (%)
+
+class CampaignOpenCurve(BaseModel):
+    campaign_id: int
+    name: str
+    started_at: Optional[datetime] = None
+    sent: int
+    opened: int
+    open_rate: float
+    curve: List[OpenCurvePoint]
+
+class CompanyEngagement(BaseModel):
+    company: str
+    sent: int
+    opened: int
+    open_rate: float
+
 class TemplateCreate(BaseModel):
     name: str
     subject: str
@@ -79,6 +184,29 @@ class DashboardStats(BaseModel):
 
 # --- Full Customer ---
 class CustomerDetailResponse(CustomerResponse):
-    interactions: List[dict] = []
+    """固定大小的表頭；互動與報名紀錄請使用各自的分頁端點"""
+    updated_at: Optional[datetime] = None
+    interaction_count: int = 0
+    registration_count: int = 0
     courses: List[CourseResponse] = []
-    registrations: List[dict] = []
+
+class InteractionItem(BaseModel):
+    id: int
+    type: str
+    notes: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class InteractionPage(BaseModel):
+    items: List[InteractionItem]
+    next_cursor: Optional[str] = None
+
+class RegistrationItem(BaseModel):
+    event_id: int
+    name: str
+    date: datetime
+    attended: Optional[bool] = None
+    registered_at: Optional[datetime] = None
+
+class RegistrationPage(BaseModel):
+    items: List[RegistrationItem]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,97 @@
+"""受眾分群：JSON 條件編譯成 SQL，收件人以單一 INSERT ... SELECT 寫入
+
+條件格式 (可任意巢狀)：
+
+    {"all": [條件, ...]}            全部符合
+    {"any": [條件, ...]}            任一符合
+    {"not": 條件}                   不符合
+    {"all_customers": true}         所有客戶
+    {"registered_event": 活動 id}   報名過活動
+    {"attended_event": 活動 id}     出席過活動
+    {"purchased_course": 課程 id}   購買過課程
+    {"company_in": ["公司", ...]}   公司名稱 (空值以 "其他" 表示)
+    {"received_campaign": 活動 id}  收過某次行銷信
+    {"opened_campaign": 活動 id}    開啟過某次行銷信
+
+例如「買過課程 3 但沒買課程 5」：{"all": [{"purchased_course": 3}, {"not": {"purchased_course": 5}}]}
+"""
+from sqlalchemy import and_, or_, not_, exists, true, func, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from .models import Customer, EventRegistration, CampaignRecipient, customer_courses
+from .stats import company_key
+
+MAX_DEPTH = 8
+MAX_RULES = 100
+
+class SegmentError(ValueError):
+    pass
+
+def _id(value, rule: str) -> int:
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise SegmentError(f"{rule} 需要整數 id")
+    return value
+
+def _leaf(op: str, value):
+    if op == "all_customers":
+        return true()
+    if op == "registered_event":
+        return exists().where(EventRegistration.customer_id == Customer.id, EventRegistration.event_id == _id(value, op))
+    if op == "attended_event":
+        return exists().where(EventRegistration.customer_id == Customer.id, EventRegistration.event_id == _id(value, op), EventRegistration.attended.is_(True))
+    if op == "purchased_course":
+        return exists().where(customer_courses.c.customer_id == Customer.id, customer_courses.c.course_id == _id(value, op))
+    if op == "company_in":
+        if not isinstance(value, list) or not value or not all(isinstance(v, str) for v in value):
+            raise SegmentError("company_in 需要非空的公司名稱陣列")
+        return company_key().in_(value)
+    if op == "received_campaign":
+        return exists().where(CampaignRecipient.customer_id == Customer.id, CampaignRecipient.campaign_id == _id(value, op))
+    if op == "opened_campaign":
+        return exists().where(CampaignRecipient.customer_id == Customer.id, CampaignRecipient.campaign_id == _id(value, op), CampaignRecipient.opened_at.is_not(None))
+    raise SegmentError(f"未知的條件: {op}")
+
+def compile_segment(definition: dict):
+    """回傳 Customer 上的 WHERE 條件；格式錯誤時拋出 SegmentError"""
+    count = 0
+
+    def walk(rule, depth: int):
+        nonlocal count
+        count += 1
+        if depth > MAX_DEPTH or count > MAX_RULES:
+            raise SegmentError("條件過於複雜")
+        if not isinstance(rule, dict) or len(rule) != 1:
+            raise SegmentError("每個條件必須是只有一個鍵的物件")
+        (op, value), = rule.items()
+        if op in ("all", "any"):
+            if not isinstance(value, list) or not value:
+                raise SegmentError(f"{op} 需要非空陣列")
+            parts = [walk(r, depth + 1) for r in value]
+            return and_(*parts) if op == "all" else or_(*parts)
+        if op == "not":
+            return not_(walk(value, depth + 1))
+        return _leaf(op, value)
+
+    return walk(definition, 0)
+
+def audience_query(definition: dict):
+    return select(Customer.id).where(compile_segment(definition))
+
+async def count_audience(db: AsyncSession, definition: dict) -> int:
+    return (await db.execute(select(func.count()).select_from(Customer).where(compile_segment(definition)))).scalar()
+
+async def preview_audience(db: AsyncSession, definition: dict, sample: int = 10) -> dict:
+    rows = (await db.execute(
+        select(Customer.id, Customer.name, Customer.email, Customer.company)
+        .where(compile_segment(definition)).order_by(Customer.id).limit(sample)
+    )).all()
+    return {"count": await count_audience(db, definition), "sample": [dict(r._mapping) for r in rows]}
+
+async def materialize_recipients(db: AsyncSession, campaign_id: int, definition: dict) -> int:
+    """INSERT INTO campaign_recipients (campaign_id, customer_id) SELECT ... 一個語句寫入所有收件人"""
+    stmt = insert(CampaignRecipient).from_select(
+        ["campaign_id", "customer_id"],
+        select(literal(campaign_id), Customer.id).where(compile_segment(definition)),
+    ).on_conflict_do_nothing()
+    return (await db.execute(stmt)).rowcount
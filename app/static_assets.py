@@ -0,0 +1,167 @@
+"""前端靜態檔：預先壓縮 (gzip / brotli)、各編碼獨立的強 ETag、Cache-Control
+
+啟動時把 static/ 下的檔案讀進記憶體並各自準備好壓縮版本，請求時只做
+Accept-Encoding 協商與 If-None-Match 比對，不再每次讀檔。壓縮版本優先使用
+部署時產生的 .gz / .br 檔 (比原檔新才採用)，否則啟動時即時壓縮：
+
+    python -m app.static_assets          # 產生 static/*.gz (安裝 brotli 時一併產生 .br)
+
+未安裝 brotli 套件且沒有 .br 檔時只提供 gzip。
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from fastapi import Request, Response
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from .config import settings
+
+try:
+    import brotli
+except ImportError:  # 選用套件
+    brotli = None
+
+STATIC_DIR = "static"
+ENTRY = "index.html"
+PRECOMPRESSED = {"br": ".br", "gzip": ".gz"}  # q 值相同時的協商優先順序
+ETAG_SUFFIX = {"br": "-br", "gzip": "-gz"}  # 壓縮後本文不同，強 ETag 也必須不同
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+@dataclass
+class Asset:
+    body: bytes
+    media_type: str
+    etag: str  # 原始內容的 ETag，壓縮版本為 etag_for(encoding)
+    encoded: Dict[str, bytes] = field(default_factory=dict)  # encoding -> 壓縮後內容
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        return self.etag if encoding is None else f'{self.etag[:-1]}{ETAG_SUFFIX[encoding]}"'
+
+def _accept_encoding(header: str) -> Dict[str, float]:
+    """解析 Accept-Encoding 為 {編碼: q 值}；q 格式錯誤視為 0"""
+    accepted = {}
+    for item in header.split(","):
+        coding, *params = [p.strip() for p in item.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+def _negotiate(header: str, available) -> Optional[str]:
+    """依 q 值挑選壓縮編碼 (q=0 表示拒絕)，None 代表回傳原始內容"""
+    accepted = _accept_encoding(header)
+    best, best_q = None, 0.0
+    for encoding in PRECOMPRESSED:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if encoding in available and q > best_q:
+            best, best_q = encoding, q
+    # 用戶端明確偏好原始內容時不壓縮
+    return None if accepted.get("identity", 0.0) > best_q else best
+
+class NegotiatedGZipMiddleware(GZipMiddleware):
+    """全站 gzip，但依 q 值判斷 (gzip;q=0 不壓縮)；靜態檔已自行協商並帶各編碼的 ETag，不再經過"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            path = scope["path"]
+            accepted = _accept_encoding(Headers(scope=scope).get("accept-encoding", ""))
+            if path == "/" or path.startswith("/static/") or accepted.get("gzip", accepted.get("*", 0.0)) <= 0:
+                await self.app(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
+
+def _compress(encoding: str, body: bytes) -> Optional[bytes]:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=11)
+    return None
+
+def _load_asset(path: str) -> Asset:
+    with open(path, "rb") as f:
+        body = f.read()
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if media_type.startswith("text/"):
+        media_type += "; charset=utf-8"
+    asset = Asset(body=body, media_type=media_type, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+    if not media_type.startswith(COMPRESSIBLE):
+        return asset
+    mtime = os.path.getmtime(path)
+    for encoding, suffix in PRECOMPRESSED.items():
+        packed = path + suffix
+        if os.path.exists(packed) and os.path.getmtime(packed) >= mtime:
+            with open(packed, "rb") as f:
+                data = f.read()
+        else:
+            data = _compress(encoding, body)
+        if data is not None and len(data) < len(body):
+            asset.encoded[encoding] = data
+    return asset
+
+class StaticAssets:
+    def __init__(self, directory: str = STATIC_DIR):
+        self.directory = directory
+        self.assets: Dict[str, Asset] = {}
+
+    def load(self):
+        self.assets.clear()
+        if not os.path.isdir(self.directory):
+            return
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(tuple(PRECOMPRESSED.values())):
+                    continue
+                path = os.path.join(root, name)
+                self.assets[os.path.relpath(path, self.directory).replace(os.sep, "/")] = _load_asset(path)
+        print(f"📦 [Static] 已載入 {len(self.assets)} 個靜態檔")
+
+    def response(self, request: Request, name: str) -> Response:
+        asset = self.assets.get(name)
+        if asset is None:
+            return Response(status_code=404)
+        # 入口頁每次都要向伺服器確認 (ETag 相同即 304)，其他檔案可快取 STATIC_MAX_AGE 秒
+        cache = "no-cache" if name == ENTRY else f"public, max-age={settings.STATIC_MAX_AGE}"
+        encoding = _negotiate(request.headers.get("accept-encoding", ""), asset.encoded)
+        etag = asset.etag_for(encoding)
+        headers = {"ETag": etag, "Cache-Control": cache, "Vary": "Accept-Encoding"}
+        # If-None-Match 採弱比對 (RFC 9110)：忽略 W/ 前綴，並只比對這次要送出的編碼版本
+        tags = [t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")]
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+        if encoding is None:
+            return Response(asset.body, media_type=asset.media_type, headers=headers)
+        headers["Content-Encoding"] = encoding
+        return Response(asset.encoded[encoding], media_type=asset.media_type, headers=headers)
+
+static_assets = StaticAssets()
+
+def build(directory: str = STATIC_DIR):
+    """部署前產生壓縮檔"""
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(tuple(PRECOMPRESSED.values())) or not (mimetypes.guess_type(path)[0] or "").startswith(COMPRESSIBLE):
+                continue
+            with open(path, "rb") as f:
+                body = f.read()
+            for encoding, suffix in PRECOMPRESSED.items():
+                data = _compress(encoding, body)
+                if data is not None:
+                    with open(path + suffix, "wb") as f:
+                        f.write(data)
+                    print(f"🗜️ {path}{suffix}: {len(body):,} → {len(data):,} bytes")
+
+if __name__ == "__main__":
+    build(sys.argv[1] if len(sys.argv) > 1 else STATIC_DIR)
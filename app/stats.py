@@ -0,0 +1,95 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import func, distinct
+from .models import Customer, Course, Event, EventRegistration, customer_courses
+
+SEGMENT_LIMIT = 5
+OTHER_COMPANY = "其他"
+
+def _rate(part: int, whole: int) -> float:
+    return round(part / whole * 100, 2) if whole else 0
+
+def company_key():
+    """公司分群鍵：空字串與 NULL 皆歸類為「其他」"""
+    return func.coalesce(func.nullif(Customer.company, ""), OTHER_COMPANY)
+
+def purchasers_subquery():
+    """有購買紀錄的客戶 (去重)"""
+    return select(customer_courses.c.customer_id).distinct().subquery()
+
+def event_conversion_query():
+    """各活動報名數與轉換數：一次 GROUP BY 取得"""
+    purchasers = purchasers_subquery()
+    return (
+        select(
+            Event.id,
+            Event.name,
+            func.count(distinct(EventRegistration.customer_id)).label("registrations"),
+            func.count(distinct(purchasers.c.customer_id)).label("converted"),
+        )
+        .select_from(Event)
+        .outerjoin(EventRegistration, EventRegistration.event_id == Event.id)
+        .outerjoin(purchasers, purchasers.c.customer_id == EventRegistration.customer_id)
+        .group_by(Event.id, Event.name)
+        .order_by(Event.id)
+    )
+
+def format_dashboard(totals: dict, segments: list, events: list) -> dict:
+    """組裝 DashboardStats 結構 (SQL 聚合與 rollup 共用)"""
+    top_events = [
+        {"name": e["name"], "registrations": e["registrations"], "converted": e["converted"], "rate": _rate(e["converted"], e["registrations"])}
+        for e in events
+    ]
+    return {
+        **totals,
+        "conversion_rate": _rate(totals["converted_purchasers"], totals["unique_event_attendees"]),
+        "customer_segments": segments, "top_converting_events": sorted(top_events, key=lambda x: x['rate'], reverse=True)
+    }
+
+async def compute_dashboard_stats(db: AsyncSession) -> dict:
+    """以 SQL 聚合計算 Dashboard 統計，回傳 DashboardStats 結構"""
+    total_customers = (await db.execute(select(func.count(Customer.id)))).scalar() or 0
+    total_events = (await db.execute(select(func.count(Event.id)))).scalar() or 0
+
+    # 購買次數與營收：customer_courses JOIN courses
+    purchase_row = (await db.execute(
+        select(func.count(), func.coalesce(func.sum(Course.price), 0))
+        .select_from(customer_courses)
+        .join(Course, Course.id == customer_courses.c.course_id)
+    )).one()
+    total_purchases, total_revenue = purchase_row[0] or 0, float(purchase_row[1] or 0)
+
+    # 報名者與「報名且購買」者的交集
+    purchasers = purchasers_subquery()
+    funnel_row = (await db.execute(
+        select(
+            func.count(distinct(EventRegistration.customer_id)),
+            func.count(distinct(purchasers.c.customer_id)),
+        )
+        .select_from(EventRegistration)
+        .outerjoin(purchasers, purchasers.c.customer_id == EventRegistration.customer_id)
+    )).one()
+    attendees, converted = funnel_row[0] or 0, funnel_row[1] or 0
+
+    # 前五大公司分佈
+    company = company_key().label("company")
+    seg_rows = (await db.execute(
+        select(company, func.count(Customer.id).label("count"))
+        .group_by(company)
+        .order_by(func.count(Customer.id).desc())
+        .limit(SEGMENT_LIMIT)
+    )).all()
+    segments = [{"company": r.company, "count": r.count} for r in seg_rows]
+
+    ev_rows = (await db.execute(event_conversion_query())).all()
+    events = [{"name": r.name, "registrations": r.registrations, "converted": r.converted} for r in ev_rows]
+
+    totals = {
+        "total_customers": total_customers,
+        "total_events": total_events,
+        "total_purchases": total_purchases,
+        "total_revenue": total_revenue,
+        "unique_event_attendees": attendees,
+        "converted_purchasers": converted,
+    }
+    return format_dashboard(totals, segments, events)
@@ -0,0 +1,129 @@
+"""郵件範本編譯器
+
+範本只解析一次，拆成「靜態片段」與「變數欄位」；每位收件人只需把欄位值
+接進預先算好的片段。Campaign 郵件的 HTML 外框、追蹤像素前綴與 MIME 標頭
+也都預先組好，逐封只做字串串接與一次 base64。
+"""
+import base64
+import html
+import re
+import threading
+from collections import OrderedDict
+from email.header import Header
+from typing import Hashable, Mapping
+
+FIELDS = ("name", "company", "email", "phone", "events")
+_PLACEHOLDER = re.compile(r"\{(" + "|".join(FIELDS) + r")\}")
+_CACHE_SIZE = 256
+_B64_LINE = 57  # 每行 57 bytes → 編碼後 76 字元 (RFC 2045)
+
+class CompiledTemplate:
+    """結果與舊版 str.replace 代入後再把換行轉為 <br> 相同：
+
+    - html=True 時範本與欄位值中的換行都轉為 <br>
+    - 欄位值預設原樣代入；escape=True 時先做 HTML 跳脫 (選用，避免客戶資料中的 HTML 被解讀)
+    """
+
+    def __init__(self, source: str, html: bool = True, escape: bool = False):
+        self.source = source
+        self.html = html
+        self.escape = escape
+        statics, fields, pos = [], [], 0
+        for m in _PLACEHOLDER.finditer(source):
+            statics.append(self._static(source[pos:m.start()]))
+            fields.append(m.group(1))
+            pos = m.end()
+        statics.append(self._static(source[pos:]))
+        self.statics = tuple(statics)
+        self.fields = tuple(fields)
+
+    def _static(self, text: str) -> str:
+        return text.replace("\n", "<br>") if self.html else text
+
+    def _value(self, value) -> str:
+        text = str(value)
+        if self.escape:
+            text = html.escape(text)
+        return self._static(text)
+
+    @property
+    def uses(self) -> frozenset:
+        return frozenset(self.fields)
+
+    def render(self, values: Mapping) -> str:
+        if not self.fields:
+            return self.statics[0]
+        parts = [self.statics[0]]
+        for field, static in zip(self.fields, self.statics[1:]):
+            parts.append(self._value(values.get(field) or ""))
+            parts.append(static)
+        return "".join(parts)
+
+def _encode_header(value: str) -> str:
+    return value if value.isascii() else Header(value, "utf-8").encode(linesep="\r\n")
+
+def _b64_body(data: bytes) -> bytes:
+    return b"\r\n".join(base64.b64encode(data[i:i + _B64_LINE]) for i in range(0, len(data), _B64_LINE))
+
+class CampaignMessage:
+    """預先計算靜態部分的 campaign 郵件：HTML 外框、追蹤像素、MIME 標頭"""
+
+    def __init__(self, campaign_id: int, subject: str, body: str, base_url: str):
+        self.body = CompiledTemplate(body, html=True)
+        self.subject = CompiledTemplate(subject, html=False)
+        self._html_head = "<html><body>"
+        self._pixel_head = f"<img src='{base_url}/customers/tracking/open/{campaign_id}/"
+        self._pixel_tail = "' width='1' height='1' style='display:none;'></body></html>"
+        self._mime_head = b'MIME-Version: 1.0\r\nContent-Type: text/html; charset="utf-8"\r\nContent-Transfer-Encoding: base64\r\nfrom: me\r\n'
+        self._subject_line = None if self.subject.fields else f"subject: {_encode_header(subject)}\r\n".encode()
+
+    @property
+    def uses(self) -> frozenset:
+        return self.body.uses | self.subject.uses
+
+    def render_html(self, customer_id: int, values: Mapping) -> str:
+        return "".join((self._html_head, self.body.render(values), self._pixel_head, str(customer_id), self._pixel_tail))
+
+    def render_raw(self, to_email: str, customer_id: int, values: Mapping) -> str:
+        """回傳 Gmail API 需要的 urlsafe base64 RFC 822 訊息"""
+        subject_line = self._subject_line or f"subject: {_encode_header(self.subject.render(values))}\r\n".encode()
+        message = b"".join((
+            self._mime_head,
+            f"to: {_encode_header(to_email)}\r\n".encode(),
+            subject_line,
+            b"\r\n",
+            _b64_body(self.render_html(customer_id, values).encode("utf-8")),
+            b"\r\n",
+        ))
+        return base64.urlsafe_b64encode(message).decode()
+
+class _LRU:
+    def __init__(self, size: int):
+        self.size = size
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key: Hashable, fingerprint, build):
+        """fingerprint 不同 (例如範本內容被修改) 時重新編譯"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] == fingerprint:
+                self._data.move_to_end(key)
+                return entry[1]
+        value = build()
+        with self._lock:
+            self._data[key] = (fingerprint, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+        return value
+
+_compiled = _LRU(_CACHE_SIZE)
+
+def get_template(template_id: int, body: str) -> CompiledTemplate:
+    """EmailTemplate.body 的編譯結果，依 id 快取"""
+    return _compiled.get_or_build(("template", template_id), body, lambda: CompiledTemplate(body))
+
+def get_campaign_message(campaign_id: int, subject: str, body: str, base_url: str) -> CampaignMessage:
+    """Campaign 的編譯結果，依 id 快取"""
+    return _compiled.get_or_build(("campaign", campaign_id), (subject, body, base_url), lambda: CampaignMessage(campaign_id, subject, body, base_url))
@@ -0,0 +1,150 @@
+"""開信追蹤：像素請求只寫入記憶體緩衝，背景定期以單一語句批次寫回
+
+像素端點完全不碰資料庫，延遲與資料庫負載無關。寫回語句帶有
+opened_at IS NULL 條件，重複開啟或多個行程同時寫回都不會覆蓋第一次開啟時間；
+同一語句也把新開啟的收件人累加到成效 rollup (見 engagement.py)。
+Postgres 以外 (本機 sqlite) 改為先查出未開啟的收件人，再逐列寫回並累加 rollup。
+"""
+import asyncio
+import base64
+from collections import Counter
+from datetime import datetime, timezone
+from sqlalchemy import bindparam, text, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from .config import settings
+from .database import AsyncSessionLocal
+from .engagement import bucket_of, bump
+from .metrics import Gauge
+from .models import CampaignRecipient, Customer
+from .stats import OTHER_COMPANY
+
+PIXEL_GIF = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+
+# 只有 opened_at 由 NULL 變為有值的列 (RETURNING) 會累加到 campaign_engagement
+FLUSH_SQL = text("""
+    WITH opened AS (
+        UPDATE campaign_recipients AS cr
+        SET opened_at = v.opened_at
+        FROM unnest(CAST(:campaign_ids AS INTEGER[]), CAST(:customer_ids AS INTEGER[]), CAST(:opened_ats AS TIMESTAMPTZ[]))
+             AS v(campaign_id, customer_id, opened_at)
+        WHERE cr.campaign_id = v.campaign_id AND cr.customer_id = v.customer_id AND cr.opened_at IS NULL
+        RETURNING cr.campaign_id, cr.customer_id, cr.opened_at
+    )
+    INSERT INTO campaign_engagement (campaign_id, bucket, company, sent, opened)
+    SELECT o.campaign_id, date_trunc('hour', o.opened_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+           COALESCE(NULLIF(c.company, ''), :other), 0, count(*)
+    FROM opened o LEFT JOIN customers c ON c.id = o.customer_id
+    GROUP BY 1, 2, 3
+    ON CONFLICT (campaign_id, bucket, company) DO UPDATE SET opened = campaign_engagement.opened + EXCLUDED.opened
+""")
+
+PORTABLE_BATCH = 500  # 每個 IN 查詢的收件人數 (每人 2 個參數)
+
+async def _flush_portable(db: AsyncSession, hits: dict):
+    """FLUSH_SQL 的通用版本：只有 opened_at 仍為 NULL 的列會寫回並累加 rollup"""
+    cr = CampaignRecipient
+    keys = list(hits)
+    counts = Counter()
+    for i in range(0, len(keys), PORTABLE_BATCH):
+        rows = (await db.execute(
+            select(cr.campaign_id, cr.customer_id, Customer.company)
+            .outerjoin(Customer, Customer.id == cr.customer_id)
+            .where(tuple_(cr.campaign_id, cr.customer_id).in_(keys[i:i + PORTABLE_BATCH]), cr.opened_at.is_(None))
+            .with_for_update(of=cr)
+        )).all()
+        if not rows:
+            continue
+        await db.execute(
+            update(cr.__table__)
+            .where(cr.campaign_id == bindparam("b_campaign_id"), cr.customer_id == bindparam("b_customer_id"), cr.opened_at.is_(None))
+            .values(opened_at=bindparam("b_opened_at")),
+            [{"b_campaign_id": r.campaign_id, "b_customer_id": r.customer_id, "b_opened_at": hits[(r.campaign_id, r.customer_id)]} for r in rows],
+        )
+        counts.update((r.campaign_id, bucket_of(hits[(r.campaign_id, r.customer_id)]), r.company or OTHER_COMPANY) for r in rows)
+    await bump(db, {key: (0, n) for key, n in counts.items()})
+
+class OpenBuffer:
+    def __init__(self, max_size: int = settings.TRACKING_BUFFER_MAX, interval: float = settings.TRACKING_FLUSH_SECONDS):
+        self.max_size = max_size
+        self.interval = interval
+        self.dropped = 0
+        self._hits: dict = {}
+        self._full = asyncio.Event()
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+
+    def record(self, campaign_id: int, customer_id: int):
+        """記錄一次開啟；同一收件人只保留最早的時間"""
+        key = (campaign_id, customer_id)
+        if key in self._hits:
+            return
+        if len(self._hits) >= self.max_size:
+            # 緩衝已滿：丟棄並催促立即寫回，記憶體用量維持上限
+            self.dropped += 1
+            self._full.set()
+            return
+        self._hits[key] = datetime.now(timezone.utc)
+        if len(self._hits) >= self.max_size:
+            self._full.set()
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._hits:
+                return 0
+            hits, self._hits = self._hits, {}
+            keys = list(hits)
+            try:
+                async with AsyncSessionLocal() as db:
+                    if db.bind.dialect.name == "postgresql":
+                        await db.execute(FLUSH_SQL, {
+                            "campaign_ids": [k[0] for k in keys],
+                            "customer_ids": [k[1] for k in keys],
+                            "opened_ats": [hits[k] for k in keys],
+                            "other": OTHER_COMPANY,
+                        })
+                    else:
+                        await _flush_portable(db, hits)
+                    await db.commit()
+            except Exception as e:
+                # 寫回失敗：放回緩衝 (保留較早的時間) 等下次重試；緩衝上限同 record()，超過的丟棄
+                print(f"⚠️ [Tracking] 開信紀錄寫回失敗，稍後重試: {e}")
+                for k, ts in hits.items():
+                    if k in self._hits:
+                        self._hits[k] = min(ts, self._hits[k])
+                    elif len(self._hits) < self.max_size:
+                        self._hits[k] = ts
+                    else:
+                        self.dropped += 1
+                return 0
+            return len(keys)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            # shield：停止時若正在寫回，讓這批資料完整寫完
+            await asyncio.shield(self.flush())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止背景任務並做最後一次寫回"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+open_buffer = OpenBuffer()
+
+Gauge("crm_tracking_buffered", "等待寫回的開信紀錄數", collect=lambda: len(open_buffer._hits))
+Gauge("crm_tracking_dropped", "緩衝已滿而丟棄的開信紀錄數", collect=lambda: open_buffer.dropped)
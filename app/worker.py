@@ -0,0 +1,31 @@
+"""獨立的排程 / 發送 worker，不含 HTTP app
+
+    python worker.py
+
+API 行程設定 RUN_SCHEDULER=false 後即可任意增加 uvicorn worker 數；發送只在
+worker 執行。多個 worker 同時執行時以 advisory lock 選出一個 leader 負責排程，
+所有 worker 都會以 outbox 租約分攤發送中活動的收件人。
+"""
+import asyncio
+import signal
+from .database import engine
+from .migrations import pending_migrations
+from .scheduler import start_scheduler, stop_scheduler
+
+async def run():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with engine.connect() as conn:
+        pending = await pending_migrations(conn)
+    if pending:
+        print(f"⚠️ [Migration] 資料庫尚未套用 {', '.join(pending)}，請執行 python -m app.migrations")
+
+    start_scheduler()
+    print("👷 [Worker] 已啟動：發送 outbox 中的收件人，並競選排程 leader")
+    await stop.wait()
+    print("👷 [Worker] 正在停止...")
+    await stop_scheduler()
+    await engine.dispose()
@@ -0,0 +1,91 @@
+"""重複客戶偵測基準測試：blocking + 向量化計分的各階段耗時與準確度
+
+以 seed 產生含已知重複的資料 (dup-{tag}-{i}@... 為 bench-{tag}-{i}@... 的重複)，
+量測載入特徵、配對計分的時間，並與逐對比較 (n²/2) 的配對數對照；
+召回率 / 精確率以已知重複計算 (Faker 姓名本身也會重複，精確率為下限)。
+
+    python -m benchmarks.seed --customers 1000000 --duplicate-rate 0.05 --events 0 --campaigns 0 --reset
+    python -m benchmarks.bench_dedup                    # numpy (已安裝時)
+    python -m benchmarks.bench_dedup --engine both      # numpy 與純 Python 各跑一次
+    python -m benchmarks.bench_dedup --store            # 另外寫入 duplicate_suggestions
+"""
+import argparse
+import asyncio
+import re
+import sys
+import time
+from sqlalchemy import or_
+from sqlalchemy.future import select
+from app import dedup
+from app.database import engine, AsyncSessionLocal
+from app.models import Customer
+
+numpy = dedup.np  # 載入時的狀態；run_engine 會切換 dedup.np
+BENCH_EMAIL = re.compile(r"^(bench|dup)-(.+)@example\.(com|org)$")
+
+async def known_duplicates() -> set:
+    """(原客戶 id, 重複客戶 id)，依 seed 產生的 Email 對回"""
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(Customer.id, Customer.email).where(or_(Customer.email.like("bench-%"), Customer.email.like("dup-%")))
+        )).all()
+    originals, copies = {}, {}
+    for cid, email in rows:
+        m = BENCH_EMAIL.match(email)
+        if m:
+            (originals if m.group(1) == "bench" else copies)[m.group(2)] = cid
+    return {tuple(sorted((originals[key], cid))) for key, cid in copies.items() if key in originals}
+
+def run_engine(name: str, features, min_score):
+    dedup.np = numpy if name == "numpy" else None
+    start = time.perf_counter()
+    stats, pairs = dedup.find_duplicates(features, min_score)
+    return stats, pairs, time.perf_counter() - start
+
+async def collect():
+    start = time.perf_counter()
+    features = await dedup.load_features()
+    load_s = time.perf_counter() - start
+    truth = await known_duplicates()
+    await engine.dispose()  # 之後的 asyncio.run 使用新的連線池
+    return features, load_s, truth
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", choices=("numpy", "python", "both"), default="numpy" if numpy is not None else "python")
+    parser.add_argument("--min-score", type=float, default=None)
+    parser.add_argument("--store", action="store_true", help="將結果寫入 duplicate_suggestions")
+    args = parser.parse_args()
+    if args.engine != "python" and numpy is None:
+        sys.exit("未安裝 numpy (需 2.0 以上)，請改用 --engine python")
+
+    features, load_s, truth = asyncio.run(collect())
+    if not len(features):
+        sys.exit("資料庫沒有客戶資料，請先執行: python -m benchmarks.seed --duplicate-rate 0.05")
+
+    n = len(features)
+    print(f"客戶 {n:,}   blocking keys {len(features.block_keys):,}   載入 {load_s:.1f} 秒   已知重複 {len(truth):,} 組")
+    print(f"  {'引擎':<8}{'計分 秒':>9}{'組數':>10}{'略過':>7}{'候選配對':>14}{'建議':>10}{'召回率':>9}{'精確率':>9}")
+    pairs = None
+    for name in (("numpy", "python") if args.engine == "both" else (args.engine,)):
+        stats, pairs, seconds = run_engine(name, features, args.min_score)
+        found = {(a, b) for a, b, _, _ in pairs}
+        hits = len(found & truth)
+        recall = hits / len(truth) * 100 if truth else 0
+        precision = hits / len(found) * 100 if found else 0
+        print(f"  {name:<10}{seconds:>9.2f}{stats['blocks']:>10,}{stats['skipped_blocks']:>7,}{stats['candidate_pairs']:>14,}"
+              f"{len(pairs):>10,}{recall:>8.1f}%{precision:>8.1f}%")
+    print(f"  逐對比較需 {n * (n - 1) // 2:,} 組配對")
+
+    if args.store:
+        async def store():
+            start = time.perf_counter()
+            async with AsyncSessionLocal() as db:
+                await dedup.store_suggestions(db, pairs)
+                await db.commit()
+            await engine.dispose()
+            return time.perf_counter() - start
+        print(f"  寫入 {len(pairs):,} 筆建議 {asyncio.run(store()):.1f} 秒")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""郵件 render + encode 微基準測試
+
+比較舊流程 (str.replace + MIMEMultipart + base64) 與編譯後範本 (CampaignMessage)
+逐封產生 Gmail raw 訊息的成本。
+
+    python -m benchmarks.bench_render            # 預設 100,000 位收件人
+    python -m benchmarks.bench_render -n 20000
+"""
+import argparse
+import time
+from faker import Faker
+from app.email_utils import build_raw_message
+from app.templating import get_campaign_message
+
+BASE_URL = "http://localhost:8080"
+SUBJECT = "【活動通知】年度講座報名開跑"
+BODY = "親愛的 {name} 您好：\n\n感謝 {company} 一直以來的支持。\n您曾參加：{events}\n\n本次講座名額有限，請盡早報名！\n\nCRM Pro 團隊敬上"
+
+def make_recipients(n: int, seed: int = 42):
+    fake = Faker("zh_TW")
+    Faker.seed(seed)
+    pool = [
+        {"id": i + 1, "name": fake.name(), "email": f"user{i}@example.com", "company": fake.company(), "phone": fake.phone_number(), "events": "2024尾牙、2025春酒"}
+        for i in range(min(n, 1000))
+    ]
+    return [{**pool[i % len(pool)], "id": i + 1, "email": f"user{i}@example.com"} for i in range(n)]
+
+def legacy(recipients):
+    for r in recipients:
+        html_body = BODY.replace("{name}", r["name"]).replace("\n", "<br>")
+        pixel_url = f"{BASE_URL}/customers/tracking/open/1/{r['id']}"
+        full_content = f"<html><body>{html_body}<img src='{pixel_url}' width='1' height='1' style='display:none;'></body></html>"
+        build_raw_message(r["email"], SUBJECT, full_content, is_html=True)
+
+def compiled(recipients):
+    message = get_campaign_message(1, SUBJECT, BODY, BASE_URL)
+    for r in recipients:
+        message.render_raw(r["email"], r["id"], r)
+
+def timed(fn, recipients) -> float:
+    start = time.perf_counter()
+    fn(recipients)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--recipients", type=int, default=100_000)
+    args = parser.parse_args()
+
+    recipients = make_recipients(args.recipients)
+    results = {name: timed(fn, recipients) for name, fn in (("legacy", legacy), ("compiled", compiled))}
+
+    print(f"收件人數: {args.recipients:,}")
+    for name, sec in results.items():
+        print(f"  {name:<9} 總計 {sec:8.3f} 秒   每封 {sec / args.recipients * 1e6:8.2f} µs")
+    print(f"  加速倍數 {results['legacy'] / results['compiled']:.1f}x")
+
+if __name__ == "__main__":
+    main()
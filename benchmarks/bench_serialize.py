@@ -0,0 +1,87 @@
+"""列表端點序列化基準測試：response_model (FAST_JSON 關閉) vs FastJSONResponse (FAST_JSON 開啟)
+
+直接呼叫已改用 fast_or_model 的端點函式取得同一頁內容 (查詢相同)，再比較兩種輸出方式：
+
+- model：FAST_JSON 關閉時 FastAPI 的做法 —— 以路由的 response_model 驗證後 dump_json；
+         沒有 response_model 的路由 (範本列表) 則為 jsonable_encoder → JSONResponse
+- fast：FastJSONResponse (orjson，未安裝時為標準 json)
+
+    python -m benchmarks.seed --customers 100000 --reset
+    python -m benchmarks.bench_serialize               # 每個端點取一頁 500 筆
+    python -m benchmarks.bench_serialize -l 100 -r 50
+"""
+import argparse
+import asyncio
+import sys
+import time
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from app.config import settings
+from app.database import engine, AsyncSessionLocal
+from app.responses import FastJSONResponse, orjson
+from app.router import router, read_customers, read_events, list_campaigns, get_templates
+
+def endpoints(limit: int):
+    """(名稱, 端點函式, 呼叫參數)；參數需明確給定，因為直接呼叫時不會套用 Query 預設值"""
+    page = {"limit": limit, "cursor": None}
+    return [
+        ("customers", read_customers, {**page, "q": None, "fields": None}),
+        ("events", read_events, {**page, "summary": False}),
+        ("campaigns", list_campaigns, {**page, "summary": False}),
+        ("templates", get_templates, {}),
+    ]
+
+def model_encoder(endpoint):
+    """回傳與 FastAPI 處理該路由 response_model 相同的編碼函式"""
+    route = next(r for r in router.routes if getattr(r, "endpoint", None) is endpoint)
+    if route.response_model is None:
+        return lambda content: JSONResponse(jsonable_encoder(content)).body
+    adapter = TypeAdapter(route.response_model)
+    return lambda content: adapter.dump_json(adapter.validate_python(content))
+
+def best_of(fn, content, repeats: int):
+    best, size = None, 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        size = len(fn(content))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+async def run(limit: int, repeats: int) -> dict:
+    settings.FAST_JSON = False  # 端點回傳原始內容，兩條路徑編碼同一份資料
+    results = {}
+    for name, endpoint, kwargs in endpoints(limit):
+        async with AsyncSessionLocal() as db:
+            start = time.perf_counter()
+            content = await endpoint(db=db, **kwargs)
+            query_s = time.perf_counter() - start
+        items = content["items"] if isinstance(content, dict) else content
+        if not items:
+            continue
+        results[name] = (
+            len(items), query_s,
+            best_of(model_encoder(endpoint), content, repeats),
+            best_of(lambda c: FastJSONResponse(c).body, content, repeats),
+        )
+    await engine.dispose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-l", "--limit", type=int, default=500, help="每頁筆數 (端點上限 500)")
+    parser.add_argument("-r", "--repeats", type=int, default=20, help="每條路徑編碼次數 (取最快一次)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.limit, args.repeats))
+    if not results:
+        sys.exit("資料庫沒有資料，請先執行: python -m benchmarks.seed")
+
+    print(f"每頁上限: {args.limit}   JSON 編碼: {'orjson ' + orjson.__version__ if orjson else '標準 json (未安裝 orjson)'}")
+    print(f"  {'端點':<10}{'筆數':>6}{'查詢 ms':>10}{'model ms':>10}{'fast ms':>10}{'倍數':>7}{'本文 KB':>9}")
+    for name, (count, query_s, (model_s, size), (fast_s, _)) in results.items():
+        print(f"  {name:<12}{count:>6}{query_s * 1000:>10.1f}{model_s * 1000:>10.2f}{fast_s * 1000:>10.2f}{model_s / fast_s:>8.1f}x{size / 1024:>9.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""本地 Gmail API 替身：接收單封 send 與 multipart batch 請求並立即回應
+
+搭配 settings.GMAIL_API_ENDPOINT 使用，發送引擎完全照正式流程運作，
+只是不會真的寄出信件。可模擬網路延遲與 429 限流。
+
+    with GmailStub(latency=0.05) as stub:
+        ...  # 發送中的活動會寄到 stub
+        print(stub.sent)
+"""
+import email
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from app.config import settings
+from app.email_utils import gmail_service_cache
+
+# 未過期的假 token：不會觸發 OAuth 刷新
+FAKE_TOKEN = {"token": "bench", "refresh_token": "bench", "client_id": "bench", "client_secret": "bench", "expiry": "2099-01-01T00:00:00Z"}
+
+class GmailStub:
+    def __init__(self, latency: float = 0.0, throttle_rate: float = 0.0, seed: int = 0):
+        self.latency = latency              # 每個 HTTP 請求的延遲 (秒)
+        self.throttle_rate = throttle_rate  # 回 429 的比例
+        self.sent = 0
+        self.throttled = 0
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._saved = None
+
+    def _result(self):
+        with self._lock:
+            if self._random.random() < self.throttle_rate:
+                self.throttled += 1
+                return 429, {"error": {"code": 429, "message": "Rate limit exceeded"}}
+            self.sent += 1
+            return 200, {"id": f"bench-{next(self._ids)}"}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, content_type: str, data: bytes):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if not self.path.startswith("/batch/"):
+                    status, payload = stub._result()
+                    return self._reply(status, "application/json", json.dumps(payload).encode())
+
+                msg = email.message_from_bytes(b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+                boundary = "bench_boundary"
+                parts = []
+                for part in msg.get_payload():
+                    status, payload = stub._result()
+                    reason = "OK" if status == 200 else "Too Many Requests"
+                    parts.append(
+                        f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{part['Content-ID'][1:]}\r\n\r\n"
+                        f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n\r\n{json.dumps(payload)}\r\n"
+                    )
+                self._reply(200, f"multipart/mixed; boundary={boundary}", ("".join(parts) + f"--{boundary}--\r\n").encode())
+
+        return Handler
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self._saved = (os.environ.get("GMAIL_TOKEN_JSON"), settings.GMAIL_API_ENDPOINT)
+        os.environ["GMAIL_TOKEN_JSON"] = json.dumps(FAKE_TOKEN)
+        settings.GMAIL_API_ENDPOINT = f"http://127.0.0.1:{self._server.server_port}/"
+        gmail_service_cache.invalidate()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        token, endpoint = self._saved
+        if token is None:
+            os.environ.pop("GMAIL_TOKEN_JSON", None)
+        else:
+            os.environ["GMAIL_TOKEN_JSON"] = token
+        settings.GMAIL_API_ENDPOINT = endpoint
+        gmail_service_cache.invalidate()
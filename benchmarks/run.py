@@ -0,0 +1,254 @@
+"""端到端基準測試：以 in-process ASGI client 驅動 FastAPI app
+
+每個情境記錄 p50 / p95 / p99 延遲、吞吐量與峰值記憶體 (tracemalloc，另跑一輪取樣，
+不影響延遲數字)，結果存成 JSON；指定 --baseline 時與先前結果比較並標示退步的情境。
+Gmail 以本地替身 (benchmarks.gmail_stub) 取代，發送吞吐量也能重現。
+
+    python -m benchmarks.seed --customers 20000 --reset
+    python -m benchmarks.run                                   # 全部情境
+    python -m benchmarks.run --only stats,events -n 500 -c 20
+    python -m benchmarks.run --baseline benchmarks/results/20250101-120000.json
+
+有退步時結束碼為 1，可直接放進 CI。import / delivery 情境會新增資料，
+比較結果前請以相同參數 --reset 重新 seed，資料量才一致。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import insert, func
+from sqlalchemy.future import select
+from app.database import engine, AsyncSessionLocal
+from app.main import app
+from app.models import Customer, Campaign, CampaignStatus, CampaignRecipient, Event
+from app.rollups import stats_cache
+from app.delivery import TokenBucket
+from app.scheduler import delivery_engine, deliver_sending_campaigns
+from app.tracking import open_buffer
+from .gmail_stub import GmailStub
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+MEMORY_SAMPLES = 20
+IMPORT_ROWS = 500
+DELIVERY_RECIPIENTS = 1_000
+
+# (指標, 數值變大是否代表退步)
+COMPARED_METRICS = (("p95_ms", True), ("throughput", False), ("peak_mem_mb", True))
+
+@dataclass
+class Scenario:
+    name: str
+    op: Callable[[AsyncClient, object], Awaitable[None]]
+    prepare: Optional[Callable[[int], Awaitable[object]]] = None  # 每次操作前執行，不計時
+    items: int = 1                  # 每次操作處理的筆數 (吞吐量以筆/秒計)
+    iterations: Optional[int] = None
+    concurrency: Optional[int] = None
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+async def _expect_ok(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.method} {response.request.url.path} -> {response.status_code}: {response.text[:200]}")
+
+async def run_scenario(client: AsyncClient, scenario: Scenario, iterations: int, concurrency: int) -> dict:
+    iterations = scenario.iterations or iterations
+    concurrency = min(scenario.concurrency or concurrency, iterations)
+    latencies = []
+    counter = iter(range(iterations))
+
+    async def worker():
+        for i in counter:
+            state = await scenario.prepare(i) if scenario.prepare else None
+            start = time.perf_counter()
+            await scenario.op(client, state)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+
+    # 記憶體另跑一輪循序取樣：tracemalloc 會拖慢執行，不能與延遲量測混在一起
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for i in range(min(MEMORY_SAMPLES, iterations)):
+        state = await scenario.prepare(iterations + i) if scenario.prepare else None
+        await scenario.op(client, state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    ms = sorted(l * 1000 for l in latencies)
+    return {
+        "iterations": iterations, "concurrency": concurrency, "items_per_op": scenario.items,
+        "p50_ms": round(percentile(ms, 0.50), 3), "p95_ms": round(percentile(ms, 0.95), 3),
+        "p99_ms": round(percentile(ms, 0.99), 3), "max_ms": round(ms[-1], 3),
+        "throughput": round(iterations * scenario.items / wall, 2), "wall_s": round(wall, 3),
+        "peak_mem_mb": round(peak / 1e6, 3),
+    }
+
+# --- 情境 ---
+
+async def _dataset() -> dict:
+    async with AsyncSessionLocal() as db:
+        customer_ids = (await db.execute(select(Customer.id).order_by(Customer.id).limit(50_000))).scalars().all()
+        campaign_ids = (await db.execute(select(Campaign.id).limit(100))).scalars().all()
+        counts = {
+            "customers": (await db.execute(select(func.count(Customer.id)))).scalar(),
+            "events": (await db.execute(select(func.count(Event.id)))).scalar(),
+            "campaigns": (await db.execute(select(func.count(Campaign.id)))).scalar(),
+            "recipients": (await db.execute(select(func.count()).select_from(CampaignRecipient))).scalar(),
+        }
+    if not customer_ids:
+        sys.exit("資料庫沒有客戶資料，請先執行: python -m benchmarks.seed")
+    return {"customer_ids": customer_ids, "campaign_ids": campaign_ids or [0], "counts": counts}
+
+def build_scenarios(data: dict, rnd: random.Random) -> list:
+    run_tag = int(time.time())
+
+    def get(path_fn):
+        async def op(client, state):
+            await _expect_ok(await client.get(path_fn(state)))
+        return op
+
+    async def invalidate_stats(i):
+        stats_cache.invalidate()
+
+    async def import_payload(i):
+        rows = "\n".join(f"匯入{j},import-{run_tag}-{i}-{j}@example.com,0900000000,壓測公司,壓測活動{j % 5}" for j in range(IMPORT_ROWS))
+        return rows.encode()
+
+    async def import_op(client, body):
+        await _expect_ok(await client.post("/customers/import/stream", content=body, headers={"Content-Type": "text/csv"}))
+
+    async def pixel_target(i):
+        return rnd.choice(data["campaign_ids"]), rnd.choice(data["customer_ids"])
+
+    async def new_campaign(i):
+        async with AsyncSessionLocal() as db:
+            campaign_id = (await db.execute(insert(Campaign).returning(Campaign.id), [{
+                "name": f"壓測發送 {run_tag}-{i}", "subject": "壓測", "body": "親愛的 {name} 您好：\n這是一封壓測信件。",
+                "status": CampaignStatus.SENDING, "scheduled_at": datetime.now(timezone.utc),
+            }])).scalar()
+            await db.execute(insert(CampaignRecipient), [
+                {"campaign_id": campaign_id, "customer_id": cid} for cid in data["customer_ids"][:DELIVERY_RECIPIENTS]
+            ])
+            await db.commit()
+
+    async def deliver(client, state):
+        await deliver_sending_campaigns(wait=True)
+
+    return [
+        Scenario("stats", get(lambda s: "/customers/stats")),
+        Scenario("stats_uncached", get(lambda s: "/customers/stats"), prepare=invalidate_stats, concurrency=1),
+        Scenario("customers_page", get(lambda s: "/customers/?limit=50")),
+        Scenario("customers_search", get(lambda s: "/customers/?limit=50&q=example")),
+        Scenario("events", get(lambda s: "/customers/events/?limit=50")),
+        Scenario("campaigns", get(lambda s: "/customers/marketing/campaigns?limit=50")),
+        Scenario("import", import_op, prepare=import_payload, items=IMPORT_ROWS, iterations=10, concurrency=1),
+        Scenario("tracking_pixel", get(lambda s: f"/customers/tracking/open/{s[0]}/{s[1]}"), prepare=pixel_target),
+        Scenario("delivery", deliver, prepare=new_campaign, items=DELIVERY_RECIPIENTS, iterations=3, concurrency=1),
+    ]
+
+# --- 結果比較 ---
+
+def find_regressions(current: dict, baseline: dict, threshold: float) -> list:
+    flagged = []
+    for name, result in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change > threshold) if higher_is_worse else (change < -threshold):
+                flagged.append({"scenario": name, "metric": metric, "baseline": old, "current": new, "change_pct": round(change * 100, 1)})
+    return flagged
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args) -> dict:
+    data = await _dataset()
+    scenarios = build_scenarios(data, random.Random(args.seed))
+    if args.only:
+        wanted = set(args.only.split(","))
+        scenarios = [s for s in scenarios if s.name in wanted]
+
+    # 正式環境的速率限制是 Gmail 配額；壓測時放寬，量測的是引擎本身的吞吐量
+    delivery_engine.bucket = TokenBucket(args.mail_rate, args.mail_rate)
+
+    results = {}
+    with GmailStub(latency=args.gmail_latency):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+            for scenario in scenarios:
+                print(f"⏱️  {scenario.name} ...", flush=True)
+                results[scenario.name] = await run_scenario(client, scenario, args.iterations, args.concurrency)
+        await open_buffer.flush()
+    await engine.dispose()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(), "commit": _git_commit(),
+            "database": engine.url.get_backend_name(), "python": platform.python_version(),
+            "dataset": data["counts"], "iterations": args.iterations, "concurrency": args.concurrency,
+            "gmail_latency_s": args.gmail_latency, "mail_rate": args.mail_rate,
+        },
+        "scenarios": results,
+    }
+
+def print_report(report: dict):
+    print(f"\n{'情境':<18}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'吞吐量/秒':>12}{'峰值 MB':>10}")
+    for name, r in report["scenarios"].items():
+        print(f"{name:<20}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['throughput']:>14.1f}{r['peak_mem_mb']:>10.2f}")
+    for r in report.get("regressions", []):
+        print(f"🔴 退步: {r['scenario']} {r['metric']} {r['baseline']} → {r['current']} ({r['change_pct']:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help="只跑指定情境 (逗號分隔)")
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=10)
+    parser.add_argument("--gmail-latency", type=float, default=0.02, help="Gmail 替身每個請求的延遲 (秒)")
+    parser.add_argument("--mail-rate", type=float, default=1000, help="發送引擎的速率上限 (封/秒)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="結果 JSON 路徑 (預設 benchmarks/results/<時間>.json)")
+    parser.add_argument("--baseline", help="與先前的結果 JSON 比較")
+    parser.add_argument("--threshold", type=float, default=0.10, help="退步判定門檻 (預設 10%%)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["baseline"] = args.baseline
+            report["regressions"] = find_regressions(report, json.load(f), args.threshold)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_report(report)
+    print(f"\n📄 結果已寫入 {out}")
+    sys.exit(1 if report.get("regressions") else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""產生可重現的測試資料 (Faker, 固定 seed)
+
+寫入 settings.DATABASE_URL 指向的資料庫 (例如 docker-compose 的 Postgres)：
+
+    docker compose up -d db
+    python -m benchmarks.seed --customers 50000 --reset
+    python -m benchmarks.seed --customers 5000 --events 20 --campaigns 10 --recipients 1000
+    python -m benchmarks.seed --customers 1000000 --duplicate-rate 0.05 --reset   # 去重基準測試
+
+--reset 會清空所有 CRM 資料表，請勿對正式資料庫執行。
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from faker import Faker
+from sqlalchemy import insert, delete
+from app.database import engine, AsyncSessionLocal
+from app.migrations import upgrade
+from app.models import (
+    Customer, Course, Event, EventRegistration, Campaign, CampaignStatus, CampaignRecipient,
+    Interaction, EmailTemplate, Segment, DuplicateSuggestion, customer_courses
+)
+from app.rollups import rebuild_rollups
+
+INSERT_BATCH = 5000
+
+def _batches(rows, size: int = INSERT_BATCH):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+async def _insert(db, table, rows):
+    for batch in _batches(rows):
+        await db.execute(insert(table), batch)
+
+async def _insert_ids(db, model, rows) -> list:
+    """批次寫入並回傳新 id；rows 為空時不執行 (空的 executemany 會變成 INSERT DEFAULT VALUES)"""
+    ids = []
+    for batch in _batches(rows):
+        ids += (await db.execute(insert(model).returning(model.id), batch)).scalars().all()
+    return ids
+
+async def reset_database():
+    async with AsyncSessionLocal() as db:
+        for table in (customer_courses, CampaignRecipient, Campaign, Segment, EventRegistration, Interaction, DuplicateSuggestion, Event, Course, Customer, EmailTemplate):
+            await db.execute(delete(table))
+        await db.commit()
+
+def duplicate_of(row: dict, i: int, run_tag: str, rnd: random.Random, fake: Faker) -> dict:
+    """模擬同一人以另一個 Email 重複建檔：電話改格式或留空，姓名偶爾有一個錯字
+
+    Email 為 dup-{run_tag}-{i}@...，benchmarks.bench_dedup 以此對回原客戶 (bench-{run_tag}-{i}@...) 計算召回率
+    """
+    name = row["name"]
+    if rnd.random() < 0.3:
+        name = name[:-1] + fake.first_name()[-1]
+    r = rnd.random()
+    phone = None if r < 0.3 else ("".join(ch for ch in row["phone"] if ch.isdigit()) if r < 0.7 else row["phone"])
+    company = row["company"] if rnd.random() < 0.8 else None
+    return {**row, "name": name, "email": f"dup-{run_tag}-{i}@example.org", "phone": phone, "company": company}
+
+async def seed(customers: int = 10_000, courses: int = 20, events: int = 50, campaigns: int = 20,
+               recipients: int = 2_000, registrations_per_customer: float = 2.0, purchase_rate: float = 0.15,
+               duplicate_rate: float = 0.0, seed_value: int = 42, reset: bool = False) -> dict:
+    fake = Faker("zh_TW")
+    Faker.seed(seed_value)
+    rnd = random.Random(seed_value)
+    now = datetime.now(timezone.utc)
+
+    await upgrade(engine)
+    if reset:
+        await reset_database()
+
+    # 公司分佈刻意偏斜 (少數大公司)，較接近實際資料
+    companies = [fake.company() for _ in range(max(10, customers // 200))] + [None]
+    weights = [1 / (i + 1) for i in range(len(companies))]
+    run_tag = f"{seed_value}-{int(time.time())}"
+
+    async with AsyncSessionLocal() as db:
+        course_ids = await _insert_ids(db, Course, [
+            {"name": f"{fake.catch_phrase()}課程", "price": rnd.choice([1200, 3600, 9800, 16000])} for _ in range(courses)
+        ])
+        event_ids = await _insert_ids(db, Event, [
+            {"name": f"{fake.city()}講座 #{i + 1}", "date": now - timedelta(days=rnd.randint(0, 720)), "location": fake.city()} for i in range(events)
+        ])
+
+        customer_rows = [{
+            "name": fake.name(), "email": f"bench-{run_tag}-{i}@example.com", "phone": fake.phone_number(),
+            "company": rnd.choices(companies, weights)[0], "created_at": now - timedelta(minutes=rnd.randint(0, 1_000_000)),
+        } for i in range(customers)]
+        if duplicate_rate:  # 未指定時不消耗亂數，其他資料與先前的 seed 相同
+            customer_rows += [duplicate_of(customer_rows[i], i, run_tag, rnd, fake) for i in range(customers) if rnd.random() < duplicate_rate]
+        customer_ids = await _insert_ids(db, Customer, customer_rows)
+
+        regs = set()
+        for cid in customer_ids:
+            for _ in range(min(len(event_ids), int(rnd.expovariate(1 / registrations_per_customer)) if registrations_per_customer else 0)):
+                regs.add((cid, rnd.choice(event_ids)))
+        await _insert(db, EventRegistration, [{"customer_id": c, "event_id": e, "attended": rnd.random() < 0.7} for c, e in regs])
+
+        purchases = {(cid, rnd.choice(course_ids)) for cid in customer_ids if course_ids and rnd.random() < purchase_rate}
+        await _insert(db, customer_courses, [{"customer_id": c, "course_id": k} for c, k in purchases])
+
+        campaign_ids = await _insert_ids(db, Campaign, [{
+            "name": f"電子報 #{i + 1}", "subject": fake.sentence(), "body": "親愛的 {name} 您好：\n" + fake.paragraph(),
+            "status": CampaignStatus.COMPLETED, "scheduled_at": now - timedelta(days=i), "created_at": now - timedelta(days=i),
+        } for i in range(campaigns)])
+        recipient_rows = []
+        for kid in campaign_ids:
+            for cid in rnd.sample(customer_ids, min(recipients, len(customer_ids))):
+                sent = now - timedelta(minutes=rnd.randint(1, 10_000))
+                recipient_rows.append({"campaign_id": kid, "customer_id": cid, "sent_at": sent, "opened_at": sent + timedelta(minutes=5) if rnd.random() < 0.3 else None})
+        await _insert(db, CampaignRecipient, recipient_rows)
+
+        await rebuild_rollups(db)
+        await db.commit()
+
+    return {
+        "customers": len(customer_ids), "courses": len(course_ids), "events": len(event_ids),
+        "registrations": len(regs), "purchases": len(purchases), "campaigns": len(campaign_ids), "recipients": len(recipient_rows),
+    }
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--customers", type=int, default=10_000)
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--campaigns", type=int, default=20)
+    parser.add_argument("--recipients", type=int, default=2_000, help="每個行銷活動的收件人數")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="另外產生的重複客戶比例 (去重測試用)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="先清空所有資料表")
+
+def seed_kwargs(args) -> dict:
+    return dict(customers=args.customers, courses=args.courses, events=args.events, campaigns=args.campaigns,
+                recipients=args.recipients, duplicate_rate=args.duplicate_rate, seed_value=args.seed, reset=args.reset)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    counts = asyncio.run(seed(**seed_kwargs(args)))
+    print(f"🌱 [Seed] 完成 ({time.perf_counter() - start:.1f} 秒)")
+    for name, n in counts.items():
+        print(f"  {name:<14} {n:>10,}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""冷啟動基準測試：import 時間與啟動到第一個請求成功的時間
+
+每一輪都啟動全新的 Python 行程 (與 autoscaling 新副本相同)，分別量測：
+
+- import：`import app.main` 花費的時間，以及是否載入了 Google client 套件
+- first request：從啟動 uvicorn 到第一個請求回應 200 的時間，
+  AUTO_MIGRATE 開 / 關各量一次 (關閉時 schema 需已由 python -m app.migrations 套用)
+
+    python -m app.migrations
+    python -m benchmarks.startup
+    python -m benchmarks.startup -n 10 --path /customers/stats
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+heavy = sorted({m.split('.')[0] for m in sys.modules if m.startswith(('google', 'googleapiclient', 'httplib2'))})
+print(json.dumps({"import_s": elapsed, "modules": len(sys.modules), "google_loaded": heavy}))
+"""
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def measure_import() -> dict:
+    out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def measure_first_request(path: str, auto_migrate: bool, timeout: float = 60) -> float:
+    port = _free_port()
+    env = {**os.environ, "AUTO_MIGRATE": str(auto_migrate).lower()}
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            while time.perf_counter() - start < timeout:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"uvicorn 結束 (code {proc.returncode}): {proc.stderr.read().decode()[-500:]}")
+                try:
+                    if client.get(path).status_code == 200:
+                        return time.perf_counter() - start
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+        raise RuntimeError(f"{timeout} 秒內未能成功請求 {path}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def _summary(values: list) -> dict:
+    ms = [v * 1000 for v in values]
+    return {"median_ms": round(statistics.median(ms), 1), "min_ms": round(min(ms), 1), "max_ms": round(max(ms), 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--path", default="/customers/stats", help="第一個請求的路徑")
+    parser.add_argument("--out", help="結果 JSON 路徑")
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    report = {
+        "import": {**_summary([r["import_s"] for r in imports]), "modules": imports[-1]["modules"], "google_loaded": imports[-1]["google_loaded"]},
+        "first_request": {},
+    }
+    for auto_migrate in (True, False):
+        label = "auto_migrate" if auto_migrate else "fast_start"
+        print(f"⏱️  first request ({label}) ...", flush=True)
+        report["first_request"][label] = _summary([measure_first_request(args.path, auto_migrate) for _ in range(args.runs)])
+
+    imp = report["import"]
+    print(f"\nimport app.main      {imp['median_ms']:>8.1f} ms (min {imp['min_ms']}, max {imp['max_ms']})，{imp['modules']} 個模組")
+    print(f"Google client 已載入  {', '.join(imp['google_loaded']) or '否'}")
+    for label, r in report["first_request"].items():
+        print(f"first request {label:<12}{r['median_ms']:>8.1f} ms (min {r['min_ms']}, max {r['max_ms']})")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 結果已寫入 {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -10,5 +10,7 @@ if hasattr(time, 'tzset'):
 if __name__ == "__main__":
     # 讀取 Zeabur 自動分配的 PORT，若無則預設 8080
     port = int(os.getenv("PORT", 8080))
+    # API 行程數；多於 1 時建議設定 RUN_SCHEDULER=false 並另外執行 python worker.py
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
     # 啟動 app 資料夾下的 main.py 裡的 app
-    uvicorn.run("app.main:app", host="0.0.0.0", port=port)
+    uvicorn.run("app.main:app", host="0.0.0.0", port=port, workers=workers)
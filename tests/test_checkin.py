@@ -0,0 +1,49 @@
+"""bulk_check_in：新增 / 更新計數與 skipped (輸入先解析為不重複的客戶)"""
+from datetime import datetime, timezone
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.future import select
+from app.checkin import bulk_check_in
+from app.models import Customer, Event, EventRegistration
+from app.rollups import read_dashboard_stats, rebuild_rollups
+
+async def _seed(db):
+    """客戶 1..6；1-4 已報名活動，其中 1 已簽到"""
+    db.add(Event(name="年會", date=datetime.now(timezone.utc)))
+    await db.execute(insert(Customer), [{"name": f"客戶{i}", "email": f"c{i}@example.com"} for i in range(1, 7)])
+    await db.execute(insert(EventRegistration), [
+        {"customer_id": i, "event_id": 1, "attended": i == 1} for i in range(1, 5)
+    ])
+    await rebuild_rollups(db)
+    await db.commit()
+
+async def _attended(db) -> set:
+    return set((await db.execute(select(EventRegistration.customer_id).where(EventRegistration.event_id == 1, EventRegistration.attended.is_(True)))).scalars())
+
+async def test_registered_only_counts(db):
+    await _seed(db)
+    result = await bulk_check_in(db, 1, customer_ids=[1, 2, 2, 5, 404], emails=["c2@example.com", " c3@example.com ", "nobody@example.com"], register_walk_ins=False)
+    # 2 以 id 與 Email 各傳一次只算一人；1 已簽到、5 未報名、404 與 nobody 找不到
+    assert result == {"checked_in": 2, "walk_ins": 0, "skipped": 4}
+    assert await _attended(db) == {1, 2, 3}
+
+    again = await bulk_check_in(db, 1, customer_ids=[2, 3], emails=["c2@example.com"], register_walk_ins=False)
+    assert again == {"checked_in": 0, "walk_ins": 0, "skipped": 2}
+
+async def test_no_matching_customers(db):
+    await _seed(db)
+    result = await bulk_check_in(db, 1, customer_ids=[404], emails=["nobody@example.com", "", "  "])
+    assert result == {"checked_in": 0, "walk_ins": 0, "skipped": 2}
+
+@pytest.mark.postgres
+async def test_walk_ins_are_registered(db):
+    await _seed(db)
+    result = await bulk_check_in(db, 1, customer_ids=[1, 2, 5], emails=["c5@example.com", "c6@example.com", "nobody@example.com"])
+    # 2 更新為出席；5、6 現場報名；1 已簽到、nobody 找不到
+    assert result == {"checked_in": 3, "walk_ins": 2, "skipped": 2}
+    assert await _attended(db) == {1, 2, 5, 6}
+
+    await db.flush()
+    incremental = await read_dashboard_stats(db)
+    await rebuild_rollups(db)
+    assert incremental == await read_dashboard_stats(db)
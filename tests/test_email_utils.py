@@ -0,0 +1,54 @@
+"""Gmail 發送 (對本地 Gmail 替身)：單封、batch、429 退避重試、batch 回應缺漏的請求不可視為已寄出"""
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app import delivery
+from app.delivery import Delivery, DeliveryEngine, DeliveryReport
+from app.email_utils import GmailSendError, build_raw_message, gmail_service_cache, send_raw, send_raw_batch
+from benchmarks.gmail_stub import GmailStub
+
+def _raw(i: int) -> str:
+    return build_raw_message(f"c{i}@example.com", "主旨", f"內文 {i}")
+
+def test_send_single():
+    with GmailStub() as stub:
+        assert send_raw(_raw(0)) == "bench-1"
+    assert stub.sent == 1
+
+def test_send_batch():
+    with GmailStub() as stub:
+        results = send_raw_batch([_raw(i) for i in range(3)])
+    assert sorted(mid for mid, _ in results) == ["bench-1", "bench-2", "bench-3"]
+    assert [err for _, err in results] == [None] * 3 and stub.sent == 3
+
+def test_throttled_sends_are_retryable():
+    with GmailStub(throttle_rate=1.0):
+        with pytest.raises(GmailSendError) as exc:
+            send_raw(_raw(0))
+        results = send_raw_batch([_raw(i) for i in range(2)])
+    assert (exc.value.status, exc.value.retryable) == (429, True)
+    assert [(mid, err.status, err.retryable) for mid, err in results] == [(None, 429, True)] * 2
+
+def test_batch_request_without_response_is_not_sent(monkeypatch):
+    new_batch = gmail_service_cache.new_batch
+
+    def dropping(callback):
+        # 模擬 batch 回應中缺少第 2 個請求的結果
+        return new_batch(lambda request_id, response, exception: None if request_id == "1" else callback(request_id, response, exception))
+
+    monkeypatch.setattr(gmail_service_cache, "new_batch", dropping)
+    with GmailStub():
+        results = send_raw_batch([_raw(i) for i in range(3)])
+    assert results[0][1] is None and results[2][1] is None
+    mid, err = results[1]
+    assert mid is None and isinstance(err, GmailSendError) and err.retryable
+
+@pytest.mark.parametrize("size", [1, 10])
+async def test_engine_retries_throttled_sends(monkeypatch, size):
+    monkeypatch.setattr(delivery, "_backoff", lambda attempt, retry_after=None: 0)
+    engine = DeliveryEngine(rate=1000, burst=1000, max_retries=20)
+    chunk = [Delivery(i, f"c{i}@example.com", _raw(i)) for i in range(size)]
+    report = DeliveryReport(campaign_id=1)
+    with GmailStub(throttle_rate=0.5, seed=1) as stub, ThreadPoolExecutor(1) as executor:
+        errors = await engine._send_chunk(executor, chunk, report)
+    assert errors == [None] * size
+    assert stub.sent == size and stub.throttled == report.retries > 0
@@ -0,0 +1,38 @@
+"""批次匯入：大 chunk 分段寫入 (不超過 asyncpg 單一語句 32767 個參數)、既有客戶不重複建立"""
+import pytest
+from sqlalchemy import event, func
+from sqlalchemy.future import select
+from app.database import engine
+from app.importer import import_rows
+from app.models import Customer, EventRegistration
+
+ASYNCPG_MAX_PARAMS = 32767
+
+@pytest.fixture
+def max_params():
+    """記錄單一語句最多用了幾個參數 (SQLite 的上限較寬，需自行檢查)"""
+    seen = [0]
+
+    def track(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            seen[0] = max(seen[0], len(parameters or ()))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", track)
+    yield seen
+    event.remove(engine.sync_engine, "before_cursor_execute", track)
+
+async def _rows(n: int, offset: int = 0):
+    for i in range(n):
+        yield i + 2, {"name": f"客戶{i + offset}", "email": f"c{i + offset}@example.com", "company": "甲公司", "events_str": "年會" if i % 3 == 0 else None}
+
+async def test_large_chunk_stays_under_parameter_limit(db, max_params):
+    # 9000 列 × 4 欄 = 36000 個參數，必須分段
+    result = await import_rows(db, _rows(9000), chunk_size=9000)
+    assert (result.created, result.registrations, result.errors) == (9000, 3000, [])
+    assert 0 < max_params[0] <= ASYNCPG_MAX_PARAMS
+
+    again = await import_rows(db, _rows(9000, offset=6000), chunk_size=9000)
+    assert (again.created, again.registrations) == (6000, 2000)
+    assert max_params[0] <= ASYNCPG_MAX_PARAMS
+    assert (await db.execute(select(func.count()).select_from(Customer))).scalar() == 15000
+    assert (await db.execute(select(func.count()).select_from(EventRegistration))).scalar() == 5000
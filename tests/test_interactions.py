@@ -0,0 +1,40 @@
+"""互動紀錄匯入：created_at 必須落在已建立分區的範圍內"""
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy.future import select
+from app.config import settings
+from app.interactions import accepted_range, ingest, iter_json_array, month_start
+from app.models import Customer, Interaction
+
+@pytest.mark.parametrize("ts, offset, expected", [
+    (datetime(2025, 1, 31, 23, 59, tzinfo=timezone.utc), 0, datetime(2025, 1, 1, tzinfo=timezone.utc)),
+    (datetime(2025, 11, 15, tzinfo=timezone.utc), 3, datetime(2026, 2, 1, tzinfo=timezone.utc)),
+    (datetime(2025, 3, 1, tzinfo=timezone.utc), -3, datetime(2024, 12, 1, tzinfo=timezone.utc)),
+])
+def test_month_start(ts, offset, expected):
+    assert month_start(ts, offset) == expected
+
+def test_accepted_range(monkeypatch):
+    monkeypatch.setattr(settings, "INTERACTION_PARTITION_MONTHS", 3)
+    monkeypatch.setattr(settings, "INTERACTION_MAX_AGE_DAYS", 365)
+    now = datetime(2025, 12, 20, tzinfo=timezone.utc)
+    # 預先建立 3 個月的分區，上限為其後一個月的月初
+    assert accepted_range(now) == (now - timedelta(days=365), datetime(2026, 4, 1, tzinfo=timezone.utc))
+
+async def test_ingest_rejects_out_of_range_timestamps(db):
+    db.add(Customer(name="客戶", email="c@example.com"))
+    await db.commit()
+    now = datetime.now(timezone.utc)
+    earliest, latest = accepted_range(now)
+    items = [
+        {"customer_id": 1, "type": "電話"},
+        {"customer_id": 1, "type": "Email", "created_at": (now - timedelta(days=1)).replace(tzinfo=None).isoformat()},  # 未帶時區視為 UTC
+        {"customer_id": 1, "type": "會議", "created_at": (latest + timedelta(days=1)).isoformat()},
+        {"customer_id": 1, "type": "會議", "created_at": (earliest - timedelta(days=1)).isoformat()},
+        {"customer_id": 2, "type": "電話"},
+    ]
+    result = await ingest(db, iter_json_array(items))
+    assert result.inserted == 2 and result.error_count == 3
+    assert [e.split(":")[0] for e in result.errors] == ["第 3 筆", "第 4 筆", "第 5 筆"]
+    types = (await db.execute(select(Interaction.type).order_by(Interaction.id))).scalars().all()
+    assert types == ["電話", "Email"]
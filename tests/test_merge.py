@@ -0,0 +1,110 @@
+"""merge_customers：關聯資料改指向保留的客戶、重複列合併、rollup 與完整重建一致"""
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.future import select
+from app.dedup import MergeError, merge_customers
+from app.models import (
+    Campaign, CampaignRecipient, Course, Customer, DuplicateSuggestion, Event, EventRegistration,
+    Interaction, customer_courses,
+)
+from app.rollups import read_dashboard_stats, rebuild_rollups
+
+NOW = datetime.now(timezone.utc)
+
+def _utc(value: datetime) -> datetime:
+    # SQLite 不保存時區
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+async def _seed(db):
+    keep = Customer(name="王小明", email="ming@example.com")
+    dup1 = Customer(name="王小明", email="ming.wang@example.com", phone="0912345678")
+    dup2 = Customer(name="王小明", email="ming@work.example.com", company="甲公司")
+    other = Customer(name="李大華", email="hua@example.com", company="乙公司")
+    e1, e2 = Event(name="講座", date=NOW), Event(name="工作坊", date=NOW)
+    course = Course(name="基礎", price=1000)
+    c1 = Campaign(name="電子報", subject="s", body="b")
+    c2 = Campaign(name="促銷", subject="s", body="b")
+    db.add_all([keep, dup1, dup2, other, e1, e2, course, c1, c2])
+    await db.flush()
+
+    await db.execute(insert(EventRegistration), [
+        {"customer_id": keep.id, "event_id": e1.id, "attended": False, "registered_at": NOW},
+        {"customer_id": dup1.id, "event_id": e1.id, "attended": True, "registered_at": NOW - timedelta(days=3)},
+        {"customer_id": dup2.id, "event_id": e2.id, "attended": False, "registered_at": NOW},
+        {"customer_id": other.id, "event_id": e2.id, "attended": True, "registered_at": NOW},
+    ])
+    await db.execute(insert(customer_courses), [
+        {"customer_id": keep.id, "course_id": course.id},
+        {"customer_id": dup1.id, "course_id": course.id},
+    ])
+    await db.execute(insert(CampaignRecipient), [
+        {"campaign_id": c1.id, "customer_id": keep.id},
+        {"campaign_id": c1.id, "customer_id": dup1.id, "sent_at": NOW, "opened_at": NOW},
+        {"campaign_id": c2.id, "customer_id": dup2.id},
+    ])
+    await db.execute(insert(Interaction), [
+        {"customer_id": dup1.id, "type": "電話", "notes": "詢問課程"},
+        {"customer_id": dup2.id, "type": "Email"},
+    ])
+    db.add_all([
+        DuplicateSuggestion(customer_id=keep.id, duplicate_id=dup1.id, score=0.9),
+        DuplicateSuggestion(customer_id=dup2.id, duplicate_id=other.id, score=0.4),
+    ])
+    await rebuild_rollups(db)
+    await db.commit()
+    return keep, dup1, dup2, other, (e1, e2), course, (c1, c2)
+
+async def test_merge_reassigns_related_rows(db):
+    keep, dup1, dup2, other, (e1, e2), course, (c1, c2) = await _seed(db)
+    keep_id, old_ids = keep.id, [dup1.id, dup2.id]
+
+    result = await merge_customers(db, {keep_id: [dup1.id, dup2.id, dup1.id]})
+    await db.commit()
+    assert result == {"groups": 1, "merged": 2, "interactions_moved": 2}
+
+    assert (await db.execute(select(Customer.id).where(Customer.id.in_(old_ids)))).first() is None
+    kept = (await db.execute(select(Customer.phone, Customer.company).where(Customer.id == keep_id))).one()
+    assert tuple(kept) == ("0912345678", "甲公司")  # 空白欄位以被併入者補上
+
+    regs = {r.event_id: r for r in (await db.execute(select(EventRegistration).where(EventRegistration.customer_id == keep_id))).scalars()}
+    assert set(regs) == {e1.id, e2.id}
+    assert regs[e1.id].attended is True  # 任一筆出席即出席
+    assert _utc(regs[e1.id].registered_at) == NOW - timedelta(days=3)  # 報名時間取最早
+
+    courses = (await db.execute(select(customer_courses.c.customer_id, customer_courses.c.course_id))).all()
+    assert sorted(courses) == [(keep_id, course.id)]  # 重複的課程只留一筆
+
+    recipients = {r.campaign_id: r for r in (await db.execute(select(CampaignRecipient).where(CampaignRecipient.customer_id == keep_id))).scalars()}
+    assert set(recipients) == {c1.id, c2.id}
+    assert recipients[c1.id].sent_at is not None and recipients[c1.id].opened_at is not None  # 已寄給併入者，不會重寄
+    assert (await db.execute(select(CampaignRecipient).where(CampaignRecipient.customer_id.in_(old_ids)))).first() is None
+
+    notes = (await db.execute(select(Interaction.type, Interaction.notes).where(Interaction.customer_id == keep_id).order_by(Interaction.id))).all()
+    assert [t for t, _ in notes] == ["電話", "Email", "合併"]
+    assert "ming.wang@example.com" in notes[-1].notes and "ming@work.example.com" in notes[-1].notes
+
+    assert (await db.execute(select(DuplicateSuggestion))).first() is None
+
+async def test_merge_keeps_rollups_consistent(db):
+    keep, dup1, dup2, *_ = await _seed(db)
+    await merge_customers(db, {keep.id: [dup1.id, dup2.id]})
+    await db.flush()
+    incremental = await read_dashboard_stats(db)
+    await rebuild_rollups(db)
+    rebuilt = await read_dashboard_stats(db)
+    key = lambda s: s["company"]
+    assert sorted(incremental.pop("customer_segments"), key=key) == sorted(rebuilt.pop("customer_segments"), key=key)
+    assert incremental == rebuilt
+    assert rebuilt["total_customers"] == 2 and rebuilt["total_purchases"] == 1
+
+@pytest.mark.parametrize("groups", [
+    {},
+    {1: [2], 3: [2]},  # 同一人併入兩個群組
+    {1: [2], 2: [3]},  # 既是保留又是被併入
+    {1: [999]},        # 不存在
+])
+async def test_merge_rejects_invalid_groups(db, groups):
+    await _seed(db)
+    with pytest.raises(MergeError):
+        await merge_customers(db, groups)
@@ -0,0 +1,120 @@
+"""Outbox 認領：SKIP LOCKED 互斥 (Postgres)、租約續期與歸還只作用在自己的列"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import insert, update
+from sqlalchemy.future import select
+from app.database import AsyncSessionLocal
+from app.models import Campaign, CampaignRecipient, CampaignStatus, Customer
+from app.config import settings
+from app.outbox import Lease, claim_batch, finalize_campaign, iter_claimed
+
+async def _campaign(db, recipients: int) -> int:
+    campaign = Campaign(name="電子報", subject="s", body="b", status=CampaignStatus.SENDING)
+    db.add(campaign)
+    await db.execute(insert(Customer), [{"name": f"客戶{i}", "email": f"c{i}@example.com"} for i in range(recipients)])
+    await db.flush()
+    ids = (await db.execute(select(Customer.id))).scalars().all()
+    await db.execute(insert(CampaignRecipient), [{"campaign_id": campaign.id, "customer_id": cid} for cid in ids])
+    await db.commit()
+    return campaign.id
+
+async def _recipients(db, campaign_id: int) -> dict:
+    rows = await db.execute(select(CampaignRecipient).where(CampaignRecipient.campaign_id == campaign_id).execution_options(populate_existing=True))
+    return {r.customer_id: r for r in rows.scalars()}
+
+@pytest.mark.postgres
+async def test_open_claims_skip_each_others_rows(db):
+    campaign_id = await _campaign(db, 50)
+    async with AsyncSessionLocal() as a, AsyncSessionLocal() as b:
+        first = {r["id"] for r in await claim_batch(a, campaign_id, limit=30, worker_id="a")}
+        # a 尚未 commit，列鎖仍在：b 只能認領其餘的列
+        second = {r["id"] for r in await claim_batch(b, campaign_id, limit=30, worker_id="b")}
+        assert len(first) == 30 and len(second) == 20 and not first & second
+        await a.commit()
+        await b.commit()
+    # 租約未逾期前不會被再次認領
+    assert await claim_batch(db, campaign_id, worker_id="c") == []
+
+@pytest.mark.postgres
+async def test_concurrent_workers_claim_each_recipient_once(db):
+    campaign_id = await _campaign(db, 200)
+
+    async def worker(name: str) -> list:
+        lease = Lease(campaign_id, worker_id=name)
+        return [row["id"] async for row in iter_claimed(campaign_id, lease=lease, batch=lambda: 7)]
+
+    claimed = await asyncio.gather(*(worker(f"w{i}") for i in range(4)))
+    flat = [cid for ids in claimed for cid in ids]
+    assert len(flat) == len(set(flat)) == 200
+    owners = {r.customer_id: r.claimed_by for r in (await _recipients(db, campaign_id)).values()}
+    for i, ids in enumerate(claimed):
+        assert all(owners[cid] == f"w{i}" for cid in ids)
+
+async def test_renew_drops_rows_claimed_by_another_worker(db):
+    campaign_id = await _campaign(db, 6)
+    lease = Lease(campaign_id, worker_id="me", seconds=60)
+    async for _ in iter_claimed(campaign_id, lease=lease):
+        pass
+    assert len(lease.held) == 6
+    stolen, *_ = sorted(lease.held)
+    # 模擬租約逾期後被其他 worker 認領
+    await db.execute(update(CampaignRecipient).where(CampaignRecipient.customer_id == stolen).values(claimed_by="other"))
+    await db.commit()
+
+    assert await lease.renew(db) == {stolen}
+    await db.commit()
+    assert stolen not in lease.held and len(lease.held) == 5
+    rows = await _recipients(db, campaign_id)
+    assert rows[stolen].claimed_by == "other"
+    soon = datetime.now(timezone.utc) + timedelta(seconds=50)
+    for cid in lease.held:
+        expires = rows[cid].lease_expires_at
+        assert (expires if expires.tzinfo else expires.replace(tzinfo=timezone.utc)) > soon
+
+async def test_release_returns_unsent_rows_only(db):
+    campaign_id = await _campaign(db, 6)
+    lease = Lease(campaign_id, worker_id="me")
+    async for _ in iter_claimed(campaign_id, lease=lease):
+        pass
+    sending = set(sorted(lease.held)[:2])
+    lease.sending |= sending  # 已交給 Gmail、結果未知：不可歸還
+    stolen = sorted(lease.held)[-1]
+    await db.execute(update(CampaignRecipient).where(CampaignRecipient.customer_id == stolen).values(claimed_by="other"))
+
+    assert await lease.release(db) == 3
+    await db.commit()
+    rows = await _recipients(db, campaign_id)
+    for cid, r in rows.items():
+        if cid in sending:
+            assert (r.claimed_by, r.attempts) == ("me", 1)
+        elif cid == stolen:
+            assert (r.claimed_by, r.attempts) == ("other", 1)
+        else:
+            assert (r.claimed_by, r.lease_expires_at, r.attempts) == (None, None, 0)
+    # 歸還的列可立即被其他 worker 認領
+    assert len(await claim_batch(db, campaign_id, worker_id="next")) == 3
+
+async def test_finalize_waits_for_live_lease_on_last_attempt(db):
+    campaign_id = await _campaign(db, 3)
+    now = datetime.now(timezone.utc)
+    last = settings.OUTBOX_MAX_ATTEMPTS
+    await db.execute(update(CampaignRecipient).where(CampaignRecipient.customer_id == 1).values(sent_at=now, attempts=1))
+    # 2：其他 worker 正在做最後一次發送；3：最後一次認領的 worker 已崩潰 (租約逾期)
+    await db.execute(update(CampaignRecipient).where(CampaignRecipient.customer_id == 2).values(claimed_by="other", attempts=last, lease_expires_at=now + timedelta(minutes=5)))
+    await db.execute(update(CampaignRecipient).where(CampaignRecipient.customer_id == 3).values(claimed_by="gone", attempts=last, lease_expires_at=now - timedelta(minutes=1)))
+    await db.commit()
+
+    assert await finalize_campaign(db, campaign_id) is False
+    rows = await _recipients(db, campaign_id)
+    assert (rows[2].claimed_by, rows[2].error) == ("other", None)
+
+    # 持有者寫回 (只更新 claimed_by 仍是自己的列) 後即可完成
+    written = await db.execute(update(CampaignRecipient).where(CampaignRecipient.customer_id == 2, CampaignRecipient.claimed_by == "other").values(sent_at=now, claimed_by=None, lease_expires_at=None))
+    assert written.rowcount == 1
+    await db.commit()
+    assert await finalize_campaign(db, campaign_id) is True
+    rows = await _recipients(db, campaign_id)
+    assert rows[2].sent_at is not None and rows[2].error is None
+    assert (rows[3].error, rows[3].claimed_by) == ("重試次數過多", None)
+    assert (await db.get(Campaign, campaign_id, populate_existing=True)).status == CampaignStatus.COMPLETED
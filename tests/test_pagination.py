@@ -0,0 +1,59 @@
+"""Keyset cursor：編碼 / 解碼往返、格式錯誤回 400、分頁走訪不重複不遺漏"""
+from datetime import datetime, timedelta, timezone
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import insert
+from app.config import settings
+from app.models import Customer
+from app.pagination import decode_cursor, encode_cursor, page_of
+from app.router import read_customers
+
+@pytest.mark.parametrize("values, types", [
+    ((datetime(2025, 3, 1, 8, 30, 15, 123456, tzinfo=timezone.utc), 42), (datetime, int)),
+    ((datetime(2025, 3, 1, 16, 30, tzinfo=timezone(timedelta(hours=8))), 7), (datetime, int)),
+    ((datetime(2025, 3, 1), 1), (datetime, int)),
+    ((0.8734567890123, 12, 345), (float, int, int)),
+    (("王小明", 3), (str, int)),
+])
+def test_cursor_round_trip(values, types):
+    cursor = encode_cursor(*values)
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor  # 可直接放在 query string
+    assert decode_cursor(cursor, *types) == values
+
+@pytest.mark.parametrize("cursor, types", [
+    ("not-base64!", (datetime, int)),
+    (encode_cursor(1), (datetime, int)),             # 欄位數不符
+    (encode_cursor("yesterday", 1), (datetime, int)),
+    (encode_cursor("x", "y"), (float, int)),
+    ("", (int,)),
+])
+def test_invalid_cursor_is_400(cursor, types):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor, *types)
+    assert exc.value.status_code == 400
+
+def test_page_of():
+    rows = list(range(5))
+    assert page_of(rows, 5, key=lambda r: (r,)) == (rows, None)
+    page, cursor = page_of(rows, 3, key=lambda r: (r,))
+    assert page == [0, 1, 2] and decode_cursor(cursor, int) == (2,)
+
+async def test_customer_pages_cover_every_row_once(db, monkeypatch):
+    monkeypatch.setattr(settings, "FAST_JSON", False)
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    # created_at 大量重複，必須以 (created_at, id) 一起分頁
+    await db.execute(insert(Customer), [
+        {"name": f"客戶{i}", "email": f"c{i}@example.com", "created_at": base + timedelta(minutes=i // 4)} for i in range(23)
+    ])
+    await db.commit()
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = await read_customers(limit=5, cursor=cursor, q=None, fields="id", db=db)
+        seen += [r["id"] for r in page["items"]]
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == 5
+    assert len(seen) == len(set(seen)) == 23
@@ -0,0 +1,102 @@
+"""增量 rollup hooks 與 rebuild_rollups 完整重建的結果必須一致"""
+from collections import namedtuple
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from sqlalchemy.future import select
+from app.models import Customer, Course, Event, EventRegistration, customer_courses
+from app.rollups import (
+    on_customer_created, on_registration_added, on_course_enrolled, on_customer_deleted,
+    apply_import_deltas, apply_customer_deltas, read_dashboard_stats, rebuild_rollups,
+)
+
+Inserted = namedtuple("Inserted", "id company")
+
+def _normalized(stats: dict) -> dict:
+    # 同數量的公司 / 同轉換率的活動順序不固定
+    return {
+        **stats,
+        "customer_segments": sorted(stats["customer_segments"], key=lambda s: s["company"]),
+        "top_converting_events": sorted(stats["top_converting_events"], key=lambda e: e["name"]),
+    }
+
+async def _assert_matches_rebuild(db):
+    await db.flush()
+    incremental = _normalized(await read_dashboard_stats(db))
+    await rebuild_rollups(db)
+    assert incremental == _normalized(await read_dashboard_stats(db))
+
+async def _create_customer(db, n: int, company=None) -> Customer:
+    c = Customer(name=f"客戶{n}", email=f"c{n}@example.com", company=company)
+    db.add(c)
+    await on_customer_created(db, c)
+    await db.flush()
+    return c
+
+async def _register(db, customer_id: int, event_id: int):
+    await on_registration_added(db, customer_id, event_id)
+    db.add(EventRegistration(customer_id=customer_id, event_id=event_id))
+    await db.flush()
+
+async def _enroll(db, customer_id: int, course: Course):
+    await on_course_enrolled(db, customer_id, course)
+    await db.execute(insert(customer_courses).values(customer_id=customer_id, course_id=course.id))
+
+async def _fixture(db):
+    now = datetime.now(timezone.utc)
+    events = [Event(name=f"活動{i}", date=now) for i in range(3)]
+    courses = [Course(name="基礎", price=1000), Course(name="進階", price=2500.5)]
+    db.add_all(events + courses)
+    await db.flush()
+    customers = [await _create_customer(db, i, company) for i, company in enumerate(["甲公司", "甲公司", "乙公司", None, "丙公司"])]
+    return events, courses, customers
+
+async def test_write_hooks_match_rebuild(db):
+    (e1, e2, e3), (basic, advanced), (a, b, c, d, e) = await _fixture(db)
+
+    await _register(db, a.id, e1.id)
+    await _register(db, a.id, e2.id)
+    await _enroll(db, a.id, basic)      # 已報名者首次購買：兩個活動都轉換
+    await _enroll(db, a.id, advanced)   # 第二次購買不重複計算轉換
+    await _enroll(db, b.id, basic)
+    await _register(db, b.id, e1.id)    # 購買後才報名
+    await _register(db, c.id, e3.id)
+    await _enroll(db, d.id, advanced)   # 只購買未報名
+    await _assert_matches_rebuild(db)
+
+    # 刪除客戶：ORM cascade 一併刪除報名與課程
+    for customer in (a, c):
+        await on_customer_deleted(db, customer)
+        await db.delete(customer)
+    await _assert_matches_rebuild(db)
+
+async def test_import_deltas_match_rebuild(db):
+    (e1, e2, _), (basic, _), (a, _, _, _, _) = await _fixture(db)
+    await _enroll(db, a.id, basic)
+    await _register(db, a.id, e1.id)
+    await rebuild_rollups(db)
+
+    rows = (await db.execute(
+        insert(Customer).returning(Customer.id, Customer.company),
+        [{"name": f"匯入{i}", "email": f"import{i}@example.com", "company": "丁公司" if i % 2 else None} for i in range(4)],
+    )).all()
+    inserted = [Inserted(r.id, r.company) for r in rows]
+    new_regs = [(a.id, e2.id)] + [(r.id, e1.id) for r in inserted] + [(inserted[0].id, e2.id)]
+    await db.execute(insert(EventRegistration), [{"customer_id": cid, "event_id": eid} for cid, eid in new_regs])
+    await apply_import_deltas(db, inserted, new_regs)
+    await _assert_matches_rebuild(db)
+
+async def test_customer_deltas_round_trip(db):
+    """扣除後加回 (合併客戶時的用法) 應回到原狀"""
+    (e1, e2, _), (basic, _), (a, b, c, _, _) = await _fixture(db)
+    await _register(db, a.id, e1.id)
+    await _register(db, b.id, e2.id)
+    await _enroll(db, a.id, basic)
+    await rebuild_rollups(db)
+    before = _normalized(await read_dashboard_stats(db))
+
+    ids = (await db.execute(select(Customer.id))).scalars().all()
+    await apply_customer_deltas(db, ids, -1)
+    emptied = await read_dashboard_stats(db)
+    assert emptied["total_customers"] == 0 and emptied["total_revenue"] == 0 and emptied["customer_segments"] == []
+    await apply_customer_deltas(db, ids, 1)
+    assert _normalized(await read_dashboard_stats(db)) == before
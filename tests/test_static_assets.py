@@ -0,0 +1,61 @@
+"""靜態檔：Accept-Encoding 依 q 值協商、各編碼版本使用不同的 ETag"""
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.static_assets import Asset, _negotiate, static_assets
+
+BOTH = {"br": b"", "gzip": b""}
+
+@pytest.mark.parametrize("header, available, expected", [
+    ("gzip, deflate, br", BOTH, "br"),
+    ("br;q=0, gzip", BOTH, "gzip"),
+    ("gzip;q=0.5, br;q=0.8", BOTH, "br"),
+    ("gzip;q=0.9, br;q=0.8", BOTH, "gzip"),
+    ("GZIP", BOTH, "gzip"),
+    ("br;q=abc, gzip", BOTH, "gzip"),
+    ("*", BOTH, "br"),
+    ("*, br;q=0", BOTH, "gzip"),
+    ("*;q=0", BOTH, None),
+    ("identity;q=1, gzip;q=0.5", BOTH, None),
+    ("br", {"gzip": b""}, None),
+    ("", BOTH, None),
+])
+def test_negotiate(header, available, expected):
+    assert _negotiate(header, available) == expected
+
+def test_etag_per_encoding():
+    asset = Asset(body=b"", media_type="text/plain", etag='"abc"')
+    assert [asset.etag_for(e) for e in (None, "gzip", "br")] == ['"abc"', '"abc-gz"', '"abc-br"']
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """完整的 app (含全站 gzip middleware)；不觸發 startup，只載入暫存目錄的靜態檔"""
+    (tmp_path / "index.html").write_text("<html>" + "哈囉 " * 500 + "</html>", encoding="utf-8")
+    monkeypatch.setattr(static_assets, "directory", str(tmp_path))
+    static_assets.load()
+    yield TestClient(app)
+    static_assets.assets.clear()
+
+@pytest.mark.parametrize("header", ["gzip;q=0", "identity;q=1, gzip;q=0.5", "br;q=0, gzip;q=0", ""])
+def test_refused_gzip_is_not_applied_by_middleware(client, header):
+    plain = client.get("/", headers={"Accept-Encoding": header})
+    assert "content-encoding" not in plain.headers
+    assert not plain.headers["etag"].endswith('-gz"')
+    assert plain.content.decode().startswith("<html>")
+
+def test_conditional_get_matches_only_the_same_encoding(client):
+    gz = client.get("/", headers={"Accept-Encoding": "gzip"})
+    plain = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert gz.headers["content-encoding"] == "gzip" and "content-encoding" not in plain.headers
+    assert gz.headers["etag"] == plain.headers["etag"][:-1] + '-gz"'
+
+    etag = gz.headers["etag"]
+    assert client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+    assert client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": f"W/{etag}"}).status_code == 304
+    # 快取的是 gzip 版本，要求原始內容時必須回完整本文
+    assert client.get("/", headers={"Accept-Encoding": "identity", "If-None-Match": etag}).status_code == 200
+    assert client.get("/static/index.html", headers={"Accept-Encoding": "gzip;q=0"}).headers["etag"] == plain.headers["etag"]
+
+def test_api_gzip_respects_q_values(client):
+    assert client.get("/openapi.json", headers={"Accept-Encoding": "gzip"}).headers.get("content-encoding") == "gzip"
+    assert "content-encoding" not in client.get("/openapi.json", headers={"Accept-Encoding": "gzip;q=0, br"}).headers
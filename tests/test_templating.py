@@ -0,0 +1,36 @@
+"""編譯後範本與舊版 str.replace 的結果一致；HTML 跳脫需明確開啟"""
+import base64
+from email import message_from_bytes
+import pytest
+from app.templating import CampaignMessage, CompiledTemplate
+
+VALUES = {"name": "A&B <i>王</i>", "company": "第一行\n第二行", "email": "a@example.com", "phone": None, "events": "年會、講座"}
+
+def legacy(body: str, values: dict) -> str:
+    for field in ("name", "company", "email", "phone", "events"):
+        body = body.replace("{" + field + "}", str(values.get(field) or ""))
+    return body.replace("\n", "<br>")
+
+@pytest.mark.parametrize("body", [
+    "親愛的 {name} 您好：\n\n感謝 {company} 的支持。\n您曾參加：{events}",
+    "{name}{name}{phone}",
+    "沒有變數\n",
+    "{unknown} 保留原樣 {name}",
+])
+def test_matches_str_replace(body):
+    assert CompiledTemplate(body).render(VALUES) == legacy(body, VALUES)
+
+def test_escape_is_opt_in():
+    escaped = CompiledTemplate("<p>{name}</p>\n{company}", escape=True).render(VALUES)
+    assert escaped == "<p>A&amp;B &lt;i&gt;王&lt;/i&gt;</p><br>第一行<br>第二行"
+
+def test_plain_text_keeps_newlines():
+    assert CompiledTemplate("主旨 {name}\n", html=False).render(VALUES) == "主旨 A&B <i>王</i>\n"
+
+def test_campaign_message_body():
+    message = CampaignMessage(7, "給 {name} 的通知", "Hi {name}\n{company}", "http://crm.local")
+    raw = message_from_bytes(base64.urlsafe_b64decode(message.render_raw("a@example.com", 42, VALUES)))
+    html = raw.get_payload(decode=True).decode()
+    assert html.startswith("<html><body>" + legacy("Hi {name}\n{company}", VALUES))
+    assert "http://crm.local/customers/tracking/open/7/42" in html
+    assert raw["to"] == "a@example.com"
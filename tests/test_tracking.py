@@ -0,0 +1,66 @@
+"""開信追蹤寫回：只記錄第一次開啟、同時累加成效 rollup；寫回失敗時緩衝不超過上限"""
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert, update
+from sqlalchemy.future import select
+from app import tracking
+from app.engagement import bucket_of
+from app.models import Campaign, CampaignEngagement, CampaignRecipient, CampaignStatus, Customer
+from app.stats import OTHER_COMPANY
+from app.tracking import OpenBuffer
+
+async def _campaign(db) -> int:
+    campaign = Campaign(name="電子報", subject="s", body="b", status=CampaignStatus.COMPLETED)
+    db.add(campaign)
+    await db.execute(insert(Customer), [
+        {"name": "甲", "email": "a@example.com", "company": "甲公司"},
+        {"name": "乙", "email": "b@example.com", "company": ""},
+        {"name": "丙", "email": "c@example.com", "company": "甲公司"},
+    ])
+    await db.flush()
+    await db.execute(insert(CampaignRecipient), [{"campaign_id": campaign.id, "customer_id": cid} for cid in (1, 2, 3)])
+    await db.commit()
+    return campaign.id
+
+async def _engagement(db) -> dict:
+    rows = (await db.execute(select(CampaignEngagement).execution_options(populate_existing=True))).scalars()
+    return {(r.campaign_id, bucket_of(r.bucket), r.company): (r.sent, r.opened) for r in rows}
+
+async def test_flush_records_first_open_and_rollup(db):
+    campaign_id = await _campaign(db)
+    earlier = datetime.now(timezone.utc) - timedelta(days=1)
+    await db.execute(update(CampaignRecipient).where(CampaignRecipient.customer_id == 3).values(opened_at=earlier))
+    await db.commit()
+
+    buffer = OpenBuffer()
+    for customer_id in (1, 2, 3, 99):  # 3 已開啟過、99 不是收件人
+        buffer.record(campaign_id, customer_id)
+    assert await buffer.flush() == 4 and not buffer._hits
+
+    opened = dict((await db.execute(select(CampaignRecipient.customer_id, CampaignRecipient.opened_at).execution_options(populate_existing=True))).all())
+    assert opened[1] is not None and opened[2] is not None
+    assert bucket_of(opened[3]) == bucket_of(earlier)
+    bucket = bucket_of(opened[1])
+    assert await _engagement(db) == {(campaign_id, bucket, "甲公司"): (0, 1), (campaign_id, bucket, OTHER_COMPANY): (0, 1)}
+
+    # 重複開啟不會重複計算
+    buffer.record(campaign_id, 1)
+    await buffer.flush()
+    assert await _engagement(db) == {(campaign_id, bucket, "甲公司"): (0, 1), (campaign_id, bucket, OTHER_COMPANY): (0, 1)}
+
+async def test_failed_flush_keeps_buffer_bounded(db, monkeypatch):
+    buffer = OpenBuffer(max_size=3)
+
+    async def fail(db, hits):
+        # 寫回期間又有新的開啟
+        buffer.record(1, 1)
+        buffer.record(1, 4)
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(tracking, "_flush_portable", fail)
+    for customer_id in (1, 2, 3):
+        buffer.record(1, customer_id)
+    first = dict(buffer._hits)
+    assert await buffer.flush() == 0
+    # 放回時保留較早的時間，超過上限的丟棄
+    assert buffer._hits == {(1, 1): first[(1, 1)], (1, 4): buffer._hits[(1, 4)], (1, 2): first[(1, 2)]}
+    assert buffer.dropped == 1
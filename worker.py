@@ -0,0 +1,12 @@
+import asyncio
+import os
+import time
+
+# 與 API 行程相同的時區設定
+os.environ['TZ'] = 'Asia/Taipei'
+if hasattr(time, 'tzset'):
+    time.tzset()
+
+if __name__ == "__main__":
+    from app.worker import run
+    asyncio.run(run())